@@ -0,0 +1,47 @@
+"""
+Runs the benchmark suite against a stubbed frappe module, so no bench, site
+or database is needed, and optionally writes the results as JSON for
+comparison between releases with `python -m benchmarks.compare`.
+
+Run from the repository root:
+
+    python -m benchmarks --json results.json
+    python -m benchmarks --quick --only wrappers scrape
+"""
+
+import argparse
+import importlib
+
+from benchmarks.harness import print_results, write_results
+
+SUITES = ("label_cache", "wrappers", "update_metric", "scrape")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Frappe Exporter benchmarks")
+    parser.add_argument("--json", metavar="PATH", help="Write machine-readable results to PATH")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations and smaller registries")
+    parser.add_argument("--only", nargs="+", choices=SUITES, help="Benchmarks to run (default: all)")
+    parser.add_argument(
+        "--series", type=int, nargs="+", help="Series counts for the scrape benchmark, e.g. 10000 100000 1000000"
+    )
+    args = parser.parse_args()
+
+    benchmarks = {}
+    for suite in args.only or SUITES:
+        module = importlib.import_module(f"benchmarks.{suite}")
+        if suite == "scrape":
+            results = module.run(quick=args.quick, series_counts=args.series)
+        else:
+            results = module.run(quick=args.quick)
+        for name, cases in results.items():
+            print_results(name, cases)
+            benchmarks[name] = cases
+
+    if args.json:
+        write_results(args.json, benchmarks)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
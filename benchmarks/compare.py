@@ -0,0 +1,77 @@
+"""
+Compares two result files written by `python -m benchmarks --json`, e.g. the
+last release against the current tree:
+
+    python -m benchmarks.compare baseline.json results.json [--threshold 10]
+
+Prints the relative change of every measure present in both files, marking
+changes beyond the threshold (in percent) as better or worse. Exits with
+status 1 if any measure got worse beyond it.
+"""
+
+import argparse
+import json
+import sys
+
+# Measures where a larger value is an improvement; for all others smaller is better
+HIGHER_IS_BETTER = ("calls_per_second",)
+# Descriptive measures that are not compared
+INFORMATIONAL = ("samples",)
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _flatten(benchmarks):
+    for name, cases in benchmarks.items():
+        for case, measures in cases.items():
+            for measure, value in measures.items():
+                yield (name, case, measure), value
+
+
+def compare(baseline, current, threshold):
+    """Returns (rows, regressions); rows are (key, old, new, change %, verdict)."""
+    old_values = dict(_flatten(baseline["benchmarks"]))
+    rows = []
+    regressions = 0
+    for key, new in _flatten(current["benchmarks"]):
+        old = old_values.get(key)
+        measure = key[2]
+        if old is None or measure in INFORMATIONAL or not old:
+            continue
+        change = (new - old) / abs(old) * 100
+        improved = change > 0 if measure in HIGHER_IS_BETTER else change < 0
+        verdict = ""
+        if abs(change) >= threshold:
+            verdict = "better" if improved else "WORSE"
+            regressions += not improved
+        rows.append((key, old, new, change, verdict))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Compare benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as significant")
+    args = parser.parse_args()
+
+    baseline = _load(args.baseline)
+    current = _load(args.current)
+    for label, data in (("baseline", baseline), ("current", current)):
+        env = data.get("environment", {})
+        print(f"{label:<9} {env.get('git_commit')} ({env.get('frappe_exporter')}), Python {env.get('python')}, {env.get('timestamp')}")
+
+    rows, regressions = compare(baseline, current, args.threshold)
+    for (name, case, measure), old, new, change, verdict in rows:
+        print(f"{name:<20} {case:<40} {measure:<22} {old:>14.6g} {new:>14.6g} {change:+8.1f}% {verdict}")
+
+    if regressions:
+        print(f"{regressions} measures got worse by more than {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Minimal stand-in for the `frappe` module so the exporter can be imported and
+benchmarked without a bench, site or database.
+
+Call `install()` before importing anything from `frappe_exporter`.
+"""
+
+import sys
+import threading
+import types
+
+
+class _dict(dict):
+    def __getattr__(self, key):
+        return self.get(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class _Local(threading.local):
+    site = "bench.localhost"
+
+
+class _Cache:
+    def __init__(self):
+        self._values = {}
+
+    def get_value(self, key, *args, **kwargs):
+        return self._values.get(key)
+
+    def set_value(self, key, value, *args, **kwargs):
+        self._values[key] = value
+
+    def delete_key(self, key):
+        self._values.pop(key, None)
+
+
+class _DB:
+    def __init__(self, singles, tables):
+        self._singles = singles
+        # Child table doctype -> list of row dicts
+        self._tables = tables
+
+    def exists(self, *args, **kwargs):
+        return True
+
+    def get_singles_dict(self, doctype, *args, **kwargs):
+        return _dict(self._singles.get(doctype, {}))
+
+    def get_values(self, doctype, filters=None, fieldname="name", as_dict=False, **kwargs):
+        rows = self._tables.get(doctype, [])
+        if as_dict:
+            return [_dict(row) for row in rows]
+        fields = [fieldname] if isinstance(fieldname, str) else fieldname
+        return [tuple(row.get(field) for field in fields) for row in rows]
+
+    def sql(self, query, *args, **kwargs):
+        return []
+
+
+def _whitelist(*args, **kwargs):
+    def decorator(fn):
+        return fn
+
+    return decorator
+
+
+def _get_doc(*args, **kwargs):
+    doctype = args[0] if args else kwargs.get("doctype")
+    if isinstance(doctype, dict):
+        doctype = doctype.get("doctype")
+    return _dict(doctype=doctype, name=args[1] if len(args) > 1 else None)
+
+
+def _get_list(*args, **kwargs):
+    return []
+
+
+def install(settings=None, tables=None):
+    """
+    Registers the stub as `frappe` and returns it. `settings` are the values of
+    Frappe Exporter Settings, `tables` its child table rows by doctype.
+    """
+    existing = sys.modules.get("frappe")
+    if existing is not None:
+        if not getattr(existing, "_is_stub", False):
+            raise RuntimeError("A real frappe module is already imported")
+        return existing
+
+    frappe = types.ModuleType("frappe")
+    frappe._is_stub = True
+    frappe._dict = _dict
+    frappe.local = _Local()
+    frappe.flags = _dict()
+    frappe.conf = _dict()
+    frappe.db = _DB({"Frappe Exporter Settings": dict(settings or {"enabled": 1})}, dict(tables or {}))
+    frappe.request = None
+    _cache = _Cache()
+    frappe.cache = lambda: _cache
+    frappe.whitelist = _whitelist
+    frappe.get_doc = _get_doc
+    frappe.get_list = _get_list
+    frappe.get_all = _get_list
+    frappe.get_hooks = lambda *args, **kwargs: []
+    frappe.generate_hash = lambda *args, **kwargs: "0" * kwargs.get("length", 10)
+
+    exceptions = types.ModuleType("frappe.exceptions")
+    for name in (
+        "ValidationError",
+        "DuplicateEntryError",
+        "LinkValidationError",
+        "DocstatusTransitionError",
+        "UpdateAfterSubmitError",
+        "DocumentLockedError",
+        "PermissionError",
+        "AuthenticationError",
+        "SessionExpired",
+        "CSRFTokenError",
+        "QueryTimeoutError",
+        "QueryDeadlockError",
+        "TooManyRequestsError",
+        "TooManyWritesError",
+        "QueueOverloaded",
+        "OutgoingEmailError",
+        "SessionStopped",
+        "InReadOnlyMode",
+        "SessionBootFailed",
+        "ImproperDBConfigurationError",
+    ):
+        setattr(exceptions, name, type(name, (Exception,), {}))
+    frappe.exceptions = exceptions
+
+    sys.modules["frappe"] = frappe
+    sys.modules["frappe.exceptions"] = exceptions
+    return frappe
+
+
+def configure(settings=None, tables=None):
+    """
+    Replaces the exporter settings (and child tables, if given) of the
+    installed stub and drops the cached settings snapshot, so the next
+    instrumented call sees them.
+    """
+    from frappe_exporter.settings import drop_site_settings
+
+    frappe = sys.modules["frappe"]
+    frappe.db._singles["Frappe Exporter Settings"] = dict(settings or {"enabled": 1})
+    if tables is not None:
+        frappe.db._tables = dict(tables)
+    drop_site_settings(frappe.local.site)
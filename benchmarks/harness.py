@@ -0,0 +1,80 @@
+"""
+Timing helpers and the machine-readable result format shared by the
+benchmarks.
+
+Results are written as JSON:
+
+    {"environment": {...}, "benchmarks": {"<benchmark>": {"<case>": {"<measure>": value}}}}
+
+Measure names carry their unit (`ns_per_call`, `calls_per_second`,
+`seconds`, `bytes`) so `python -m benchmarks.compare` knows which direction
+is better.
+"""
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import timeit
+
+
+def ns_per_call(fn, calls, repeat=5):
+    """Best of `repeat` runs of `fn` called `calls` times, in nanoseconds per call."""
+    fn()  # warm up: create label children, load settings
+    seconds = min(timeit.repeat(fn, number=calls, repeat=repeat))
+    return seconds / calls * 1e9
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    from importlib.metadata import PackageNotFoundError, version
+
+    import frappe_exporter
+
+    try:
+        prometheus_client_version = version("prometheus_client")
+    except PackageNotFoundError:
+        prometheus_client_version = None
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "frappe_exporter": frappe_exporter.__version__,
+        "git_commit": _git_commit(),
+        "prometheus_client": prometheus_client_version,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path, benchmarks):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "benchmarks": benchmarks}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def _format(value):
+    if isinstance(value, float) and abs(value) < 100:
+        return f"{value:.4g}"
+    return f"{value:,.0f}"
+
+
+def print_results(name, results):
+    print(name)
+    for case, measures in results.items():
+        values = ", ".join(f"{measure} {_format(value)}" for measure, value in measures.items())
+        print(f"  {case:<40} {values}")
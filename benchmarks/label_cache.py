@@ -0,0 +1,54 @@
+"""
+Per-call cost of resolving a built-in metric's label child, comparing
+`metric.labels(site=..., doctype=..., status=...)` with the LabelCache used by
+the get_doc/get_list wrappers.
+
+Run from the repository root:
+
+    python -m benchmarks.label_cache
+"""
+
+from benchmarks import frappe_stub
+from benchmarks.harness import ns_per_call, print_results
+
+frappe_stub.install()
+
+from frappe_exporter.label_cache import LabelCache
+from frappe_exporter.metrics_handler import GET_DOC_DURATION_SECONDS, GET_DOC_TOTAL
+
+NUMBER = 200_000
+SITE = "bench.localhost"
+DOCTYPES = [f"DocType {i}" for i in range(20)]
+
+
+def run(quick=False):
+    total_cache = LabelCache(GET_DOC_TOTAL)
+    duration_cache = LabelCache(GET_DOC_DURATION_SECONDS)
+
+    def uncached():
+        for doctype in DOCTYPES:
+            GET_DOC_TOTAL.labels(site=SITE, doctype=doctype, status="success").inc()
+            GET_DOC_DURATION_SECONDS.labels(site=SITE, doctype=doctype).observe(0.01)
+
+    def cached():
+        for doctype in DOCTYPES:
+            total_cache.get(SITE, doctype, "success").inc()
+            duration_cache.get(SITE, doctype).observe(0.01)
+
+    calls = (NUMBER // 10 if quick else NUMBER) // len(DOCTYPES)
+    results = {}
+    for name, fn in (("labels()", uncached), ("LabelCache", cached)):
+        # Each call of fn makes one instrumented call per doctype
+        results[name] = {"ns_per_call": ns_per_call(fn, calls) / len(DOCTYPES)}
+    return {"label_cache": results}
+
+
+def main():
+    results = run()["label_cache"]
+    print_results("label_cache", results)
+    speedup = results["labels()"]["ns_per_call"] / results["LabelCache"]["ns_per_call"]
+    print(f"  speedup {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
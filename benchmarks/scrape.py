@@ -0,0 +1,122 @@
+"""
+Scrape cost against series count: serialization time in each exposition
+format, peak memory while serializing, payload size, and the end-to-end time
+of the api.metrics endpoint.
+
+Nine in ten series are get_doc counter children and one in ten are get_doc
+duration histogram children, all for one site. Needs werkzeug, which is
+installed with frappe.
+
+Run from the repository root:
+
+    python -m benchmarks.scrape [--series 10000 100000 1000000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks import frappe_stub
+from benchmarks.harness import print_results
+
+frappe = frappe_stub.install()
+
+from frappe_exporter import api
+from frappe_exporter.exposition import FORMATS, ClassicView
+from frappe_exporter.label_cache import label_cache_for
+from frappe_exporter.metrics_handler import APP_REGISTRY, GET_DOC_DURATION_SECONDS, GET_DOC_TOTAL
+
+SERIES_COUNTS = (10_000, 100_000)
+QUICK_SERIES_COUNTS = (1_000, 10_000)
+
+
+def _populate(series):
+    for metric in (GET_DOC_TOTAL, GET_DOC_DURATION_SECONDS):
+        metric.clear()
+        label_cache_for(metric).clear()
+
+    site = frappe.local.site
+    histograms = series // 10
+    for i in range(series - histograms):
+        GET_DOC_TOTAL.labels(site, f"DocType {i}", "success").inc()
+    for i in range(histograms):
+        GET_DOC_DURATION_SECONDS.labels(site, f"DocType {i}").observe(0.02)
+    gc.collect()
+
+
+def _best_time(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _peak_memory(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _series_memory(series):
+    tracemalloc.start()
+    try:
+        _populate(series)
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def run(quick=False, series_counts=None):
+    series_counts = series_counts or (QUICK_SERIES_COUNTS if quick else SERIES_COUNTS)
+    frappe_stub.configure({"enabled": 1})
+    results = {}
+
+    for series in series_counts:
+        # Few repeats for large registries; a single scrape already takes seconds
+        repeat = 3 if series <= 100_000 else 1
+        held = _series_memory(series)
+        samples = sum(len(metric.samples) for metric in APP_REGISTRY.collect())
+
+        for fmt, (_content_type, serializer) in FORMATS.items():
+            registry = APP_REGISTRY if fmt == "protobuf" else ClassicView(APP_REGISTRY)
+            seconds, body = _best_time(lambda: serializer(registry), repeat)
+            results[f"{series} series {fmt}"] = {
+                "seconds": seconds,
+                "peak_bytes": _peak_memory(lambda: serializer(registry)),
+                "payload_bytes": len(body),
+                "samples": samples,
+                "series_memory_bytes": held,
+            }
+
+        seconds, response = _best_time(api.metrics, repeat)
+        results[f"{series} series api.metrics"] = {
+            "seconds": seconds,
+            "peak_bytes": _peak_memory(api.metrics),
+            "payload_bytes": len(response.get_data()),
+        }
+
+    for metric in (GET_DOC_TOTAL, GET_DOC_DURATION_SECONDS):
+        metric.clear()
+        label_cache_for(metric).clear()
+    return {"scrape": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--series", type=int, nargs="+", help="Series counts to measure")
+    args = parser.parse_args()
+    for name, results in run(series_counts=args.series).items():
+        print_results(name, results)
+
+
+if __name__ == "__main__":
+    main()
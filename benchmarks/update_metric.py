@@ -0,0 +1,96 @@
+"""
+Throughput of the custom metric API: update_metric, bind_metric handles and
+update_metrics_bulk, for each custom metric type.
+
+Run from the repository root:
+
+    python -m benchmarks.update_metric
+"""
+
+from benchmarks import frappe_stub
+from benchmarks.harness import ns_per_call, print_results
+
+frappe_stub.install()
+
+from frappe_exporter import bind_metric, update_metric, update_metrics_bulk
+from frappe_exporter.recorder import finish_request_accumulator, start_request_accumulator
+
+CALLS = 100_000
+CUSTOMERS = [f"CUST-{i:04d}" for i in range(20)]
+
+CUSTOM_METRICS = [
+    {"metric_name": "bench_invoices_total", "metric_type": "Counter", "label_names": "customer"},
+    {"metric_name": "bench_queue_depth", "metric_type": "Gauge", "label_names": "customer"},
+    {"metric_name": "bench_invoice_seconds", "metric_type": "Histogram", "label_names": "customer"},
+    {"metric_name": "bench_invoice_native_seconds", "metric_type": "Native Histogram", "label_names": "customer"},
+    {"metric_name": "bench_invoice_sketch_seconds", "metric_type": "Sketch Summary", "label_names": "customer"},
+]
+
+
+def _configure():
+    rows = [dict(row, help_text="Benchmark metric", quantiles="", idx=i) for i, row in enumerate(CUSTOM_METRICS)]
+    frappe_stub.configure({"enabled": 1}, {"Prometheus Custom Metric": rows})
+
+
+def _result(ns):
+    return {"ns_per_call": ns, "calls_per_second": 1e9 / ns}
+
+
+def run(quick=False):
+    calls = (CALLS // 10 if quick else CALLS) // len(CUSTOMERS)
+    _configure()
+    results = {}
+
+    for row in CUSTOM_METRICS:
+        metric_name = row["metric_name"]
+        labels = [{"customer": customer} for customer in CUSTOMERS]
+
+        def direct():
+            for label in labels:
+                update_metric(metric_name, 0.25, labels=label)
+
+        results[f"update_metric {row['metric_type']}"] = _result(ns_per_call(direct, calls) / len(CUSTOMERS))
+
+    metric_name = "bench_invoices_total"
+    labels = [{"customer": customer} for customer in CUSTOMERS]
+
+    def in_request():
+        for label in labels:
+            update_metric(metric_name, 1.0, labels=label)
+
+    start_request_accumulator()
+    try:
+        results["update_metric Counter in request"] = _result(
+            ns_per_call(in_request, calls) / len(CUSTOMERS)
+        )
+    finally:
+        finish_request_accumulator()
+
+    handles = [bind_metric(metric_name, customer=customer) for customer in CUSTOMERS]
+
+    def bound():
+        for handle in handles:
+            handle.inc()
+
+    results["bind_metric Counter"] = _result(ns_per_call(bound, calls) / len(CUSTOMERS))
+
+    batch = [(metric_name, 1.0, label) for label in labels] * 50
+
+    def bulk():
+        update_metrics_bulk(batch)
+
+    results["update_metrics_bulk Counter"] = _result(
+        ns_per_call(bulk, max(1, calls // 50)) / len(batch)
+    )
+
+    frappe_stub.configure({"enabled": 1}, {})
+    return {"update_metric": results}
+
+
+def main():
+    for name, results in run().items():
+        print_results(name, results)
+
+
+if __name__ == "__main__":
+    main()
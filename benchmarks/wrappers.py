@@ -0,0 +1,145 @@
+"""
+Time the get_doc/get_list wrappers add to each call, and how calls hold up
+when many threads of one worker make them at once.
+
+The stubbed get_doc/get_list return immediately, so the measured time is
+almost entirely the exporter's bookkeeping.
+
+Run from the repository root:
+
+    python -m benchmarks.wrappers
+"""
+
+import threading
+import time
+
+from benchmarks import frappe_stub
+from benchmarks.harness import ns_per_call, print_results
+
+frappe_stub.install()
+
+import frappe
+
+import frappe_exporter  # applies the overrides
+from frappe_exporter import overrides
+from frappe_exporter.recorder import finish_request_accumulator, start_request_accumulator
+
+CALLS = 100_000
+CALLS_PER_THREAD = 20_000
+THREAD_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+DOCTYPES = [f"DocType {i}" for i in range(20)]
+
+
+def _cycle(call):
+    # One call per doctype, so label children are spread like real traffic
+    def fn():
+        for doctype in DOCTYPES:
+            call(doctype)
+
+    return fn
+
+
+def _per_call(fn, calls):
+    return ns_per_call(fn, max(1, calls // len(DOCTYPES))) / len(DOCTYPES)
+
+
+def overhead(quick=False):
+    calls = CALLS // 10 if quick else CALLS
+    original_get_doc = overrides._original_get_doc
+    original_get_list = overrides._original_get_list
+
+    def get_doc(doctype):
+        frappe.get_doc(doctype, "name")
+
+    def get_list(doctype):
+        frappe.get_list(doctype, fields=["name"], filters={"status": "Open"})
+
+    results = {}
+
+    frappe_stub.configure({"enabled": 1})
+    get_doc_baseline = _per_call(_cycle(lambda d: original_get_doc(d, "name")), calls)
+    get_list_baseline = _per_call(
+        _cycle(lambda d: original_get_list(d, fields=["name"], filters={"status": "Open"})), calls
+    )
+    results["get_doc uninstrumented"] = {"ns_per_call": get_doc_baseline}
+    results["get_list uninstrumented"] = {"ns_per_call": get_list_baseline}
+
+    def measure(case, call, baseline):
+        value = _per_call(_cycle(call), calls)
+        results[case] = {"ns_per_call": value, "overhead_ns_per_call": value - baseline}
+
+    measure("get_doc", get_doc, get_doc_baseline)
+    measure("get_list", get_list, get_list_baseline)
+
+    # Inside a request updates go to the per-request accumulator
+    start_request_accumulator()
+    try:
+        measure("get_doc in request", get_doc, get_doc_baseline)
+    finally:
+        finish_request_accumulator()
+
+    frappe_stub.configure({"enabled": 1, "sample_every": 10})
+    measure("get_doc sampled 1 in 10", get_doc, get_doc_baseline)
+
+    frappe_stub.configure({"enabled": 1, "buffered_recording": 1})
+    measure("get_doc buffered", get_doc, get_doc_baseline)
+
+    # Whitelisting on and none of the doctypes listed: the cheapest instrumented path
+    frappe_stub.configure(
+        {"enabled": 1, "whitelisting_enabled": 1},
+        {"Whitelisted Doctype": [{"doctype_name": "Other"}]},
+    )
+    measure("get_doc not whitelisted", get_doc, get_doc_baseline)
+
+    frappe_stub.configure({"enabled": 1}, {})
+    return results
+
+
+def _run_threads(call, thread_count, calls_per_thread):
+    barrier = threading.Barrier(thread_count + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(calls_per_thread):
+            call(DOCTYPES[i % len(DOCTYPES)])
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def contention(quick=False):
+    """Throughput of get_doc with 1 to 64 threads calling it concurrently."""
+    calls_per_thread = CALLS_PER_THREAD // 10 if quick else CALLS_PER_THREAD
+    original_get_doc = overrides._original_get_doc
+    frappe_stub.configure({"enabled": 1})
+
+    results = {}
+    for thread_count in THREAD_COUNTS:
+        total_calls = thread_count * calls_per_thread
+        baseline = _run_threads(lambda d: original_get_doc(d, "name"), thread_count, calls_per_thread)
+        elapsed = _run_threads(lambda d: frappe.get_doc(d, "name"), thread_count, calls_per_thread)
+        results[f"{thread_count} threads"] = {
+            "calls_per_second": total_calls / elapsed,
+            "ns_per_call": elapsed / total_calls * 1e9,
+            "overhead_ns_per_call": (elapsed - baseline) / total_calls * 1e9,
+        }
+    return results
+
+
+def run(quick=False):
+    return {"wrapper_overhead": overhead(quick), "wrapper_contention": contention(quick)}
+
+
+def main():
+    for name, results in run().items():
+        print_results(name, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,13 @@ __version__ = "0.0.1"
 
 import logging
 
+# Multiprocess mode must be configured before any metric is created.
+from .multiprocess import configure_multiprocess
+
+configure_multiprocess()
+
 # --- Public API ---
-from .utils import update_metric
+from .utils import bind_metric, update_metric, update_metrics_bulk
 
 logger: logging.Logger = logging.getLogger("frappe_exporter.init")
 logger.info("Frappe Prometheus Exporter App is loading...")
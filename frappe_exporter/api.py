@@ -1,19 +1,58 @@
 import frappe
-from prometheus_client import generate_latest
 from werkzeug.wrappers import Response
-from .metrics_handler import get_registry
+from .exposition import SiteView, get_scrape_payload
+from .metrics_handler import get_exposition_registry, run_housekeeping
+from .multiprocess import compact_dead_process_files, is_multiprocess_enabled
+from .profiler import get_profiler, render_collapsed, render_pprof
+from .recorder import flush_buffers
+from .settings import get_site_settings
+from .slow_calls import SLOW_CALLS
+
+
+def _prepare_exposition_registry():
+    run_housekeeping()
+    registry = get_exposition_registry()
+
+    # Apply observations still queued by buffered recording in this process
+    flush_buffers()
+
+    # Fold files of recycled workers into the archive before reading them (rate limited)
+    if is_multiprocess_enabled():
+        compact_dead_process_files()
+
+    return registry
 
 
 @frappe.whitelist(allow_guest=True)
-def metrics():
-    # Generate the Prometheus formatted text (bytes)
-    prometheus_data_bytes = generate_latest(get_registry())
+def metrics(all_sites=0):
+    # Only this site's series are exposed, unless a System Manager asks for the
+    # bench-wide view of all sites (also served by `bench frappe-exporter serve`).
+    site = frappe.local.site
+    headers = frappe.request.headers if frappe.request else {}
+    ttl = get_site_settings().values.get("scrape_cache_ttl") or 0
+
+    get_registry = lambda: SiteView(_prepare_exposition_registry(), site)  # noqa: E731
+    scope = site
+    if all_sites and int(all_sites):
+        frappe.only_for("System Manager")
+        get_registry = _prepare_exposition_registry
+        scope = ("all_sites",)
+
+    # Serialized in the negotiated format (and optionally gzipped), cached for `ttl` seconds
+    payload = get_scrape_payload(
+        get_registry,
+        accept=headers.get("Accept"),
+        accept_encoding=headers.get("Accept-Encoding"),
+        ttl=float(ttl),
+        scope=scope,
+    )
 
     # Create a Werkzeug Response object
     response = Response(
-        response=prometheus_data_bytes,
+        response=payload.body,
         status=200,
-        mimetype="text/plain; version=0.0.4; charset=utf-8",
+        content_type=payload.content_type,
+        headers=payload.headers,
     )
 
     # Return this Werkzeug Response object directly.
@@ -35,3 +74,42 @@ def get_custom_doctypes():
         order_by="name",
     )
     return [d.name for d in custom_doctypes]
+
+
+@frappe.whitelist()
+def get_slow_calls(limit=None):
+    """
+    Returns this site's slowest get_doc/get_list/database call signatures
+    recorded by the process serving this request, slowest first.
+    """
+    frappe.only_for("System Manager")
+    return SLOW_CALLS.top(int(limit) if limit else None, site=frappe.local.site)
+
+
+@frappe.whitelist()
+def get_profile(format="collapsed", reset=0):
+    """
+    Returns this site's stacks sampled by the profiler of the process serving
+    the request: collapsed stack lines (flamegraph.pl, speedscope) or a
+    gzipped pprof profile (`format=pprof`). `reset=1` clears them afterwards.
+    """
+    frappe.only_for("System Manager")
+    profiler = get_profiler()
+    if profiler is None:
+        frappe.throw("The sampling profiler is not running in this process")
+
+    site = frappe.local.site
+    stacks, _functions = profiler.snapshot(site)
+    if reset and int(reset):
+        profiler.reset(site)
+
+    if format == "pprof":
+        return Response(
+            response=render_pprof(stacks, profiler.frames, profiler.hz, profiler.started_at),
+            status=200,
+            content_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{site}.pb.gz"'},
+        )
+    if format != "collapsed":
+        frappe.throw(f"Unsupported profile format '{format}', expected 'collapsed' or 'pprof'")
+    return Response(response=render_collapsed(stacks), status=200, content_type="text/plain; charset=utf-8")
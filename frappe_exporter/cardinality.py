@@ -0,0 +1,104 @@
+import os
+import sys
+
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
+
+from .label_cache import get_label_caches
+from .sketch import DDSketch
+
+
+def _exported_name(metric):
+    if metric._type == "counter":
+        return metric._name + "_total"
+    return metric._name
+
+
+def _child_size(child):
+    # Approximate bytes held by one child: the object, its attribute dict and
+    # its value holders. Attributes shared with the parent are not counted.
+    size = sys.getsizeof(child) + sys.getsizeof(vars(child))
+    for name, value in vars(child).items():
+        if name in ("_labelnames", "_labelvalues", "_kwargs", "_documentation", "_name", "_unit"):
+            continue
+        if isinstance(value, list):
+            size += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+        elif isinstance(value, dict):
+            # Sparse buckets of native histograms
+            size += sys.getsizeof(value) + len(value) * (sys.getsizeof(0) + sys.getsizeof(0.0))
+        elif isinstance(value, DDSketch):
+            size += sys.getsizeof(value)
+        elif hasattr(value, "get") and hasattr(value, "set"):
+            size += sys.getsizeof(value)
+    return size
+
+
+class SeriesCollector:
+    """
+    Reports the live series of every metric in this process, per site, with a
+    memory estimate, and how many label sets were folded into overflow series.
+    Series limits apply per process, so every series carries the pid.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        pid = str(os.getpid())
+        series = GaugeMetricFamily(
+            "frappe_exporter_series",
+            "Live label children per metric and site in this process",
+            labels=["metric", "site", "pid"],
+        )
+        memory = GaugeMetricFamily(
+            "frappe_exporter_series_memory_bytes",
+            "Estimated memory held by the label children of each metric in this process",
+            labels=["metric", "pid"],
+        )
+        registry_series = GaugeMetricFamily(
+            "frappe_exporter_registry_series",
+            "Live label children across all metrics in this process",
+            labels=["pid"],
+        )
+        overflowed = CounterMetricFamily(
+            "frappe_exporter_series_overflow",
+            "Label sets recorded into the __overflow__ series after a metric reached its series limit",
+            labels=["metric", "site", "pid"],
+        )
+
+        series_counts = {}
+        memory_bytes = {}
+        overflow_counts = {}
+        for cache in get_label_caches():
+            metric = cache.metric
+            name = _exported_name(metric)
+            site_index = cache._site_index
+
+            with metric._lock:
+                children = list(metric._metrics.items())
+            if not children:
+                continue
+
+            child_size = _child_size(children[0][1])
+            total = memory_bytes.get(name, 0)
+            for labelvalues, _child in children:
+                site = labelvalues[site_index] if site_index is not None else ""
+                series_counts[(name, site)] = series_counts.get((name, site), 0) + 1
+                total += child_size + sys.getsizeof(labelvalues) + sum(sys.getsizeof(v) for v in labelvalues)
+            memory_bytes[name] = total
+
+            for site, count in list(cache.overflowed.items()):
+                key = (name, site or "")
+                overflow_counts[key] = overflow_counts.get(key, 0) + count
+
+        for (name, site), count in series_counts.items():
+            series.add_metric([name, site, pid], count)
+        registry_series.add_metric([pid], sum(series_counts.values()))
+        for name, size in memory_bytes.items():
+            memory.add_metric([name, pid], size)
+        for (name, site), count in overflow_counts.items():
+            overflowed.add_metric([name, site, pid], count)
+
+        yield series
+        yield memory
+        yield registry_series
+        yield overflowed
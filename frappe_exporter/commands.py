@@ -0,0 +1,31 @@
+import click
+
+
+@click.group("frappe-exporter")
+def frappe_exporter():
+    "Frappe Prometheus Exporter commands"
+
+
+@frappe_exporter.command("serve")
+@click.option("--host", default="127.0.0.1", help="Interface to bind to")
+@click.option("--port", default=9877, type=int, help="Port to listen on")
+@click.option(
+    "--cache-ttl",
+    default=0.0,
+    type=float,
+    help="Seconds to reuse a serialized scrape payload (0 disables caching)",
+)
+def serve(host, port, cache_ttl):
+    "Serve /metrics for the whole bench on a separate port, without going through the Frappe request stack"
+    from frappe_exporter.server import serve as run_server
+
+    try:
+        click.echo(f"Serving bench metrics on http://{host}:{port}/metrics")
+        run_server(host=host, port=port, cache_ttl=cache_ttl)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+commands = [frappe_exporter]
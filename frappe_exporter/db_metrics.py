@@ -0,0 +1,135 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import frappe
+
+from .label_cache import label_cache_for
+from .metrics_handler import DB_QUERIES_TOTAL, DB_QUERY_DURATION_SECONDS, DB_QUERY_ROWS
+from .recorder import get_recorder
+from .settings import get_site_settings
+from .slow_calls import SLOW_CALLS, normalize_query, query_signature
+
+logger = logging.getLogger("frappe_exporter.db_metrics")
+
+_original_sql = None
+
+_db_queries_total = label_cache_for(DB_QUERIES_TOTAL)
+_db_query_duration = label_cache_for(DB_QUERY_DURATION_SECONDS)
+_db_query_rows = label_cache_for(DB_QUERY_ROWS)
+
+QUERY_KINDS = ("select", "insert", "update", "delete")
+UNKNOWN_TABLE = "unknown"
+
+# Parsed (kind, table) per query with its literals replaced, so queries that
+# inline their values instead of passing them as %s parameters share an entry.
+# Queries without literals are their own normalized text, so the usual
+# parameterized query is found without normalizing it.
+QUERY_SHAPE_CACHE_SIZE = 2048
+_query_shapes = OrderedDict()
+_query_shapes_lock = threading.Lock()
+
+_LEADING_COMMENTS = re.compile(r"^\s*(?:(?:/\*.*?\*/|--[^\n]*\n|#[^\n]*\n)\s*)*", re.S)
+_TABLE = r"\s+(`[^`]+`|\"[^\"]+\"|[\w.]+)"
+_TABLE_PATTERNS = {
+    "select": re.compile(r"\bfrom" + _TABLE, re.I),
+    "delete": re.compile(r"\bfrom" + _TABLE, re.I),
+    "insert": re.compile(r"\binto" + _TABLE, re.I),
+    "update": re.compile(r"^\s*update(?:\s+(?:low_priority|ignore))*" + _TABLE, re.I),
+}
+
+
+def parse_query_shape(query):
+    """
+    Returns (kind, table) for a SQL string: the statement kind (select, insert,
+    update, delete or other) and the first table it reads from or writes to.
+    """
+    query = _LEADING_COMMENTS.sub("", query, count=1)
+    kind = query[:6].lower()
+    if kind not in QUERY_KINDS:
+        if query[:4].lower() == "with":
+            kind = "select"
+        else:
+            return ("other", UNKNOWN_TABLE)
+
+    match = _TABLE_PATTERNS[kind].search(query)
+    if not match:
+        return (kind, UNKNOWN_TABLE)
+
+    table = match.group(1).strip('`"')
+    # Schema-qualified names keep only the table part
+    return (kind, table.rsplit(".", 1)[-1])
+
+
+def get_query_shape(query):
+    shape = _query_shapes.get(query)
+    if shape is not None:
+        return shape
+
+    query = normalize_query(query)
+    shape = _query_shapes.get(query)
+    if shape is not None:
+        return shape
+
+    shape = parse_query_shape(query)
+    with _query_shapes_lock:
+        _query_shapes[query] = shape
+        while len(_query_shapes) > QUERY_SHAPE_CACHE_SIZE:
+            _query_shapes.popitem(last=False)
+    return shape
+
+
+def db_sql_wrapper(self, query, *args, **kwargs):
+    if frappe.flags.in_migrate or frappe.flags.in_install or frappe.flags.in_patch:
+        return _original_sql(self, query, *args, **kwargs)
+
+    settings = get_site_settings()
+    if not settings.values.get("db_instrumentation_enabled"):
+        return _original_sql(self, query, *args, **kwargs)
+
+    start_time = time.monotonic()
+    status = "success"
+    result = None
+
+    try:
+        result = _original_sql(self, query, *args, **kwargs)
+        return result
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration_seconds = time.monotonic() - start_time
+        try:
+            site = getattr(frappe.local, "site", None) or "unknown_site"
+            kind, table = get_query_shape(query if isinstance(query, str) else str(query))
+            record = get_recorder(settings)
+            record(_db_queries_total.get(site, kind, table, status), "inc", 1.0)
+            if status == "success":
+                record(_db_query_duration.get(site, kind, table), "observe", duration_seconds)
+                if duration_seconds > SLOW_CALLS.threshold:
+                    SLOW_CALLS.observe(site, "db_" + kind, table, query_signature(query), duration_seconds)
+                if kind == "select" and isinstance(result, list | tuple):
+                    record(_db_query_rows.get(site, kind, table), "observe", len(result))
+        except Exception as e:
+            logger.debug(f"Failed to record database query metrics: {e}")
+
+
+def apply_db_overrides():
+    global _original_sql
+
+    try:
+        from frappe.database.database import Database
+    except ImportError:
+        logger.info("frappe.database not available, skipping database instrumentation")
+        return
+
+    if hasattr(Database.sql, "_instrumented_by_exporter"):
+        return
+
+    _original_sql = Database.sql
+    Database.sql = db_sql_wrapper
+    # Preventing double-wrapping
+    Database.sql._instrumented_by_exporter = True
+    logger.info("Instrumented frappe.db.sql")
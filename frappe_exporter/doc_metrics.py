@@ -0,0 +1,62 @@
+import logging
+import time
+
+import frappe
+
+from .label_cache import label_cache_for
+from .metrics_handler import DOC_EVENT_DURATION_SECONDS
+from .overrides import is_doctype_whitelisted
+from .recorder import get_recorder
+from .settings import get_site_settings
+
+logger = logging.getLogger("frappe_exporter.doc_metrics")
+
+_doc_event_duration = label_cache_for(DOC_EVENT_DURATION_SECONDS)
+
+# (event, perf_counter reading) of the last lifecycle hook run for the document
+_MARK_ATTR = "_frappe_exporter_event_mark"
+
+# Hook that ends a timed phase -> (phase, hooks it may start from). Frappe
+# runs a doctype's own controller method before the doc_events hooks of the
+# same event, so the time between two hooks is the controller code of the
+# second. There is no hook between the database write and on_update or
+# on_cancel, so those phases include the write. The on_trash controller
+# runs before the first delete hook and is not timed; after_delete covers
+# link checks, the delete and the after_delete controller.
+_PHASES = {
+    "validate": ("validate", ("before_validate",)),
+    "before_save": ("before_save", ("validate",)),
+    "on_update": ("on_update", ("before_save", "before_submit", "after_insert")),
+    "on_submit": ("on_submit", ("on_update",)),
+    "on_cancel": ("on_cancel", ("before_cancel",)),
+    "after_delete": ("after_delete", ("on_trash",)),
+}
+
+
+def mark_doc_event(doc, method=None, *args, **kwargs):
+    """doc_events handler for every DocType; `method` is the name of the event being run."""
+    if frappe.flags.in_migrate or frappe.flags.in_install or frappe.flags.in_patch:
+        return
+    doctype = doc.doctype
+    if not is_doctype_whitelisted(doctype):
+        return
+
+    now = time.perf_counter()
+    mark = getattr(doc, _MARK_ATTR, None)
+    if method == "on_change":
+        # Runs last after save, submit and cancel; a later save starts afresh
+        if mark is not None:
+            setattr(doc, _MARK_ATTR, None)
+        return
+    setattr(doc, _MARK_ATTR, (method, now))
+
+    phase = _PHASES.get(method)
+    if phase is None or mark is None or mark[0] not in phase[1]:
+        return
+
+    try:
+        site = getattr(frappe.local, "site", None) or "unknown_site"
+        record = get_recorder(get_site_settings())
+        record(_doc_event_duration.get(site, doctype, phase[0]), "observe", now - mark[1])
+    except Exception as e:
+        logger.debug(f"Failed to record document event metrics: {e}")
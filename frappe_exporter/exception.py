@@ -1,9 +1,12 @@
 import logging
 import frappe
+from .label_cache import label_cache_for
 from .metrics_handler import FRAPPE_EXCEPTIONS_TOTAL
 
 logger = logging.getLogger("frappe_exporter.exception")
 
+_exceptions_total = label_cache_for(FRAPPE_EXCEPTIONS_TOTAL)
+
 # A list of common high-level Frappe exceptions to monitor, refined based
 # on the full list in `frappe.exceptions`. This helps filter out very
 # low-level or purely internal exceptions.
@@ -44,15 +47,14 @@ def get_current_site_for_exception():
 
 # Exports exceptions specifically from the get_doc/get_list wrappers.
 # This remains unchanged to avoid interfering with existing metrics.
-def exportException(e, method_name):
+# `weight` is the sampling factor when only 1 in N calls is inspected.
+def exportException(e, method_name, weight=1):
     logger.debug(f"Exception in wrapped method '{method_name}': {e}")
     exception_type = type(e).__name__
     site = get_current_site_for_exception()
 
     # Increment the counter with 'method_wrapper' as the source
-    FRAPPE_EXCEPTIONS_TOTAL.labels(
-        site=site, exception_type=exception_type, source=method_name
-    ).inc()
+    _exceptions_total.get(site, exception_type, method_name).inc(weight)
 
 
 # Handles exceptions caught by the global `on_error` hook.
@@ -71,6 +73,4 @@ def handle_global_exception(e):
     site = get_current_site_for_exception()
 
     # Increment the counter with 'global_hook' as the source
-    FRAPPE_EXCEPTIONS_TOTAL.labels(
-        site=site, exception_type=exception_type, source="global_hook"
-    ).inc()
+    _exceptions_total.get(site, exception_type, "global_hook").inc()
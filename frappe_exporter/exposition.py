@@ -0,0 +1,222 @@
+import gzip
+import logging
+import threading
+import time
+
+from prometheus_client import generate_latest as generate_text
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as CONTENT_TYPE_OPENMETRICS,
+)
+from prometheus_client.openmetrics.exposition import (
+    generate_latest as generate_openmetrics,
+)
+
+from .protobuf import CONTENT_TYPE_PROTOBUF
+from .protobuf import generate_latest as generate_protobuf
+from .self_metrics import record_scrape
+
+logger = logging.getLogger("frappe_exporter.exposition")
+
+CONTENT_TYPE_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+
+# Exposition formats by name: (content type, serializer)
+FORMATS = {
+    "text": (CONTENT_TYPE_TEXT, generate_text),
+    "openmetrics": (CONTENT_TYPE_OPENMETRICS, generate_openmetrics),
+    "protobuf": (CONTENT_TYPE_PROTOBUF, generate_protobuf),
+}
+
+# Payloads smaller than this are sent uncompressed even if the client accepts gzip
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
+
+class ScrapePayload:
+    __slots__ = ("body", "content_encoding", "content_type")
+
+    def __init__(self, body, content_type, content_encoding=None):
+        self.body = body
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+
+    @property
+    def headers(self):
+        headers = {"Vary": "Accept-Encoding"}
+        if self.content_encoding:
+            headers["Content-Encoding"] = self.content_encoding
+        return headers
+
+
+class SiteView:
+    """
+    Registry view exposing only the series of one site, plus series that are
+    not tied to a site (e.g. RQ queue depth).
+    """
+
+    def __init__(self, registry, site):
+        self._registry = registry
+        self.site = site
+
+    def collect(self):
+        site = self.site
+        for metric in self._registry.collect():
+            samples = [s for s in metric.samples if s.labels.get("site", site) == site]
+            if samples:
+                metric.samples = samples
+                yield metric
+
+
+class ClassicView:
+    """
+    Registry view without native histogram samples. The text formats have no
+    representation for them and would print them as plain samples; the
+    classic `_count`, `_sum` and `_bucket` samples of the same histogram are
+    kept.
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def collect(self):
+        for metric in self._registry.collect():
+            if metric.type == "histogram":
+                metric.samples = [s for s in metric.samples if s.native_histogram is None]
+            yield metric
+
+
+class _SampleCounter:
+    # Counts the samples passing through to the serializer
+    def __init__(self, registry):
+        self._registry = registry
+        self.samples = 0
+
+    def collect(self):
+        for metric in self._registry.collect():
+            self.samples += len(metric.samples)
+            yield metric
+
+
+class _CacheEntry:
+    __slots__ = ("encoded", "expires_at", "payload")
+
+    def __init__(self, payload, expires_at):
+        self.payload = payload
+        self.expires_at = expires_at
+        self.encoded = {}
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def accepts_gzip(accept_encoding):
+    if not accept_encoding:
+        return False
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def negotiate_format(accept):
+    """
+    Picks the exposition format for an Accept header, honouring q-values.
+    Falls back to the text format when nothing supported is requested.
+    """
+    if not accept:
+        return "text"
+
+    best, best_q = "text", 0.0
+    for part in accept.split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        params = dict(p.partition("=")[::2] for p in params)
+        media_type = media_type.lower()
+
+        if media_type == "application/vnd.google.protobuf":
+            if params.get("proto") != "io.prometheus.client.MetricFamily" or params.get(
+                "encoding", "delimited"
+            ) != "delimited":
+                continue
+            name = "protobuf"
+        elif media_type == "application/openmetrics-text":
+            name = "openmetrics"
+        elif media_type in ("text/plain", "*/*", "text/*"):
+            name = "text"
+        else:
+            continue
+
+        try:
+            q = float(params.get("q", 1.0))
+        except ValueError:
+            continue
+        # On equal q the earlier entry wins, as listed by the client
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _serialize(registry, fmt):
+    content_type, serializer = FORMATS[fmt]
+    if fmt != "protobuf":
+        registry = ClassicView(registry)
+    counter = _SampleCounter(registry)
+    start_time = time.perf_counter()
+    body = serializer(counter)
+    record_scrape(fmt, time.perf_counter() - start_time, len(body), counter.samples)
+    return ScrapePayload(body, content_type)
+
+
+def _encode(payload, use_gzip):
+    if not use_gzip or len(payload.body) < GZIP_MIN_SIZE:
+        return payload
+    return ScrapePayload(
+        gzip.compress(payload.body, compresslevel=GZIP_LEVEL), payload.content_type, "gzip"
+    )
+
+
+def get_scrape_payload(get_registry, accept=None, accept_encoding=None, ttl=0, scope="default"):
+    """
+    Returns the serialized exposition as a ScrapePayload, in the format
+    negotiated from the `accept` header.
+
+    `get_registry` is only called when the payload has to be rebuilt, so work
+    done before serialization (flushing buffers, compacting files) is skipped
+    for cached scrapes. With a positive `ttl` the uncompressed and gzipped
+    bodies are kept for that many seconds and shared by every scraper that
+    arrives within the window.
+    """
+    fmt = negotiate_format(accept)
+    use_gzip = accepts_gzip(accept_encoding)
+    encoding_key = "gzip" if use_gzip else "identity"
+
+    if ttl <= 0:
+        return _encode(_serialize(get_registry(), fmt), use_gzip)
+
+    now = time.monotonic()
+    cache_key = (scope, fmt)
+    entry = _cache.get(cache_key)
+    if entry is None or entry.expires_at <= now:
+        with _cache_lock:
+            entry = _cache.get(cache_key)
+            if entry is None or entry.expires_at <= now:
+                # Only one thread per process serializes; the rest wait and reuse it
+                entry = _CacheEntry(_serialize(get_registry(), fmt), time.monotonic() + ttl)
+                _cache[cache_key] = entry
+
+    encoded = entry.encoded.get(encoding_key)
+    if encoded is None:
+        encoded = entry.encoded[encoding_key] = _encode(entry.payload, use_gzip)
+    return encoded
+
+
+def clear_scrape_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -1,11 +1,14 @@
 import frappe
 from frappe.model.document import Document
 import re
+from frappe_exporter.instrumentation import parse_buckets, resolve_path
+from frappe_exporter.settings import invalidate_site_settings
 
 
 class FrappeExporterSettings(Document):
     def validate(self):
         self.validate_custom_metrics()
+        self.validate_instrumented_functions()
 
     def validate_custom_metrics(self):
         metric_name_regex = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
@@ -25,12 +28,31 @@ class FrappeExporterSettings(Document):
                             f"Label name '{label}' in metric '{metric.metric_name}' is invalid. It must contain only letters, numbers, and underscores, and not start with a number."
                         )
 
+    def validate_instrumented_functions(self):
+        for row in self.instrumented_functions:
+            row.function_path = (row.function_path or "").strip()
+            try:
+                resolve_path(row.function_path)
+            except Exception as e:
+                frappe.throw(f"Cannot instrument '{row.function_path}': {e}")
+
+            try:
+                parse_buckets(row.buckets)
+            except ValueError:
+                frappe.throw(
+                    f"Buckets '{row.buckets}' of '{row.function_path}' are invalid. Use comma-separated non-negative numbers, e.g. 0.01, 0.1, 1, 10."
+                )
+
+            if row.label_extractor in ("Argument", "Function") and not (row.label_argument or "").strip():
+                what = "argument" if row.label_extractor == "Argument" else "label function"
+                frappe.throw(f"Enter the {what} that labels calls of '{row.function_path}'.")
+
     def on_update(self):
-        # Clear cache keys to signal that settings have changed.
-        frappe.cache().delete_key("frappe_exporter_custom_metrics")
-        frappe.cache().delete_key("frappe_exporter_whitelisted_doctypes")
+        # Bump the settings version so every process reloads its snapshot and
+        # reconciles custom metrics, without a restart.
+        invalidate_site_settings()
         frappe.msgprint(
-            "Frappe Exporter settings saved. Changes will apply after a server restart or on the next request.",
+            "Frappe Exporter settings saved. Changes will apply to all workers within a few seconds.",
             title="Settings Updated",
             indicator="green",
         )
@@ -11,6 +11,39 @@ api_allowed_methods = {"/api/method/frappe_exporter.api.metrics": ["GET"]}
 # This hook will be called for any unhandled exception during a request.
 on_error = "frappe_exporter.exception.handle_global_exception"
 
+# --- Request Hooks ---
+# Request latency, response size and in-flight requests per route template.
+before_request = ["frappe_exporter.request_metrics.before_request"]
+after_request = ["frappe_exporter.request_metrics.after_request"]
+
+# --- Job Hooks ---
+# Queue wait time, execution duration and outcome of background jobs.
+before_job = ["frappe_exporter.job_metrics.before_job"]
+after_job = ["frappe_exporter.job_metrics.after_job"]
+
+# --- Document Events ---
+# Per-DocType time spent in validate, before_save, on_update, on_submit,
+# on_cancel and after_delete, measured between consecutive lifecycle hooks.
+doc_events = {
+	"*": {
+		event: "frappe_exporter.doc_metrics.mark_doc_event"
+		for event in (
+			"before_validate",
+			"validate",
+			"before_save",
+			"before_submit",
+			"after_insert",
+			"on_update",
+			"on_submit",
+			"before_cancel",
+			"on_cancel",
+			"on_trash",
+			"after_delete",
+			"on_change",
+		)
+	}
+}
+
 # Apps
 # ------------------
 
@@ -0,0 +1,368 @@
+"""
+Instruments the functions listed in the Instrumented Functions table of
+Frappe Exporter Settings, e.g. frappe.model.document.Document.save, with a
+call counter and a duration histogram.
+
+Functions are shared by every site the process serves while the table is
+per site, so a function stays wrapped as long as any loaded site lists it,
+and a call only records when the current site does. Wrappers are built once
+per function and reused when a function is instrumented again.
+"""
+
+import functools
+import hashlib
+import importlib
+import inspect
+import logging
+import threading
+import time
+
+import frappe
+from prometheus_client import Histogram
+
+from .label_cache import label_cache_for, remove_label_children
+from .metrics_handler import APP_REGISTRY, FUNCTION_CALLS_TOTAL
+from .recorder import get_recorder
+from .settings import get_loaded_site_settings, get_site_settings
+
+logger = logging.getLogger("frappe_exporter.instrumentation")
+
+FUNCTION_DURATION_NAME = "frappe_function_duration_seconds"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LABEL_EXTRACTORS = ("None", "DocType", "Argument", "Function")
+UNKNOWN_LABEL = "unknown"
+
+_function_calls = label_cache_for(FUNCTION_CALLS_TOTAL)
+
+# Bucket layout -> duration histogram. Every layout is a separate Histogram
+# with a name of its own, see duration_metric_name.
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+# Dotted path -> InstrumentedFunction, kept after removal so the wrapper is reused
+_functions = {}
+# (path, settings row) -> FunctionSpec
+_specs = {}
+# Site -> settings snapshot the wrapped functions were last reconciled with
+_synced = {}
+_lock = threading.Lock()
+
+
+def parse_buckets(buckets_str):
+    # "0.01, 0.1, 1" -> (0.01, 0.1, 1.0); empty means the defaults
+    if not buckets_str or not buckets_str.strip():
+        return DEFAULT_BUCKETS
+    buckets = tuple(sorted({float(b) for b in buckets_str.split(",") if b.strip()}))
+    if not buckets or buckets[0] < 0:
+        raise ValueError(f"Invalid buckets '{buckets_str}', expected e.g. 0.01, 0.1, 1, 10")
+    return buckets
+
+
+def resolve_path(path):
+    """Returns (owner, attribute) for a dotted path: the module or class holding the function, and its name."""
+    parts = path.split(".")
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            owner = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        for name in parts[i:-1]:
+            owner = getattr(owner, name)
+        if not callable(getattr(owner, parts[-1])):
+            raise TypeError(f"'{path}' is not callable")
+        return owner, parts[-1]
+    raise ImportError(f"No module found for '{path}'")
+
+
+def duration_metric_name(buckets):
+    """
+    Name of the duration histogram for a bucket layout: the default layout is
+    frappe_function_duration_seconds, others frappe_function_duration_<id>_seconds
+    with an id derived from the bounds. Series with different `le` sets cannot
+    be merged into one family, e.g. from the multiprocess files.
+    """
+    if buckets == DEFAULT_BUCKETS:
+        return FUNCTION_DURATION_NAME
+    digest = hashlib.sha1(",".join(repr(bound) for bound in buckets).encode()).hexdigest()[:8]
+    return f"frappe_function_duration_{digest}_seconds"
+
+
+def _duration_histogram(buckets):
+    histogram = _histograms.get(buckets)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.get(buckets)
+            if histogram is None:
+                histogram = _histograms[buckets] = Histogram(
+                    duration_metric_name(buckets),
+                    "Histogram of durations of the functions instrumented in Frappe Exporter Settings",
+                    ["site", "function", "label"],
+                    buckets=buckets,
+                    registry=None,
+                )
+    return histogram
+
+
+class FunctionSpec:
+    """How calls of one instrumented function are labelled and bucketed, per settings row."""
+
+    __slots__ = ("durations", "label")
+
+    def __init__(self, function, row):
+        label_extractor, label_argument, buckets_str = row
+        try:
+            buckets = parse_buckets(buckets_str)
+        except ValueError as e:
+            logger.error(f"{e} for instrumented function '{function.path}', using the defaults")
+            buckets = DEFAULT_BUCKETS
+        self.durations = label_cache_for(_duration_histogram(buckets))
+        self.label = self._label_extractor(function, label_extractor, label_argument)
+
+    @staticmethod
+    def _label_extractor(function, label_extractor, label_argument):
+        # Returns a callable(args, kwargs) -> label, or None to skip the call
+        if label_extractor == "DocType":
+            if function.is_method:
+
+                def doctype_of_self(args, kwargs):
+                    doctype = getattr(args[0], "doctype", None) if args else None
+                    return _whitelisted(doctype or "unknown_doctype")
+
+                return doctype_of_self
+            # overrides imports job_metrics, which imports this module
+            from .overrides import extract_doctype_from_args
+
+            return lambda args, kwargs: _whitelisted(extract_doctype_from_args("", args, kwargs))
+
+        if label_extractor == "Argument":
+            index = None
+            default = None
+            try:
+                parameters = inspect.signature(function.function).parameters
+                if label_argument in parameters:
+                    index = list(parameters).index(label_argument)
+                    if parameters[label_argument].default is not inspect.Parameter.empty:
+                        default = parameters[label_argument].default
+            except (TypeError, ValueError):
+                pass
+
+            def argument(args, kwargs):
+                if label_argument in kwargs:
+                    value = kwargs[label_argument]
+                elif index is not None and index < len(args):
+                    value = args[index]
+                else:
+                    value = default
+                return "" if value is None else str(value)
+
+            return argument
+
+        if label_extractor == "Function":
+            try:
+                extractor = frappe.get_attr(label_argument)
+            except Exception as e:
+                logger.error(f"Cannot load label function '{label_argument}' for '{function.path}': {e}")
+                return lambda args, kwargs: UNKNOWN_LABEL
+
+            def custom(args, kwargs):
+                try:
+                    return str(extractor(args, kwargs))
+                except Exception as e:
+                    logger.debug(f"Label function '{label_argument}' failed: {e}")
+                    return UNKNOWN_LABEL
+
+            return custom
+
+        return lambda args, kwargs: ""
+
+
+def _whitelisted(doctype):
+    return doctype if get_site_settings().is_doctype_whitelisted(doctype) else None
+
+
+def _get_spec(function, row):
+    key = (function.path, row)
+    spec = _specs.get(key)
+    if spec is None:
+        spec = _specs[key] = FunctionSpec(function, row)
+    return spec
+
+
+class InstrumentedFunction:
+    """A function that can be swapped for its wrapper on its module or class and back."""
+
+    __slots__ = (
+        "attr",
+        "function",
+        "had_own_attr",
+        "installed",
+        "is_method",
+        "original",
+        "owner",
+        "path",
+        "wrapper",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.owner, self.attr = resolve_path(path)
+        # The attribute as stored, so staticmethod/classmethod descriptors are
+        # wrapped and restored as such
+        self.original = inspect.getattr_static(self.owner, self.attr)
+        if isinstance(self.original, staticmethod | classmethod):
+            self.function = self.original.__func__
+            self.wrapper = type(self.original)(_make_wrapper(self))
+        else:
+            self.function = self.original
+            self.wrapper = _make_wrapper(self)
+        # Called with self (or cls) as the first argument
+        self.is_method = inspect.isclass(self.owner) and not isinstance(self.original, staticmethod)
+        # Inherited methods are set on the subclass and deleted again on removal
+        self.had_own_attr = self.attr in vars(self.owner)
+        self.installed = False
+
+    def is_current(self):
+        # False once the attribute was replaced, e.g. by a code reload
+        return inspect.getattr_static(self.owner, self.attr, None) in (self.original, self.wrapper)
+
+    def install(self):
+        setattr(self.owner, self.attr, self.wrapper)
+        self.installed = True
+        logger.info(f"Instrumented {self.path}")
+
+    def uninstall(self):
+        # An uninstalled wrapper only passes calls through, in case a reference
+        # to it was taken while it was installed
+        self.installed = False
+        if inspect.getattr_static(self.owner, self.attr, None) is not self.wrapper:
+            logger.warning(f"{self.path} was replaced after it was instrumented, leaving it in place")
+            return
+        if self.had_own_attr:
+            setattr(self.owner, self.attr, self.original)
+        else:
+            delattr(self.owner, self.attr)
+        logger.info(f"Removed instrumentation of {self.path}")
+
+
+def _make_wrapper(instrumented):
+    function = instrumented.function
+    path = instrumented.path
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if frappe.flags.in_migrate or frappe.flags.in_install or frappe.flags.in_patch:
+            return function(*args, **kwargs)
+
+        settings = get_site_settings()
+        row = settings.instrumented_functions.get(path)
+        if row is None or not instrumented.installed:
+            return function(*args, **kwargs)
+
+        spec = _get_spec(instrumented, row)
+        label = spec.label(args, kwargs)
+        if label is None:
+            return function(*args, **kwargs)
+
+        status = "success"
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            duration_seconds = time.perf_counter() - start_time
+            try:
+                site = getattr(frappe.local, "site", None) or "unknown_site"
+                record = get_recorder(settings)
+                record(_function_calls.get(site, path, label, status), "inc", 1.0)
+                if status == "success":
+                    record(spec.durations.get(site, path, label), "observe", duration_seconds)
+            except Exception as e:
+                logger.debug(f"Failed to record metrics of {path}: {e}")
+
+    # Preventing double-wrapping
+    wrapper._instrumented_by_exporter = True
+    return wrapper
+
+
+def _instrument(path):
+    function = _functions.get(path)
+    if function is None or not function.is_current():
+        function = InstrumentedFunction(path)
+        if getattr(function.function, "_instrumented_by_exporter", False):
+            logger.warning(f"{path} is already instrumented by the exporter. Skipping.")
+            return
+        _functions[path] = function
+    if not function.installed:
+        function.install()
+
+
+def _forget_series(site, path):
+    # Drops the site's series of a function that is no longer instrumented or
+    # now uses other buckets, so stale buckets do not linger in the export
+    for metric in [FUNCTION_CALLS_TOTAL, *_histograms.values()]:
+        with metric._lock:
+            stale = [labelvalues for labelvalues in metric._metrics if labelvalues[:2] == (site, path)]
+        remove_label_children(metric, stale)
+
+
+def _reconcile():
+    # Wraps the functions listed by any site this process serves and unwraps
+    # the rest
+    loaded = dict(get_loaded_site_settings())
+    for site in list(_synced):
+        if site not in loaded:
+            del _synced[site]
+
+    desired = set()
+    for settings in loaded.values():
+        desired.update(settings.instrumented_functions)
+
+    for path in desired:
+        try:
+            _instrument(path)
+        except Exception as e:
+            logger.error(f"Cannot instrument '{path}': {e}")
+
+    for path, function in _functions.items():
+        if function.installed and path not in desired:
+            function.uninstall()
+
+
+def sync_instrumentation(settings):
+    """
+    Applies changes to the current site's Instrumented Functions. Cheap on the
+    hot path: snapshots are only replaced when the settings change.
+    """
+    site = getattr(frappe.local, "site", None)
+    if not site or not settings.loaded or _synced.get(site) is settings:
+        return
+    with _lock:
+        previous = _synced.get(site)
+        if previous is settings:
+            return
+        _synced[site] = settings
+        if previous is not None:
+            for path, row in previous.instrumented_functions.items():
+                if settings.instrumented_functions.get(path) != row:
+                    _forget_series(site, path)
+        _reconcile()
+
+
+class FunctionDurationCollector:
+    """Exports the duration histogram of every bucket layout in use."""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        for histogram in list(_histograms.values()):
+            for family in histogram.collect():
+                if family.samples:
+                    yield family
+
+
+# Multiprocess scrapes read the histograms from the shared files instead
+APP_REGISTRY.register(FunctionDurationCollector())
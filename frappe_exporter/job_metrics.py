@@ -0,0 +1,156 @@
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+import frappe
+
+from .instrumentation import sync_instrumentation
+from .label_cache import label_cache_for
+from .metrics_handler import (
+    GET_DOC_CALLS_PER_REQUEST,
+    JOB_DURATION_SECONDS,
+    JOB_WAIT_SECONDS,
+    JOBS_ENQUEUED_TOTAL,
+    JOBS_TOTAL,
+    run_housekeeping,
+)
+from .profiler import tag_current_thread, untag_current_thread
+from .recorder import (
+    finish_request_accumulator,
+    flush_buffers,
+    get_recorder,
+    start_request_accumulator,
+)
+from .settings import get_site_settings
+from .sketch import persist_dirty_sketches
+
+logger = logging.getLogger("frappe_exporter.job_metrics")
+
+_jobs_enqueued_total = label_cache_for(JOBS_ENQUEUED_TOTAL)
+_jobs_total = label_cache_for(JOBS_TOTAL)
+_job_wait = label_cache_for(JOB_WAIT_SECONDS)
+_job_duration = label_cache_for(JOB_DURATION_SECONDS)
+_get_doc_calls = label_cache_for(GET_DOC_CALLS_PER_REQUEST)
+
+_START_ATTR = "frappe_exporter_job_start"
+
+_original_enqueue = None
+
+
+def get_method_name(method):
+    if isinstance(method, str):
+        return method
+    module = getattr(method, "__module__", None) or ""
+    name = getattr(method, "__qualname__", None) or getattr(method, "__name__", None) or repr(method)
+    return f"{module}.{name}" if module else name
+
+
+def _queue_name(qname):
+    # Frappe prefixes queue names with the bench id in Redis ("<bench>:default")
+    return qname.rsplit(":", 1)[-1] if qname else "unknown"
+
+
+def _current_job():
+    try:
+        from rq import get_current_job
+
+        return get_current_job()
+    except Exception:
+        return None
+
+
+def _utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def before_job(method=None, kwargs=None, transaction_type=None):
+    site = getattr(frappe.local, "site", None) or "unknown_site"
+    job = _current_job()
+    queue = _queue_name(getattr(job, "origin", None))
+    method_name = get_method_name(method) if method else "unknown"
+    # A job retried from Frappe's `except` block (a nested execute_job) starts
+    # while the failed attempt's exception is being handled; keep it so
+    # after_job does not take it for this attempt's failure
+    handled = sys.exc_info()[1]
+    setattr(frappe.local, _START_ATTR, (time.monotonic(), site, queue, method_name, handled))
+    sync_instrumentation(get_site_settings())
+    # Metric updates made by the job are merged and applied in after_job
+    start_request_accumulator()
+    tag_current_thread(site, method_name)
+
+    enqueued_at = getattr(job, "enqueued_at", None)
+    if enqueued_at is None:
+        return
+    try:
+        started_at = getattr(job, "started_at", None) or datetime.now(timezone.utc)
+        wait_seconds = (_utc(started_at) - _utc(enqueued_at)).total_seconds()
+        if wait_seconds >= 0:
+            record = get_recorder(get_site_settings())
+            record(_job_wait.get(site, queue, method_name), "observe", wait_seconds)
+    except Exception as e:
+        logger.debug(f"Failed to record job wait time: {e}")
+
+
+def after_job(method=None, kwargs=None, result=None):
+    started = getattr(frappe.local, _START_ATTR, None)
+    if not started:
+        return
+    setattr(frappe.local, _START_ATTR, None)
+
+    start_time, site, queue, method_name, handled = started
+    duration_seconds = time.monotonic() - start_time
+    # Frappe calls after_job from a `finally` block, so a failing job's
+    # exception is still propagating here, unlike one handled before it started
+    exception = sys.exc_info()[1]
+    status = "error" if exception is not None and exception is not handled else "success"
+    accumulator = finish_request_accumulator(get_site_settings())
+    untag_current_thread()
+
+    try:
+        record = get_recorder(get_site_settings())
+        record(_jobs_total.get(site, queue, method_name, status), "inc", 1.0)
+        record(_job_duration.get(site, queue, method_name), "observe", duration_seconds)
+        if accumulator is not None:
+            record(_get_doc_calls.get(site, method_name), "observe", accumulator.get_doc_calls)
+    except Exception as e:
+        logger.debug(f"Failed to record job metrics: {e}")
+
+    # RQ work horses exit with os._exit right after the job, before the
+    # background flusher or sketch persister would run and without atexit
+    # handlers, so apply buffered observations and write sketches now.
+    flush_buffers()
+    persist_dirty_sketches()
+
+    # Only matters for workers that run jobs in-process instead of forking
+    run_housekeeping()
+
+
+def enqueue_wrapper(method, *args, **kwargs):
+    job = _original_enqueue(method, *args, **kwargs)
+
+    if not (frappe.flags.in_migrate or frappe.flags.in_install or frappe.flags.in_patch):
+        try:
+            site = getattr(frappe.local, "site", None) or "unknown_site"
+            queue = kwargs.get("queue") or (args[0] if args and isinstance(args[0], str) else "default")
+            record = get_recorder(get_site_settings())
+            record(_jobs_enqueued_total.get(site, queue, get_method_name(method)), "inc", 1.0)
+        except Exception as e:
+            logger.debug(f"Failed to record enqueued job: {e}")
+
+    return job
+
+
+def apply_enqueue_override():
+    global _original_enqueue
+
+    if not hasattr(frappe, "enqueue") or hasattr(frappe.enqueue, "_instrumented_by_exporter"):
+        return
+
+    _original_enqueue = frappe.enqueue
+    frappe.enqueue = enqueue_wrapper
+    # Preventing double-wrapping
+    frappe.enqueue._instrumented_by_exporter = True
+    logger.info("Instrumented frappe.enqueue")
@@ -0,0 +1,264 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .multiprocess import is_multiprocess_enabled
+from .settings import get_site_settings
+
+# Label value given to every non-site label of the series that absorbs new
+# label sets once a metric reaches its series limit.
+OVERFLOW_LABEL_VALUE = "__overflow__"
+
+SITE_LABEL = "site"
+
+# Overflowed label sets remembered per metric, so repeats skip the limit check
+OVERFLOW_CACHE_SIZE = 256
+
+# Upper bound of resolved children kept per metric, also when no series limit
+# is set. Children evicted from the cache stay in the metric; they are only
+# re-resolved on their next use.
+DEFAULT_MAX_SIZE = 4096
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class LabelCache:
+    """
+    Cache of a metric's label children keyed by the positional label values
+    tuple, e.g. (site, doctype, status), ordered from least to most recently
+    used. It holds at most `maxsize` children, evicting the least recently
+    used; an evicted child is not expired until it is resolved again.
+
+    A hit costs a dict lookup instead of `metric.labels(**kwargs)`, which builds
+    kwargs, validates label names and takes the metric lock.
+
+    New children are also where the series limit is enforced: once a site has
+    created the configured number of series of the metric, further label sets
+    resolve to that site's overflow series instead of a new child. Only the
+    overflow series itself is cached; the label sets mapped to it are kept in
+    a small LRU so unbounded label values cannot grow the cache.
+
+    Because of the ordering, children idle for longer than a TTL sit at the
+    front and `expire` only visits the ones it removes.
+    """
+
+    __slots__ = (
+        "_children",
+        "_last_used",
+        "_limit_names",
+        "_lock",
+        "_overflows",
+        "_site_index",
+        "maxsize",
+        "metric",
+        "overflowed",
+        "series_counts",
+    )
+
+    def __init__(self, metric, maxsize=DEFAULT_MAX_SIZE):
+        self.metric = metric
+        self.maxsize = maxsize
+        self._children = OrderedDict()
+        self._last_used = {}
+        # Overflowed label values -> their overflow label values, least recently used first
+        self._overflows = OrderedDict()
+        self._lock = threading.Lock()
+
+        labelnames = metric._labelnames
+        self._site_index = labelnames.index(SITE_LABEL) if SITE_LABEL in labelnames else None
+        # Limits may be configured under the exported counter name as well
+        self._limit_names = (metric._name,)
+        if metric._type == "counter":
+            self._limit_names += (metric._name + "_total",)
+
+        # site (None for metrics without a site label) -> series created / label sets overflowed
+        self.series_counts = {}
+        self.overflowed = {}
+
+    def get(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is not None:
+            try:
+                self._children.move_to_end(labelvalues)
+                self._last_used[labelvalues] = time.monotonic()
+            except KeyError:
+                # Expired by another thread in between; recreated on the next call.
+                pass
+            return child
+        return self._resolve(labelvalues)
+
+    def _resolve(self, labelvalues):
+        with self._lock:
+            key = self._overflows.get(labelvalues)
+            if key is not None:
+                self._overflows.move_to_end(labelvalues)
+            else:
+                key = labelvalues
+            child = self._children.get(key)
+            if child is None:
+                key, child = self._create(key)
+                self._children[key] = child
+                while len(self._children) > self.maxsize:
+                    evicted, _child = self._children.popitem(last=False)
+                    self._last_used.pop(evicted, None)
+            else:
+                self._children.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+            return child
+
+    def _site_of(self, labelvalues):
+        return labelvalues[self._site_index] if self._site_index is not None else None
+
+    def _is_overflow(self, labelvalues):
+        return all(
+            value == OVERFLOW_LABEL_VALUE
+            for index, value in enumerate(labelvalues)
+            if index != self._site_index
+        )
+
+    def _create(self, labelvalues):
+        # Returns (cache key, child); the key is the overflow label values once
+        # the site is at its limit. Children that already exist in the metric
+        # were counted when created, and overflow series are not counted.
+        if labelvalues not in self.metric._metrics and not self._is_overflow(labelvalues):
+            site = self._site_of(labelvalues)
+            count = self.series_counts.get(site, 0)
+            limit = get_site_settings().series_limit(*self._limit_names)
+            if limit and count >= limit:
+                self.overflowed[site] = self.overflowed.get(site, 0) + 1
+                overflow = tuple(
+                    value if index == self._site_index else OVERFLOW_LABEL_VALUE
+                    for index, value in enumerate(labelvalues)
+                )
+                self._overflows[labelvalues] = overflow
+                if len(self._overflows) > OVERFLOW_CACHE_SIZE:
+                    self._overflows.popitem(last=False)
+                return overflow, self.metric.labels(*overflow)
+            self.series_counts[site] = count + 1
+        return labelvalues, self.metric.labels(*labelvalues)
+
+    def remove(self, *labelvalues):
+        # Removes the child from the metric as well, releasing its slot in the series limit
+        with self._lock:
+            self._remove(labelvalues)
+
+    def _remove(self, labelvalues):
+        self._children.pop(labelvalues, None)
+        self._last_used.pop(labelvalues, None)
+        if self._overflows.pop(labelvalues, None) is not None:
+            # An overflowed label set: only its mapping goes away
+            return
+        try:
+            self.metric.remove(*labelvalues)
+        except KeyError:
+            return
+        site = self._site_of(labelvalues)
+        if not self._is_overflow(labelvalues):
+            count = self.series_counts.get(site, 0)
+            if count > 1:
+                self.series_counts[site] = count - 1
+            else:
+                self.series_counts.pop(site, None)
+        # The site's overflowed label sets get another chance at a series of their own
+        self._forget_overflows(site)
+
+    def _forget_overflows(self, site):
+        if self._site_index is None:
+            self._overflows.clear()
+            return
+        for labelvalues in [lv for lv in self._overflows if lv[self._site_index] == site]:
+            del self._overflows[labelvalues]
+
+    def expire(self, cutoff):
+        """Removes children last used before the monotonic time `cutoff`; returns how many."""
+        expired = 0
+        with self._lock:
+            while self._children:
+                try:
+                    labelvalues = next(iter(self._children))
+                except (RuntimeError, StopIteration):
+                    # Reordered by a concurrent hit; retry from the new front
+                    continue
+                if self._last_used.get(labelvalues, 0.0) >= cutoff:
+                    break
+                self._remove(labelvalues)
+                expired += 1
+        return expired
+
+    def forget_site(self, site):
+        with self._lock:
+            self.series_counts.pop(site, None)
+            self.overflowed.pop(site, None)
+            self._forget_overflows(site)
+
+    def discard(self, *labelvalues):
+        with self._lock:
+            self._children.pop(labelvalues, None)
+            self._last_used.pop(labelvalues, None)
+            self._overflows.pop(labelvalues, None)
+
+    def clear(self):
+        with self._lock:
+            self._children.clear()
+            self._last_used.clear()
+            self._overflows.clear()
+
+    def __len__(self):
+        return len(self._children)
+
+
+def label_cache_for(metric, maxsize=DEFAULT_MAX_SIZE):
+    """Returns the shared LabelCache of `metric`, creating it on first use."""
+    cache = _caches.get(metric)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(metric)
+            if cache is None:
+                cache = _caches[metric] = LabelCache(metric, maxsize)
+    return cache
+
+
+def get_label_caches():
+    return list(_caches.values())
+
+
+def drop_label_cache(metric):
+    # Called when a metric is unregistered so stale children are not reused.
+    with _caches_lock:
+        _caches.pop(metric, None)
+
+
+def remove_label_children(metric, labelvalues_list):
+    """Removes children from `metric`, keeping its label cache and series counts in step."""
+    cache = _caches.get(metric)
+    for labelvalues in labelvalues_list:
+        if cache is not None:
+            cache.remove(*labelvalues)
+            continue
+        try:
+            metric.remove(*labelvalues)
+        except KeyError:
+            pass
+
+
+def expire_stale_series(ttl, gauge_ttl=0):
+    """
+    Removes children not used for `ttl` seconds from every metric, and gauge
+    children not used for `gauge_ttl` seconds. Counters and histograms resume
+    from zero if their labels come back, which rate() treats as a reset; a
+    gauge's last value stays meaningful, so gauges get their own TTL. A TTL of
+    0 disables expiry for that kind. Returns the number of children removed.
+
+    Does nothing in multiprocess mode: a removed child's values stay in the
+    shared files and would still be exported.
+    """
+    if is_multiprocess_enabled():
+        return 0
+    now = time.monotonic()
+    expired = 0
+    for cache in get_label_caches():
+        metric_ttl = gauge_ttl if cache.metric._type == "gauge" else ttl
+        if metric_ttl > 0:
+            expired += cache.expire(now - metric_ttl)
+    return expired
@@ -2,11 +2,50 @@ from prometheus_client import CollectorRegistry, Counter, Histogram, Gauge, Summ
 import logging
 import frappe
 import threading
+import time
+from .label_cache import (
+    SITE_LABEL,
+    drop_label_cache,
+    expire_stale_series,
+    get_label_caches,
+    label_cache_for,
+    remove_label_children,
+)
+from .multiprocess import get_aggregated_registry, is_multiprocess_enabled, read_common_site_config
+from .native_histogram import NativeHistogram
+from .sketch import DEFAULT_QUANTILES, SketchSummary
+from .settings import drop_site_settings, get_loaded_site_settings, get_site_settings
+from .cardinality import SeriesCollector
+from .self_metrics import SelfMetricsCollector
+from .profiler import PROFILER_HZ_CONF_KEY, ProfilerCollector, configure_profiler
+from .slow_calls import SLOW_CALLS, SlowCallCollector
+from .queue_collector import QueueCollector
 
 logger = logging.getLogger("frappe_exporter.metrics_handler")
 
 APP_REGISTRY = CollectorRegistry(auto_describe=True)
 
+# Key in sites/common_site_config.json listing the built-in histograms to
+# export with native (sparse exponential) buckets instead of their fixed ones,
+# e.g. ["frappe_get_doc_duration_seconds"]. Built-in metrics are shared by
+# every site of the bench, so this is a bench-wide choice.
+NATIVE_HISTOGRAMS_CONF_KEY = "frappe_exporter_native_histograms"
+
+
+def _use_native_histogram(name):
+    # Native buckets live in process memory and cannot be merged through the
+    # multiprocess files, so multiprocess mode keeps the classic buckets.
+    if is_multiprocess_enabled():
+        return False
+    return name in (read_common_site_config().get(NATIVE_HISTOGRAMS_CONF_KEY) or ())
+
+
+def _duration_histogram(name, documentation, labelnames, buckets):
+    if _use_native_histogram(name):
+        return NativeHistogram(name, documentation, labelnames, registry=APP_REGISTRY)
+    return Histogram(name, documentation, labelnames, buckets=buckets, registry=APP_REGISTRY)
+
+
 # --- Pre-defined Metrics ---
 
 FRAPPE_EXCEPTIONS_TOTAL = Counter(
@@ -23,12 +62,11 @@ GET_DOC_TOTAL = Counter(
     registry=APP_REGISTRY,
 )
 
-GET_DOC_DURATION_SECONDS = Histogram(
+GET_DOC_DURATION_SECONDS = _duration_histogram(
     "frappe_get_doc_duration_seconds",
     "Histogram of get_doc call durations in seconds",
     ["site", "doctype"],
     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
-    registry=APP_REGISTRY,
 )
 
 GET_LIST_TOTAL = Counter(
@@ -38,129 +76,486 @@ GET_LIST_TOTAL = Counter(
     registry=APP_REGISTRY,
 )
 
-GET_LIST_DURATION_SECONDS = Histogram(
+GET_LIST_DURATION_SECONDS = _duration_histogram(
     "frappe_get_list_duration_seconds",
     "Histogram of get_list call durations in seconds",
     ["site", "doctype"],
     buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# --- HTTP Request Metrics (see request_metrics.py) ---
+
+HTTP_REQUEST_DURATION_SECONDS = Histogram(
+    "frappe_http_request_duration_seconds",
+    "Histogram of HTTP request durations in seconds, by route template",
+    ["site", "route", "method", "status_class"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
     registry=APP_REGISTRY,
 )
 
-# --- Custom Metrics Handling ---
+HTTP_RESPONSE_SIZE_BYTES = Histogram(
+    "frappe_http_response_size_bytes",
+    "Histogram of HTTP response body sizes in bytes, by route template",
+    ["site", "route", "method"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000),
+    registry=APP_REGISTRY,
+)
 
-CUSTOM_METRICS = {}
-_init_lock = threading.Lock()
-_custom_metrics_initialized = False
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "frappe_http_requests_in_flight",
+    "Number of HTTP requests currently being processed",
+    ["site"],
+    multiprocess_mode="livesum",
+    registry=APP_REGISTRY,
+)
+
+GET_DOC_CALLS_PER_REQUEST = Histogram(
+    "frappe_get_doc_calls_per_request",
+    "Histogram of frappe.get_doc calls made by one request or background job",
+    ["site", "handler"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+    registry=APP_REGISTRY,
+)
+
+# --- Background Job Metrics (see job_metrics.py) ---
+
+JOBS_ENQUEUED_TOTAL = Counter(
+    "frappe_jobs_enqueued_total",
+    "Total number of background jobs enqueued through frappe.enqueue",
+    ["site", "queue", "method"],
+    registry=APP_REGISTRY,
+)
+
+JOBS_TOTAL = Counter(
+    "frappe_jobs_total",
+    "Total number of background jobs executed, by outcome",
+    ["site", "queue", "method", "status"],
+    registry=APP_REGISTRY,
+)
+
+JOB_WAIT_SECONDS = Histogram(
+    "frappe_job_wait_seconds",
+    "Histogram of time background jobs spent in the queue before starting",
+    ["site", "queue", "method"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0),
+    registry=APP_REGISTRY,
+)
+
+JOB_DURATION_SECONDS = Histogram(
+    "frappe_job_duration_seconds",
+    "Histogram of background job execution durations in seconds",
+    ["site", "queue", "method"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+    registry=APP_REGISTRY,
+)
+
+# --- Document Lifecycle Metrics (see doc_metrics.py) ---
+
+DOC_EVENT_DURATION_SECONDS = _duration_histogram(
+    "frappe_doc_event_duration_seconds",
+    "Histogram of time spent in document lifecycle events (validate, before_save, on_update, ...) per DocType",
+    ["site", "doctype", "event"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# --- Instrumented Functions (configured per site, see instrumentation.py) ---
+
+FUNCTION_CALLS_TOTAL = Counter(
+    "frappe_function_calls_total",
+    "Total number of calls of the functions instrumented in Frappe Exporter Settings, by outcome",
+    ["site", "function", "label", "status"],
+    registry=APP_REGISTRY,
+)
+
+# --- Database Metrics (opt-in, see db_metrics.py) ---
+
+DB_QUERIES_TOTAL = Counter(
+    "frappe_db_queries_total",
+    "Total number of database queries executed through frappe.db.sql",
+    ["site", "kind", "table", "status"],
+    registry=APP_REGISTRY,
+)
+
+DB_QUERY_DURATION_SECONDS = Histogram(
+    "frappe_db_query_duration_seconds",
+    "Histogram of frappe.db.sql query durations in seconds",
+    ["site", "kind", "table"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=APP_REGISTRY,
+)
+
+DB_QUERY_ROWS = Histogram(
+    "frappe_db_query_rows",
+    "Histogram of rows returned by frappe.db.sql queries",
+    ["site", "kind", "table"],
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+    registry=APP_REGISTRY,
+)
+
+# --- Process-local Collectors ---
+
+
+# Registers a collector that reports in-memory state of this process (not
+# values in the shared store). In multiprocess mode it is added to the
+# aggregated registry as well so it still shows up in scrapes; such
+# collectors label their series with the pid, since each scrape only sees
+# the worker that served it.
+def register_process_collector(collector):
+    APP_REGISTRY.register(collector)
+    if is_multiprocess_enabled():
+        get_aggregated_registry().register(collector)
+
+
+register_process_collector(SlowCallCollector(SLOW_CALLS))
+register_process_collector(QueueCollector())
+register_process_collector(SeriesCollector())
+register_process_collector(SelfMetricsCollector())
+register_process_collector(ProfilerCollector())
+
+# --- Custom Metrics Handling ---
 
 METRIC_TYPE_MAP = {
     "Counter": Counter,
     "Gauge": Gauge,
     "Histogram": Histogram,
     "Summary": Summary,
+    "Native Histogram": NativeHistogram,
+    "Sketch Summary": SketchSummary,
 }
 
+# Sites idle for longer than this (per-site setting, 0 disables) have their
+# custom metrics and series dropped from the process.
+DEFAULT_SITE_IDLE_TIMEOUT_SECONDS = 3600
 
-# Internal function to run initialization once
-def _initialize_custom_metrics_if_needed():
-    global _custom_metrics_initialized
-    if not _custom_metrics_initialized:
-        with _init_lock:
-            if not _custom_metrics_initialized:
-                initialize_custom_metrics()
-                _custom_metrics_initialized = True
+# Bumped whenever a custom metric is added, removed or rebuilt so bound
+# metric handles know to re-resolve their child.
+custom_metrics_generation = 0
 
+_site_custom_metrics = {}
+_site_custom_metrics_lock = threading.Lock()
 
-# Reads custom metric definitions from the DocType and registers them.
-# called lazily and should only execute when a site context is available.
-def initialize_custom_metrics():
-    global CUSTOM_METRICS
 
-    # Safeguard against running in a context without a site (e.g. build process)
-    if not getattr(frappe.local, "site", None):
-        logger.warning("No site context found. Skipping custom metric initialization.")
-        return
+def _parse_custom_metric_def(metric_def):
+    metric_name = metric_def.get("metric_name")
+    metric_type = metric_def.get("metric_type")
+    help_text = metric_def.get("help_text") or "No help text provided."
+    label_names_str = metric_def.get("label_names") or ""
+    label_names = tuple(
+        label.strip() for label in label_names_str.split(",") if label.strip()
+    )
 
-    logger.info("Initializing custom metrics...")
-    try:
-        if not frappe.db.exists("DocType", "Frappe Exporter Settings"):
-            logger.warning(
-                "DocType 'Frappe Exporter Settings' not found. Skipping custom metric initialization."
-            )
-            return
+    if not all([metric_name, metric_type]):
+        logger.error(f"Skipping custom metric due to missing name or type: {metric_def}")
+        return None
 
-        # FIX: Use a more robust method to get settings and child table data separately.
-        settings = frappe.db.get_singles_dict("Frappe Exporter Settings")
+    if metric_type not in METRIC_TYPE_MAP:
+        logger.error(
+            f"Invalid metric type '{metric_type}' for metric '{metric_name}'. Skipping."
+        )
+        return None
 
-        if not settings.get("enabled"):
-            logger.info(
-                "Frappe Exporter is disabled in settings. No custom metrics will be initialized."
-            )
-            return
+    quantiles = ()
+    if METRIC_TYPE_MAP[metric_type] is SketchSummary:
+        quantiles = _parse_quantiles(metric_name, metric_def.get("quantiles"))
+        if quantiles is None:
+            return None
 
-        # Fetch the child table data using a direct query.
-        custom_metrics_defs = frappe.get_all(
-            "Prometheus Custom Metric",
-            fields=["metric_name", "metric_type", "help_text", "label_names"],
-            parent="Frappe Exporter Settings",
+    if SITE_LABEL in label_names:
+        logger.error(
+            f"Custom metric '{metric_name}' cannot define the reserved label '{SITE_LABEL}'. Skipping."
         )
+        return None
 
-    except Exception as e:
+    return metric_name, (metric_type, help_text, label_names, quantiles)
+
+
+def _parse_quantiles(metric_name, quantiles_str):
+    # "0.5, 0.95, 0.99" -> (0.5, 0.95, 0.99); empty means the defaults
+    if not quantiles_str or not quantiles_str.strip():
+        return DEFAULT_QUANTILES
+    try:
+        quantiles = tuple(sorted({float(q) for q in quantiles_str.split(",") if q.strip()}))
+    except ValueError:
+        quantiles = ()
+    if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+        logger.error(
+            f"Invalid quantiles '{quantiles_str}' for metric '{metric_name}', expected e.g. 0.5, 0.95, 0.99. Skipping."
+        )
+        return None
+    return quantiles
+
+
+def _create_custom_metric(metric_name, definition, registry):
+    metric_type, help_text, label_names, quantiles = definition
+    metric_class = METRIC_TYPE_MAP[metric_type]
+    if metric_class is NativeHistogram and is_multiprocess_enabled():
         logger.warning(
-            f"Could not get Frappe Exporter Settings. Skipping custom metric initialization. Error: {e}"
+            f"Native histograms are not supported in multiprocess mode; '{metric_name}' uses classic buckets."
         )
-        return
+        metric_class = Histogram
 
-    for metric_def in custom_metrics_defs:
-        metric_name = metric_def.get("metric_name")
-        metric_type = metric_def.get("metric_type")
-        help_text = metric_def.get("help_text", "No help text provided.")
-        label_names_str = metric_def.get("label_names", "")
-        label_names = [
-            label.strip() for label in label_names_str.split(",") if label.strip()
-        ]
-
-        if not all([metric_name, metric_type]):
-            logger.error(
-                f"Skipping custom metric due to missing name or type: {metric_def}"
-            )
-            continue
+    metric_kwargs = {}
+    if metric_class is Gauge and is_multiprocess_enabled():
+        # Report the value most recently set by any process. prometheus_client
+        # rejects inc/dec in this mode, so only use it when it is needed.
+        metric_kwargs["multiprocess_mode"] = "mostrecent"
+    elif metric_class is SketchSummary:
+        metric_kwargs["quantiles"] = quantiles
 
-        if (
-            metric_name in CUSTOM_METRICS
-            or metric_name in APP_REGISTRY._names_to_collectors
-        ):
-            logger.warning(
-                f"Metric '{metric_name}' is already defined or registered. Skipping."
-            )
-            continue
+    # Every custom metric carries the site as its first label, filled in by the
+    # exporter, so sites defining the same metric never share series. This also
+    # keeps them apart in the multiprocess files.
+    return metric_class(
+        metric_name,
+        help_text,
+        labelnames=(SITE_LABEL, *label_names),
+        registry=registry,
+        **metric_kwargs,
+    )
 
-        metric_class = METRIC_TYPE_MAP.get(metric_type)
-        if not metric_class:
-            logger.error(
-                f"Invalid metric type '{metric_type}' for metric '{metric_name}'. Skipping."
-            )
-            continue
 
+class SiteCustomMetrics:
+    """
+    The custom metrics of one site, kept in a registry of their own and built
+    lazily the first time the site touches a custom metric. The definitions
+    are reconciled whenever the site's settings snapshot is replaced.
+    """
+
+    __slots__ = ("_definitions", "_lock", "_settings", "metrics", "registry", "site")
+
+    def __init__(self, site):
+        self.site = site
+        self.registry = CollectorRegistry(auto_describe=True)
+        self.metrics = {}
+        # metric_name -> (metric_type, help_text, label_names, quantiles) it was built from
+        self._definitions = {}
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def sync(self, settings):
+        # Cheap on the hot path: snapshots are only replaced when the settings
+        # version changes, so an identity check tells whether to reconcile.
+        if settings is self._settings or not settings.loaded:
+            return
+        with self._lock:
+            if settings is not self._settings:
+                self._reconcile(settings)
+                self._settings = settings
+
+    def _reconcile(self, settings):
+        # Unchanged metrics keep their series; removed ones are unregistered
+        # and changed ones are rebuilt.
+        global custom_metrics_generation
+
+        desired = {}
+        if settings.enabled:
+            for metric_def in settings.custom_metrics:
+                parsed = _parse_custom_metric_def(metric_def)
+                if parsed:
+                    desired[parsed[0]] = parsed[1]
+
+        changed = False
+        for metric_name in list(self.metrics):
+            if desired.get(metric_name) != self._definitions.get(metric_name):
+                self._unregister(metric_name)
+                changed = True
+
+        for metric_name, definition in desired.items():
+            if metric_name in self.metrics:
+                continue
+
+            if metric_name in APP_REGISTRY._names_to_collectors:
+                logger.warning(f"Metric '{metric_name}' is already defined or registered. Skipping.")
+                continue
+
+            try:
+                self.metrics[metric_name] = _create_custom_metric(metric_name, definition, self.registry)
+                self._definitions[metric_name] = definition
+                changed = True
+                logger.info(
+                    f"Successfully created and registered custom metric: '{metric_name}' for site '{self.site}'"
+                )
+            except Exception as e:
+                logger.error(f"Failed to create custom metric '{metric_name}': {e}", exc_info=True)
+
+        if changed:
+            custom_metrics_generation += 1
+
+    def _unregister(self, metric_name):
+        metric_obj = self.metrics.pop(metric_name, None)
+        self._definitions.pop(metric_name, None)
+        if metric_obj is None:
+            return
         try:
-            metric_obj = metric_class(
-                metric_name, help_text, labelnames=label_names, registry=APP_REGISTRY
-            )
-            CUSTOM_METRICS[metric_name] = metric_obj
-            logger.info(
-                f"Successfully created and registered custom metric: '{metric_name}'"
-            )
-        except Exception as e:
-            logger.error(
-                f"Failed to create custom metric '{metric_name}': {e}", exc_info=True
-            )
-    logger.info("Custom metrics initialization complete.")
+            self.registry.unregister(metric_obj)
+        except KeyError:
+            pass
+        drop_label_cache(metric_obj)
+        logger.info(f"Unregistered custom metric: '{metric_name}' for site '{self.site}'")
+
+    def clear(self):
+        global custom_metrics_generation
+        with self._lock:
+            for metric_name in list(self.metrics):
+                self._unregister(metric_name)
+            self._settings = None
+        custom_metrics_generation += 1
+
+
+def get_site_custom_metrics():
+    """Returns the SiteCustomMetrics of the current site, or None outside a site."""
+    site = getattr(frappe.local, "site", None)
+    if not site:
+        return None
+
+    site_metrics = _site_custom_metrics.get(site)
+    if site_metrics is None:
+        with _site_custom_metrics_lock:
+            site_metrics = _site_custom_metrics.get(site)
+            if site_metrics is None:
+                site_metrics = _site_custom_metrics[site] = SiteCustomMetrics(site)
+
+    site_metrics.sync(get_site_settings())
+    return site_metrics
+
+
+def get_custom_metric(metric_name, site=None):
+    # Another site's metrics are returned as last synced, since its settings
+    # can only be read from within that site
+    if site is None or site == getattr(frappe.local, "site", None):
+        site_metrics = get_site_custom_metrics()
+    else:
+        site_metrics = _site_custom_metrics.get(site)
+    if site_metrics is None:
+        return None
+    return site_metrics.metrics.get(metric_name)
 
 
-def get_custom_metric(metric_name):
-    _initialize_custom_metrics_if_needed()
-    return CUSTOM_METRICS.get(metric_name)
+class CustomMetricsCollector:
+    """
+    Exposes the custom metrics of every site in this process. Families with the
+    same name are merged; their series differ by the site label.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        families = {}
+        for site_metrics in list(_site_custom_metrics.values()):
+            for family in site_metrics.registry.collect():
+                merged = families.get(family.name)
+                if merged is None:
+                    families[family.name] = family
+                elif merged.type != family.type:
+                    logger.warning(
+                        f"Custom metric '{family.name}' of site '{site_metrics.site}' is a {family.type}, "
+                        f"but another site defines it as a {merged.type}. Skipping it in the export."
+                    )
+                else:
+                    merged.samples.extend(family.samples)
+        return iter(families.values())
+
+
+APP_REGISTRY.register(CustomMetricsCollector())
+
+
+def _remove_site_series(site):
+    # Drops the children of every built-in metric that belong to `site`. Metrics
+    # exported through a collector of their own (instrumented function
+    # durations) are found through their label caches.
+    collectors = set(APP_REGISTRY._collector_to_names)
+    collectors.update(cache.metric for cache in get_label_caches())
+    for collector in collectors:
+        labelnames = getattr(collector, "_labelnames", ())
+        if SITE_LABEL not in labelnames:
+            continue
+        index = labelnames.index(SITE_LABEL)
+        with collector._lock:
+            stale = [labelvalues for labelvalues in collector._metrics if labelvalues[index] == site]
+        remove_label_children(collector, stale)
+        label_cache_for(collector).forget_site(site)
+
+
+def evict_site(site):
+    """Drops the custom metrics, series and settings snapshot of `site` from this process."""
+    with _site_custom_metrics_lock:
+        site_metrics = _site_custom_metrics.pop(site, None)
+    if site_metrics is not None:
+        site_metrics.clear()
+    _remove_site_series(site)
+    drop_site_settings(site)
+    logger.info(f"Evicted idle site '{site}' from the exporter")
+
+
+def evict_idle_sites():
+    """Evicts sites that have not recorded anything for their configured idle timeout."""
+    now = time.monotonic()
+    for site, settings in get_loaded_site_settings():
+        idle_timeout = settings.values.get("site_idle_timeout")
+        if idle_timeout is None:
+            idle_timeout = DEFAULT_SITE_IDLE_TIMEOUT_SECONDS
+        idle_timeout = float(idle_timeout)
+        if idle_timeout > 0 and now - settings.checked_at > idle_timeout:
+            try:
+                evict_site(site)
+            except Exception as e:
+                logger.error(f"Failed to evict idle site '{site}': {e}", exc_info=True)
 
 
 def get_registry():
-    _initialize_custom_metrics_if_needed()
+    get_site_custom_metrics()
     return APP_REGISTRY
+
+
+# --- Housekeeping ---
+
+HOUSEKEEPING_INTERVAL_SECONDS = 60
+
+# Bench-wide in common_site_config.json: seconds a label combination may go
+# unused before its series is dropped from the worker. 0 (default) keeps them.
+SERIES_TTL_CONF_KEY = "frappe_exporter_series_ttl"
+GAUGE_SERIES_TTL_CONF_KEY = "frappe_exporter_gauge_series_ttl"
+
+_last_housekeeping = 0.0
+
+
+def run_housekeeping():
+    """
+    Evicts idle sites, expires stale series and applies the profiler rate. Rate limited, so it can be
+    called from request and job hooks and on scrape.
+    """
+    global _last_housekeeping
+
+    now = time.monotonic()
+    if now - _last_housekeeping < HOUSEKEEPING_INTERVAL_SECONDS:
+        return
+    _last_housekeeping = now
+
+    evict_idle_sites()
+
+    # Starts or stops the sampling profiler when its rate is changed
+    try:
+        configure_profiler(frappe.conf.get(PROFILER_HZ_CONF_KEY))
+    except Exception as e:
+        logger.error(f"Failed to configure the sampling profiler: {e}", exc_info=True)
+
+    try:
+        ttl = float(frappe.conf.get(SERIES_TTL_CONF_KEY) or 0)
+        gauge_ttl = float(frappe.conf.get(GAUGE_SERIES_TTL_CONF_KEY) or 0)
+        expired = expire_stale_series(ttl, gauge_ttl)
+    except Exception as e:
+        logger.error(f"Failed to expire stale series: {e}", exc_info=True)
+        return
+    if expired:
+        logger.debug(f"Expired {expired} stale series")
+
+
+# Returns the registry to serialize for a scrape. In multiprocess mode this
+# merges the values written by every worker on the bench instead of only
+# the values of the process that happens to serve the request.
+def get_exposition_registry():
+    registry = get_registry()
+    if is_multiprocess_enabled():
+        return get_aggregated_registry()
+    return registry
@@ -0,0 +1,302 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("frappe_exporter.multiprocess")
+
+# prometheus_client decides between in-process and mmap-backed values from
+# this environment variable, so it has to be set before any metric is built.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Key in sites/common_site_config.json that enables multiprocess mode for
+# every process on the bench (web workers, RQ workers and the scheduler).
+MULTIPROC_DIR_CONF_KEY = "frappe_exporter_multiprocess_dir"
+
+# Counter, histogram and gauge files left behind by dead processes are folded
+# into archive files so the directory does not grow with every recycled
+# gunicorn worker or forked RQ work horse.
+COMPACTION_INTERVAL_SECONDS = 60.0
+_COMPACTABLE_TYPES = ("counter", "histogram", "summary")
+# Gauge files of dead processes. Live modes only report live processes, so
+# their files are deleted (mark_process_dead misses killed workers); the
+# other modes are folded into an archive file per mode. "all" gauges report
+# every pid, dead ones included, by design and are left alone.
+_LIVE_GAUGE_MODES = ("liveall", "livemin", "livemax", "livesum", "livemostrecent")
+_COMPACTABLE_GAUGE_MODES = ("min", "max", "sum", "mostrecent")
+_ARCHIVE_PID = "archive"
+_LOCK_FILE_NAME = ".frappe_exporter.lock"
+
+_multiprocess_dir = None
+_aggregated_registry = None
+_registry_lock = threading.Lock()
+_last_compaction = 0.0
+
+
+def read_common_site_config():
+    # Bench processes run with the sites directory as their working directory.
+    try:
+        with open("common_site_config.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def configure_multiprocess():
+    """
+    Enables prometheus_client's mmap-backed multiprocess mode when a shared
+    directory is configured, either through PROMETHEUS_MULTIPROC_DIR or the
+    `frappe_exporter_multiprocess_dir` key in common_site_config.json.
+
+    Must run before the exporter's metrics are created.
+    """
+    global _multiprocess_dir
+
+    path = os.environ.get(MULTIPROC_DIR_ENV) or read_common_site_config().get(
+        MULTIPROC_DIR_CONF_KEY
+    )
+    if not path:
+        return False
+
+    path = os.path.abspath(path)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        logger.error(f"Cannot create multiprocess metrics directory '{path}': {e}")
+        return False
+
+    os.environ[MULTIPROC_DIR_ENV] = path
+
+    # Another app may have imported prometheus_client already, in which case the
+    # value class was chosen without the environment variable. Re-evaluate it so
+    # metrics created from now on write into the shared directory.
+    from prometheus_client import values
+
+    values.ValueClass = values.get_value_class()
+
+    _multiprocess_dir = path
+    atexit.register(mark_current_process_dead)
+    logger.info(f"Multiprocess metrics enabled, using directory '{path}'")
+    return True
+
+
+def is_multiprocess_enabled():
+    return _multiprocess_dir is not None
+
+
+def get_multiprocess_dir():
+    return _multiprocess_dir
+
+
+def mark_current_process_dead():
+    # Drops this process's live gauge files. Counter and histogram files are kept
+    # so totals survive the process being recycled.
+    if not _multiprocess_dir:
+        return
+    from prometheus_client import multiprocess
+
+    try:
+        multiprocess.mark_process_dead(os.getpid(), _multiprocess_dir)
+    except Exception as e:
+        logger.debug(f"Failed to mark process {os.getpid()} as dead: {e}")
+
+
+def child_exit(server, worker):
+    """
+    Gunicorn `child_exit` server hook, for benches that run gunicorn with a
+    config file. Covers workers killed before their atexit handlers could run.
+    """
+    if not _multiprocess_dir:
+        return
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, _multiprocess_dir)
+
+
+class _LockedMultiProcessCollector:
+    # Reads the mmap files under a shared lock so a concurrent compaction
+    # can never make a dead process's values count twice or not at all.
+    def __init__(self, path):
+        from prometheus_client.multiprocess import MultiProcessCollector
+
+        self._path = path
+        self._collector = MultiProcessCollector(None, path=path)
+
+    def collect(self):
+        with _directory_lock(self._path, fcntl.LOCK_SH):
+            return list(self._collector.collect())
+
+
+class _directory_lock:
+    def __init__(self, path, mode):
+        self._lock_path = os.path.join(path, _LOCK_FILE_NAME)
+        self._mode = mode
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, self._mode)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+
+
+def _is_pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dead_process_files(prefix):
+    # Files named <prefix>_<pid>.db of processes that no longer exist
+    dead_files = []
+    for path in glob.glob(os.path.join(_multiprocess_dir, f"{prefix}_*.db")):
+        pid = os.path.basename(path)[len(prefix) + 1 : -3]
+        if pid.isdigit() and int(pid) != os.getpid() and not _is_pid_alive(int(pid)):
+            dead_files.append(path)
+    return dead_files
+
+
+def _merge_gauge_files(paths, mode):
+    from prometheus_client.mmap_dict import MmapedDict
+
+    # mmap key -> (value, timestamp), combined the way the mode is read
+    merged = {}
+    for path in paths:
+        for key, value, timestamp, _pos in MmapedDict.read_all_values_from_file(path):
+            current = merged.get(key)
+            if current is None:
+                merged[key] = (value, timestamp)
+            elif mode == "min":
+                merged[key] = min(current, (value, timestamp))
+            elif mode == "max":
+                merged[key] = max(current, (value, timestamp))
+            elif mode == "sum":
+                merged[key] = (current[0] + value, max(current[1], timestamp))
+            elif timestamp > current[1]:
+                merged[key] = (value, timestamp)
+    return merged
+
+
+def _write_archive(prefix, values):
+    # Replaces <prefix>_archive.db with the given {mmap key: (value, timestamp)}
+    from prometheus_client.mmap_dict import MmapedDict
+
+    tmp_path = os.path.join(_multiprocess_dir, f".{prefix}_{_ARCHIVE_PID}.tmp")
+    archive = MmapedDict(tmp_path)
+    try:
+        for key, (value, timestamp) in values.items():
+            archive.write_value(key, value, timestamp)
+    finally:
+        archive.close()
+    os.replace(tmp_path, os.path.join(_multiprocess_dir, f"{prefix}_{_ARCHIVE_PID}.db"))
+
+
+def compact_dead_process_files(force=False):
+    """
+    Merges counter/histogram/summary files of processes that no longer exist
+    into one `<type>_archive.db` file per type, min/max/sum/mostrecent gauge
+    files into one `gauge_<mode>_archive.db` per mode, and their quantile
+    sketch files into `sketch_archive.json`, then removes the merged files.
+    Live gauge files of dead processes are removed.
+    """
+    global _last_compaction
+
+    if not _multiprocess_dir:
+        return 0
+
+    now = time.monotonic()
+    if not force and now - _last_compaction < COMPACTION_INTERVAL_SECONDS:
+        return 0
+    _last_compaction = now
+
+    from prometheus_client.mmap_dict import mmap_key
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    compacted = 0
+    with _directory_lock(_multiprocess_dir, fcntl.LOCK_EX):
+        for typ in _COMPACTABLE_TYPES:
+            archive_path = os.path.join(_multiprocess_dir, f"{typ}_{_ARCHIVE_PID}.db")
+            dead_files = _dead_process_files(typ)
+            if not dead_files:
+                continue
+
+            sources = dead_files + ([archive_path] if os.path.exists(archive_path) else [])
+            merged = MultiProcessCollector.merge(sources, accumulate=False)
+            _write_archive(
+                typ,
+                {
+                    mmap_key(
+                        metric.name,
+                        sample.name,
+                        list(sample.labels.keys()),
+                        list(sample.labels.values()),
+                        metric.documentation,
+                    ): (sample.value, 0.0)
+                    for metric in merged
+                    for sample in metric.samples
+                },
+            )
+            for path in dead_files:
+                os.remove(path)
+            compacted += len(dead_files)
+
+        for mode in _COMPACTABLE_GAUGE_MODES:
+            prefix = f"gauge_{mode}"
+            archive_path = os.path.join(_multiprocess_dir, f"{prefix}_{_ARCHIVE_PID}.db")
+            dead_files = _dead_process_files(prefix)
+            if not dead_files:
+                continue
+
+            sources = dead_files + ([archive_path] if os.path.exists(archive_path) else [])
+            _write_archive(prefix, _merge_gauge_files(sources, mode))
+            for path in dead_files:
+                os.remove(path)
+            compacted += len(dead_files)
+
+        for mode in _LIVE_GAUGE_MODES:
+            for path in _dead_process_files(f"gauge_{mode}"):
+                os.remove(path)
+                compacted += 1
+
+        # Quantile sketches are kept in JSON files of their own
+        from .sketch import compact_dead_sketch_files
+
+        compacted += compact_dead_sketch_files(_multiprocess_dir)
+
+    if compacted:
+        logger.info(f"Compacted {compacted} metric files from dead processes")
+    return compacted
+
+
+def get_aggregated_registry():
+    """
+    Returns a registry whose collection merges the values written by every
+    process on the bench. Only meaningful in multiprocess mode.
+    """
+    global _aggregated_registry
+
+    if _aggregated_registry is None:
+        from prometheus_client import CollectorRegistry
+
+        from .sketch import SketchFileCollector
+
+        with _registry_lock:
+            if _aggregated_registry is None:
+                registry = CollectorRegistry(auto_describe=True)
+                registry.register(_LockedMultiProcessCollector(_multiprocess_dir))
+                registry.register(SketchFileCollector(_multiprocess_dir))
+                _aggregated_registry = registry
+    return _aggregated_registry
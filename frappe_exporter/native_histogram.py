@@ -0,0 +1,191 @@
+"""
+Sparse exponential ("native") histograms, exported through the protobuf
+exposition format.
+
+Bucket i of a histogram with schema s covers (base^(i-1), base^i] with
+base = 2^(2^-s), so the resolution is the same at every scale and no bucket
+layout has to be chosen up front. Only buckets that received observations are
+stored, and a series never holds more than `max_buckets` of them: past that
+the schema is lowered and neighbouring buckets are merged, halving the
+resolution.
+"""
+
+import math
+import threading
+from bisect import bisect_left
+
+from prometheus_client.metrics import MetricWrapperBase
+from prometheus_client.samples import BucketSpan, Sample
+from prometheus_client.samples import NativeHistogram as NativeHistogramValue
+
+# Schema 3 gives buckets about 9% wide; -4 is the coarsest schema Prometheus accepts
+DEFAULT_SCHEMA = 3
+MIN_SCHEMA = -4
+MAX_SCHEMA = 8
+DEFAULT_MAX_BUCKETS = 160
+# Observations with an absolute value up to this count as zero
+DEFAULT_ZERO_THRESHOLD = 2.0**-128
+
+# Per schema, the upper bounds of the buckets within one power of two, as the
+# fractions returned by math.frexp (in [0.5, 1))
+_BOUNDS = {
+    schema: tuple(2.0 ** (i / (1 << schema) - 1) for i in range(1 << schema))
+    for schema in range(1, MAX_SCHEMA + 1)
+}
+
+
+def bucket_index(value, schema):
+    """Index of the bucket holding `value` (> 0) at `schema`, from its float exponent."""
+    frac, exp = math.frexp(value)
+    if schema > 0:
+        bounds = _BOUNDS[schema]
+        return bisect_left(bounds, frac) + (exp - 1) * len(bounds)
+    index = exp - 1 if frac == 0.5 else exp
+    offset = (1 << -schema) - 1
+    return (index + offset) >> -schema
+
+
+def _spans_and_deltas(buckets):
+    # Encodes {index: count} the way the exposition format expects: runs of
+    # consecutive indexes as spans, and counts as deltas from the previous one.
+    spans = []
+    deltas = []
+    previous_index = None
+    previous_count = 0
+    for index in sorted(buckets):
+        count = buckets[index]
+        if previous_index is None:
+            spans.append(BucketSpan(index, 1))
+        elif index == previous_index + 1:
+            spans[-1] = BucketSpan(spans[-1].offset, spans[-1].length + 1)
+        else:
+            spans.append(BucketSpan(index - previous_index - 1, 1))
+        deltas.append(int(count - previous_count))
+        previous_index = index
+        previous_count = count
+    return spans, deltas
+
+
+class NativeHistogram(MetricWrapperBase):
+    """
+    Histogram metric with sparse exponential buckets. Drop-in for
+    prometheus_client's Histogram where callers only use `labels()` and
+    `observe()`.
+
+    Text and OpenMetrics scrapes only see `_count`, `_sum` and a single +Inf
+    bucket; the full distribution is in the protobuf format.
+    """
+
+    _type = "histogram"
+    _reserved_labelnames = ("le",)
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        namespace="",
+        subsystem="",
+        unit="",
+        registry=None,
+        _labelvalues=None,
+        schema=DEFAULT_SCHEMA,
+        max_buckets=DEFAULT_MAX_BUCKETS,
+        zero_threshold=DEFAULT_ZERO_THRESHOLD,
+    ):
+        if not MIN_SCHEMA <= schema <= MAX_SCHEMA:
+            raise ValueError(f"Native histogram schema must be between {MIN_SCHEMA} and {MAX_SCHEMA}")
+        self._initial_schema = schema
+        self._max_buckets = max_buckets
+        self._zero_threshold = zero_threshold
+        super().__init__(
+            name=name,
+            documentation=documentation,
+            labelnames=labelnames,
+            namespace=namespace,
+            subsystem=subsystem,
+            unit=unit,
+            registry=registry,
+            _labelvalues=_labelvalues,
+        )
+        self._kwargs["schema"] = schema
+        self._kwargs["max_buckets"] = max_buckets
+        self._kwargs["zero_threshold"] = zero_threshold
+
+    def _metric_init(self):
+        self._value_lock = threading.Lock()
+        self._schema = self._initial_schema
+        self._count = 0
+        self._sum = 0.0
+        self._zero_count = 0
+        self._positive = {}
+        self._negative = {}
+
+    def observe(self, amount, weight=1):
+        self._raise_if_not_observable()
+        with self._value_lock:
+            self._observe(amount, weight)
+
+    def observe_weighted(self, amount, weight):
+        self.observe(amount, weight)
+
+    def observe_many(self, observations):
+        # (amount, weight) pairs, applied under a single lock acquisition
+        self._raise_if_not_observable()
+        with self._value_lock:
+            for amount, weight in observations:
+                self._observe(amount, weight)
+
+    def _observe(self, amount, weight):
+        if math.isnan(amount):
+            return
+        self._count += weight
+        self._sum += amount * weight
+        if abs(amount) <= self._zero_threshold:
+            self._zero_count += weight
+            return
+
+        buckets = self._positive if amount > 0 else self._negative
+        # Infinite values go to the bucket of the largest finite float
+        index = bucket_index(min(abs(amount), 1.7976931348623157e308), self._schema)
+        buckets[index] = buckets.get(index, 0) + weight
+        if len(self._positive) + len(self._negative) > self._max_buckets:
+            self._reduce_resolution()
+
+    def _reduce_resolution(self):
+        while (
+            len(self._positive) + len(self._negative) > self._max_buckets and self._schema > MIN_SCHEMA
+        ):
+            self._schema -= 1
+            for name in ("_positive", "_negative"):
+                merged = {}
+                for index, count in getattr(self, name).items():
+                    # Buckets 2j-1 and 2j at schema s make up bucket j at schema s-1
+                    new_index = (index + 1) >> 1
+                    merged[new_index] = merged.get(new_index, 0) + count
+                setattr(self, name, merged)
+
+    def _child_samples(self):
+        with self._value_lock:
+            count = self._count
+            total = self._sum
+            pos_spans, pos_deltas = _spans_and_deltas(self._positive)
+            neg_spans, neg_deltas = _spans_and_deltas(self._negative)
+            native = NativeHistogramValue(
+                count_value=count,
+                sum_value=total,
+                schema=self._schema,
+                zero_threshold=self._zero_threshold,
+                zero_count=self._zero_count,
+                pos_spans=pos_spans,
+                neg_spans=neg_spans,
+                pos_deltas=pos_deltas,
+                neg_deltas=neg_deltas,
+            )
+        return (
+            Sample("", {}, 0.0, None, None, native),
+            Sample("_bucket", {"le": "+Inf"}, count, None, None),
+            Sample("_count", {}, count, None, None),
+            Sample("_sum", {}, total, None, None),
+        )
+
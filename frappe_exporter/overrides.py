@@ -1,5 +1,8 @@
+from .db_metrics import apply_db_overrides
 from .exception import exportException
+from .job_metrics import apply_enqueue_override
 import logging
+import random
 import time
 import frappe
 from .metrics_handler import (
@@ -8,52 +11,35 @@ from .metrics_handler import (
     GET_LIST_DURATION_SECONDS,
     GET_LIST_TOTAL,
 )
+from .label_cache import label_cache_for
+from .recorder import get_recorder, get_request_accumulator, record_weighted
+from .self_metrics import thread_stats
+from .settings import get_site_settings
+from .slow_calls import SLOW_CALLS, get_doc_signature, get_list_signature
 
 logger = logging.getLogger("frappe_exporter.overrides")
 
+# Resolved label children of the built-in metrics, reused across calls
+_get_doc_total = label_cache_for(GET_DOC_TOTAL)
+_get_doc_duration = label_cache_for(GET_DOC_DURATION_SECONDS)
+_get_list_total = label_cache_for(GET_LIST_TOTAL)
+_get_list_duration = label_cache_for(GET_LIST_DURATION_SECONDS)
+
 # Store references to the original Frappe methods
 _original_get_doc = None
 _original_get_list = None
 
 
 def get_whitelisted_doctypes():
-    cached_val = frappe.cache().get_value("frappe_exporter_whitelisted_doctypes")
-    if cached_val:
-        return cached_val
-
-    try:
-        # Using frappe.db.get_singles_dict to avoid triggering get_doc hooks
-        settings = frappe.db.get_singles_dict("Frappe Exporter Settings")
-        if settings.get("enabled") and settings.get("whitelisting_enabled"):
-            # This part is safe as it doesn't trigger hooks
-            whitelisted_docs = frappe.get_all(
-                "Whitelisted Doctype",
-                fields=["doctype_name"],
-                parent="Frappe Exporter Settings",
-            )
-            whitelisted_set = {d.doctype_name for d in whitelisted_docs}
-            result = (True, whitelisted_set)
-        else:
-            # Whitelisting is disabled, so all doctypes are allowed.
-            result = (False, set())
-
-        frappe.cache().set_value("frappe_exporter_whitelisted_doctypes", result)
-        return result
-    except Exception:
-        # If settings don't exist or there's an error, behave as if disabled.
-        return (False, set())
+    settings = get_site_settings()
+    return (settings.whitelisting_enabled, settings.whitelist)
 
 
 def is_doctype_whitelisted(doctype):
     if not doctype:
         return False
 
-    enabled, whitelist = get_whitelisted_doctypes()
-
-    if not enabled:
-        return True
-
-    return doctype in whitelist
+    return get_site_settings().is_doctype_whitelisted(doctype)
 
 
 def get_current_site():
@@ -86,6 +72,34 @@ def extract_doctype_from_args(method_name, args, kwargs, result=None):
     return doctype if doctype else "unknown_doctype"
 
 
+def get_sample_every(settings, method_name, args, kwargs):
+    # N for "time 1 in N calls". Imports switch to the batch rate automatically.
+    batch = bool(frappe.flags.in_import)
+    if settings.doctype_sample_every:
+        doctype = extract_doctype_from_args(method_name, args, kwargs)
+        return settings.get_sample_every(doctype, batch)
+    return settings.get_sample_every(batch=batch)
+
+
+def is_sampled(sample_every):
+    return sample_every == 1 or random.random() * sample_every < 1.0
+
+
+def _record_overhead(method, sampled, sample_every, end_time):
+    # Calls are counted exactly. The time spent after the wrapped call, the
+    # bulk of the wrapper's bookkeeping, is only measured on sampled calls,
+    # where the clock is read anyway, and weighted by N like the durations.
+    stats = thread_stats()
+    if method == "get_doc":
+        stats.get_doc_calls += 1
+        if sampled:
+            stats.get_doc_seconds += (time.perf_counter() - end_time) * sample_every
+    else:
+        stats.get_list_calls += 1
+        if sampled:
+            stats.get_list_seconds += (time.perf_counter() - end_time) * sample_every
+
+
 def get_doc_wrapper(*args, **kwargs):
     global _original_get_doc
 
@@ -94,11 +108,16 @@ def get_doc_wrapper(*args, **kwargs):
         return _original_get_doc(*args, **kwargs)
 
     site = get_current_site()
-    start_time = time.monotonic()
+    settings = get_site_settings()
+    # Counts are exact; duration, overhead and exception bookkeeping run for
+    # 1 in N calls and are weighted by N. Unsampled calls read no clock.
+    sample_every = get_sample_every(settings, "get_doc", args, kwargs)
+    sampled = is_sampled(sample_every)
     status = "success"
     result_doc = None
     exception_obj = None
 
+    start_time = time.perf_counter() if sampled else 0.0
     try:
         result_doc = _original_get_doc(*args, **kwargs)
         return result_doc
@@ -108,18 +127,28 @@ def get_doc_wrapper(*args, **kwargs):
         raise
     finally:
         # This block runs even if an exception is raised
+        end_time = time.perf_counter() if sampled else 0.0
         doctype = extract_doctype_from_args("get_doc", args, kwargs, result_doc)
 
-        if is_doctype_whitelisted(doctype):
-            GET_DOC_TOTAL.labels(site=site, doctype=doctype, status=status).inc()
-            if status == "success":
-                duration_seconds = time.monotonic() - start_time
-                GET_DOC_DURATION_SECONDS.labels(site=site, doctype=doctype).observe(
-                    duration_seconds
-                )
+        if settings.is_doctype_whitelisted(doctype):
+            accumulator = get_request_accumulator()
+            if accumulator is not None:
+                accumulator.get_doc_calls += 1
+            record = get_recorder(settings)
+            record(_get_doc_total.get(site, doctype, status), "inc", 1.0)
+            if sampled and status == "success":
+                duration_seconds = end_time - start_time
+                record_weighted(record, _get_doc_duration.get(site, doctype), duration_seconds, sample_every)
+                if duration_seconds > SLOW_CALLS.threshold:
+                    SLOW_CALLS.observe(
+                        site, "get_doc", doctype, get_doc_signature(args, kwargs), duration_seconds
+                    )
 
-            if exception_obj:
-                exportException(exception_obj, "get_doc")
+            if sampled and exception_obj:
+                exportException(exception_obj, "get_doc", sample_every)
+
+        # Exporter overhead after the wrapped call; see _record_overhead
+        _record_overhead("get_doc", sampled, sample_every, end_time)
 
 
 def get_list_wrapper(*args, **kwargs):
@@ -131,10 +160,13 @@ def get_list_wrapper(*args, **kwargs):
 
     site = get_current_site()
     doctype = extract_doctype_from_args("get_list", args, kwargs)
-    start_time = time.monotonic()
+    settings = get_site_settings()
+    sample_every = settings.get_sample_every(doctype, bool(frappe.flags.in_import))
+    sampled = is_sampled(sample_every)
     status = "success"
     exception_obj = None
 
+    start_time = time.perf_counter() if sampled else 0.0
     try:
         return _original_get_list(*args, **kwargs)
     except Exception as e:
@@ -143,16 +175,22 @@ def get_list_wrapper(*args, **kwargs):
         raise
     finally:
         # This block runs even if an exception is raised
-        if is_doctype_whitelisted(doctype):
-            GET_LIST_TOTAL.labels(site=site, doctype=doctype, status=status).inc()
-            if status == "success":
-                duration_seconds = time.monotonic() - start_time
-                GET_LIST_DURATION_SECONDS.labels(site=site, doctype=doctype).observe(
-                    duration_seconds
-                )
+        end_time = time.perf_counter() if sampled else 0.0
+        if settings.is_doctype_whitelisted(doctype):
+            record = get_recorder(settings)
+            record(_get_list_total.get(site, doctype, status), "inc", 1.0)
+            if sampled and status == "success":
+                duration_seconds = end_time - start_time
+                record_weighted(record, _get_list_duration.get(site, doctype), duration_seconds, sample_every)
+                if duration_seconds > SLOW_CALLS.threshold:
+                    SLOW_CALLS.observe(
+                        site, "get_list", doctype, get_list_signature(args, kwargs), duration_seconds
+                    )
+
+            if sampled and exception_obj:
+                exportException(exception_obj, "get_list", sample_every)
 
-            if exception_obj:
-                exportException(exception_obj, "get_list")
+        _record_overhead("get_list", sampled, sample_every, end_time)
 
 
 _overrides_applied_flag = False
@@ -184,4 +222,9 @@ def apply_overrides():
         setattr(frappe.get_list, "_instrumented_by_exporter", True)
         logger.info("Instrumented frappe.get_list")
 
+    # Database queries are wrapped at the class level; recording is opt-in per site
+    apply_db_overrides()
+
+    apply_enqueue_override()
+
     _overrides_applied_flag = True
@@ -0,0 +1,349 @@
+"""
+Opt-in sampling profiler. A background thread reads the stacks of the
+threads serving requests and jobs from sys._current_frames() at a fixed
+rate and aggregates them, tagged with the site and route (or job method),
+into a bounded table of collapsed stacks.
+
+Enabled per bench with `frappe_exporter_profiler_hz` in
+common_site_config.json. The profile is exported by
+frappe_exporter.api.get_profile in the collapsed format used by
+flamegraph.pl and speedscope, or as a gzipped pprof protobuf.
+"""
+
+import gzip
+import logging
+import os
+import sys
+import threading
+import time
+
+from prometheus_client.metrics_core import CounterMetricFamily
+
+from .protobuf import _bytes_field, _string_field, _varint, _varint_field
+
+logger = logging.getLogger("frappe_exporter.profiler")
+
+# Samples per second; 0 (the default) disables the profiler
+PROFILER_HZ_CONF_KEY = "frappe_exporter_profiler_hz"
+MAX_HZ = 1000
+
+# Distinct (site, route, stack) entries kept. Once full, samples of new
+# stacks are counted under OTHER_FRAME so the table never grows.
+MAX_STACKS = 5000
+# (site, function) pairs with per-function sample counts
+MAX_FUNCTIONS = 5000
+# Innermost frames kept per sample; deeper stacks are cut at the root
+MAX_STACK_DEPTH = 64
+# Functions exported as metrics, by self samples
+TOP_FUNCTIONS = 20
+
+OTHER_FRAME = "[other]"
+TRUNCATED_FRAME = "[truncated]"
+
+# Code objects are few and long lived, but templates and server scripts can
+# compile new ones at runtime; beyond this labels are built without caching.
+_MAX_CACHED_CODE = 20000
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+# Thread ident -> (site, route) of the threads currently serving a request or job
+_thread_tags = {}
+
+
+def tag_current_thread(site, route):
+    """Marks the calling thread as serving `route` of `site`; only tagged threads are sampled."""
+    if _profiler is not None:
+        _thread_tags[threading.get_ident()] = (site, route)
+
+
+def untag_current_thread():
+    _thread_tags.pop(threading.get_ident(), None)
+
+
+class SamplingProfiler:
+    def __init__(self, hz, max_stacks=MAX_STACKS, max_functions=MAX_FUNCTIONS, max_depth=MAX_STACK_DEPTH):
+        self.hz = hz
+        self.max_stacks = max_stacks
+        self.max_functions = max_functions
+        self.max_depth = max_depth
+        # (site, route, root-first frame labels) -> samples
+        self.stacks = {}
+        # (site, frame label) -> [self samples, total samples]
+        self.functions = {}
+        # frame label -> (function name, file name, first line), for pprof
+        self.frames = {}
+        self.samples = 0
+        self.overhead_seconds = 0.0
+        self.started_at = time.time()
+        self._labels = {}
+        self._path_prefixes = sorted(
+            (os.path.join(os.path.abspath(p), "") for p in sys.path if p), key=len, reverse=True
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="frappe-exporter-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Profiler sample failed: {e}", exc_info=True)
+            elapsed = time.perf_counter() - started
+            self.overhead_seconds += elapsed
+            # Fixed rate: the time spent sampling comes out of the sleep
+            self._stop.wait(max(0.0, interval - elapsed))
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is not None:
+            return label
+
+        filename = code.co_filename
+        for prefix in self._path_prefixes:
+            if filename.startswith(prefix):
+                filename = filename[len(prefix) :]
+                break
+        name = getattr(code, "co_qualname", code.co_name)
+        label = f"{filename}:{name}"
+        if label not in self.frames:
+            self.frames[label] = (name, filename, code.co_firstlineno)
+        if len(self._labels) < _MAX_CACHED_CODE:
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if frame is not None:
+            labels.append(TRUNCATED_FRAME)
+        labels.reverse()
+        return tuple(labels)
+
+    def sample(self):
+        tags = dict(_thread_tags)
+        if not tags:
+            return
+        frames = sys._current_frames()
+        collected = []
+        for ident, (site, route) in tags.items():
+            frame = frames.get(ident)
+            if frame is None:
+                # The thread is gone without untagging itself
+                _thread_tags.pop(ident, None)
+                continue
+            collected.append((site, route, self._stack(frame)))
+        del frames
+
+        with self._lock:
+            for site, route, stack in collected:
+                self.samples += 1
+                key = (site, route, stack)
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = (site, route, (OTHER_FRAME,))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+                leaf = stack[-1]
+                for label in set(stack):
+                    function_key = (site, label)
+                    counts = self.functions.get(function_key)
+                    if counts is None:
+                        if len(self.functions) >= self.max_functions:
+                            continue
+                        counts = self.functions[function_key] = [0, 0]
+                    counts[1] += 1
+                    if label == leaf:
+                        counts[0] += 1
+
+    def snapshot(self, site=None):
+        """Returns ({(site, route, stack): samples}, {(site, label): [self, total]}) for `site`, or all sites."""
+        with self._lock:
+            stacks = {key: count for key, count in self.stacks.items() if site is None or key[0] == site}
+            functions = {
+                key: list(counts) for key, counts in self.functions.items() if site is None or key[0] == site
+            }
+        return stacks, functions
+
+    def reset(self, site=None):
+        with self._lock:
+            if site is None:
+                self.stacks.clear()
+                self.functions.clear()
+                return
+            for key in [key for key in self.stacks if key[0] == site]:
+                del self.stacks[key]
+            for key in [key for key in self.functions if key[0] == site]:
+                del self.functions[key]
+
+
+def get_profiler():
+    return _profiler
+
+
+def configure_profiler(hz):
+    """Starts, restarts at a new rate, or (with 0) stops the profiler of this process."""
+    global _profiler
+
+    hz = min(max(float(hz or 0), 0.0), MAX_HZ)
+    with _profiler_lock:
+        if _profiler is not None and _profiler.hz == hz:
+            return _profiler
+        if _profiler is not None:
+            _profiler.stop()
+            _profiler = None
+            _thread_tags.clear()
+            logger.info("Sampling profiler stopped")
+        if hz:
+            _profiler = SamplingProfiler(hz)
+            _profiler.start()
+            logger.info(f"Sampling profiler started at {hz:g} Hz")
+    return _profiler
+
+
+def _reset_after_fork():
+    # The sampler thread does not survive fork. The child starts its own at the
+    # same rate right away, since RQ work horses run a single job and exit.
+    global _profiler, _profiler_lock
+    hz = _profiler.hz if _profiler is not None else 0
+    _profiler = None
+    _profiler_lock = threading.Lock()
+    _thread_tags.clear()
+    if hz:
+        _profiler = SamplingProfiler(hz)
+        _profiler.start()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _escape(frame):
+    # ";" separates frames and " " the count in the collapsed format
+    return frame.replace(";", ":").replace(" ", "_")
+
+
+def render_collapsed(stacks):
+    """Collapsed stack lines, `site;route;frame;...;leaf count`, as read by flamegraph.pl."""
+    lines = []
+    for (site, route, stack), count in sorted(stacks.items(), key=lambda item: -item[1]):
+        frames = ";".join(_escape(frame) for frame in (site, route, *stack))
+        lines.append(f"{frames} {count}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def render_pprof(stacks, frames, hz, started_at):
+    """
+    Encodes the stacks as a gzipped pprof Profile message. Site and route are
+    sample labels; every frame label becomes one function and one location.
+    """
+    strings = {"": 0}
+
+    def string_index(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    def value_type(type_name, unit):
+        return _varint_field(1, string_index(type_name)) + _varint_field(2, string_index(unit))
+
+    period_nanos = int(1e9 / hz)
+    body = _bytes_field(1, value_type("samples", "count"))
+    body += _bytes_field(1, value_type("wall", "nanoseconds"))
+
+    location_ids = {}
+    functions = b""
+    locations = b""
+    for (site, route, stack), count in stacks.items():
+        ids = []
+        for label in reversed(stack):  # pprof lists the leaf first
+            location_id = location_ids.get(label)
+            if location_id is None:
+                location_id = location_ids[label] = len(location_ids) + 1
+                name, filename, first_line = frames.get(label, (label, "", 0))
+                functions += _bytes_field(
+                    5,
+                    _varint_field(1, location_id)
+                    + _varint_field(2, string_index(name))
+                    + _varint_field(3, string_index(name))
+                    + _varint_field(4, string_index(filename))
+                    + _varint_field(5, first_line),
+                )
+                line = _varint_field(1, location_id) + _varint_field(2, first_line)
+                locations += _bytes_field(4, _varint_field(1, location_id) + _bytes_field(4, line))
+            ids.append(location_id)
+
+        sample = _bytes_field(1, b"".join(_varint(i) for i in ids))
+        sample += _bytes_field(2, _varint(count) + _varint(count * period_nanos))
+        for key, value in (("site", site), ("route", route)):
+            sample += _bytes_field(3, _varint_field(1, string_index(key)) + _varint_field(2, string_index(value)))
+        body += _bytes_field(2, sample)
+
+    body += locations + functions
+    for value in strings:
+        body += _string_field(6, value)
+    body += _varint_field(9, int(started_at * 1e9))
+    body += _varint_field(10, int((time.time() - started_at) * 1e9))
+    body += _bytes_field(11, value_type("wall", "nanoseconds"))
+    body += _varint_field(12, period_nanos)
+    return gzip.compress(body)
+
+
+class ProfilerCollector:
+    """
+    Exposes the sample counts of the profiler of the process serving the
+    scrape and the functions with the most self samples, labelled with its pid.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        profiler = _profiler
+        if profiler is None:
+            return
+
+        pid = str(os.getpid())
+        samples = CounterMetricFamily(
+            "frappe_profiler_samples",
+            "Stack samples taken by the sampling profiler in this process",
+            labels=["pid"],
+        )
+        samples.add_metric([pid], profiler.samples)
+        yield samples
+        overhead = CounterMetricFamily(
+            "frappe_profiler_overhead_seconds",
+            "Time the sampling profiler spent taking samples in this process",
+            labels=["pid"],
+        )
+        overhead.add_metric([pid], profiler.overhead_seconds)
+        yield overhead
+
+        _stacks, functions = profiler.snapshot()
+        top = sorted(functions.items(), key=lambda item: (-item[1][0], -item[1][1]))[:TOP_FUNCTIONS]
+        self_samples = CounterMetricFamily(
+            "frappe_profiler_function_self_samples",
+            "Samples in which the function was running, for the functions with the most",
+            labels=["site", "function", "pid"],
+        )
+        total_samples = CounterMetricFamily(
+            "frappe_profiler_function_samples",
+            "Samples in which the function was on the stack, for the functions with the most self samples",
+            labels=["site", "function", "pid"],
+        )
+        for (site, label), (self_count, total_count) in top:
+            self_samples.add_metric([site, label, pid], self_count)
+            total_samples.add_metric([site, label, pid], total_count)
+        yield self_samples
+        yield total_samples
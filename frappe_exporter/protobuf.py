@@ -0,0 +1,269 @@
+"""
+Serializer for the Prometheus protobuf exposition format
+(io.prometheus.client.MetricFamily, length-delimited), written directly from
+registry.collect() output so no protobuf runtime is needed.
+"""
+
+import math
+import struct
+
+CONTENT_TYPE_PROTOBUF = (
+    "application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited"
+)
+
+# io.prometheus.client.MetricType
+_COUNTER = 0
+_GAUGE = 1
+_SUMMARY = 2
+_UNTYPED = 3
+_HISTOGRAM = 4
+_GAUGE_HISTOGRAM = 5
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_BYTES = 2
+
+_pack_double = struct.Struct("<d").pack
+
+
+def _varint(value):
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _double_field(field, value):
+    return _key(field, _WIRE_FIXED64) + _pack_double(float(value))
+
+
+def _varint_field(field, value):
+    return _key(field, _WIRE_VARINT) + _varint(int(value))
+
+
+def _sint_field(field, value):
+    return _key(field, _WIRE_VARINT) + _varint(_zigzag(int(value)))
+
+
+def _bytes_field(field, payload):
+    return _key(field, _WIRE_BYTES) + _varint(len(payload)) + payload
+
+
+def _string_field(field, value):
+    return _bytes_field(field, value.encode("utf-8"))
+
+
+def _label_pairs(field, labels):
+    return b"".join(
+        _bytes_field(field, _string_field(1, name) + _string_field(2, str(value)))
+        for name, value in sorted(labels.items())
+    )
+
+
+def _seconds(timestamp):
+    # Sample timestamps are either floats or prometheus_client Timestamp objects
+    if hasattr(timestamp, "sec"):
+        return timestamp.sec + timestamp.nsec / 1e9
+    return float(timestamp)
+
+
+def _timestamp_message(timestamp):
+    seconds = _seconds(timestamp)
+    whole = math.floor(seconds)
+    nanos = round((seconds - whole) * 1e9)
+    body = b""
+    if whole:
+        body += _varint_field(1, whole)
+    if nanos:
+        body += _varint_field(2, nanos)
+    return body
+
+
+def _exemplar(field, exemplar):
+    if exemplar is None:
+        return b""
+    body = _label_pairs(1, exemplar.labels) + _double_field(2, exemplar.value)
+    if exemplar.timestamp is not None:
+        body += _bytes_field(3, _timestamp_message(exemplar.timestamp))
+    return _bytes_field(field, body)
+
+
+def _native_histogram_fields(native):
+    # Fields 5-14 of io.prometheus.client.Histogram
+    body = _sint_field(5, native.schema)
+    body += _double_field(6, native.zero_threshold)
+    body += _varint_field(7, native.zero_count)
+    for field, spans in ((9, native.neg_spans), (12, native.pos_spans)):
+        for span in spans or ():
+            body += _bytes_field(field, _sint_field(1, span.offset) + _varint_field(2, span.length))
+    for field, deltas in ((10, native.neg_deltas), (13, native.pos_deltas)):
+        if deltas:
+            body += _bytes_field(field, b"".join(_varint(_zigzag(int(d))) for d in deltas))
+    if not native.pos_spans and not native.neg_spans and not native.zero_count:
+        # An empty span marks the histogram as native even with no observations
+        body += _bytes_field(12, _sint_field(1, 0) + _varint_field(2, 0))
+    return body
+
+
+class _MetricBuilder:
+    # Accumulates the samples of one label set of a metric family
+    __slots__ = (
+        "buckets",
+        "count",
+        "created",
+        "exemplar",
+        "labels",
+        "native",
+        "quantiles",
+        "sum",
+        "timestamp",
+        "value",
+    )
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = None
+        self.count = None
+        self.sum = None
+        self.created = None
+        self.exemplar = None
+        self.timestamp = None
+        self.native = None
+        self.buckets = []
+        self.quantiles = []
+
+    def encode(self, metric_type):
+        body = _label_pairs(1, self.labels)
+
+        if metric_type == _COUNTER:
+            counter = _double_field(1, self.value or 0.0) + _exemplar(2, self.exemplar)
+            if self.created is not None:
+                counter += _bytes_field(3, _timestamp_message(self.created))
+            body += _bytes_field(3, counter)
+        elif metric_type == _GAUGE:
+            body += _bytes_field(2, _double_field(1, self.value or 0.0))
+        elif metric_type == _SUMMARY:
+            summary = _varint_field(1, self.count or 0) + _double_field(2, self.sum or 0.0)
+            for quantile, value in self.quantiles:
+                summary += _bytes_field(3, _double_field(1, quantile) + _double_field(2, value))
+            if self.created is not None:
+                summary += _bytes_field(4, _timestamp_message(self.created))
+            body += _bytes_field(4, summary)
+        elif metric_type in (_HISTOGRAM, _GAUGE_HISTOGRAM):
+            native = self.native
+            count = self.count if self.count is not None else (native.count_value if native else 0)
+            total = self.sum if self.sum is not None else (native.sum_value if native else 0.0)
+            histogram = _varint_field(1, count) + _double_field(2, total)
+            for upper_bound, cumulative, exemplar in self.buckets:
+                # The +Inf bucket is implied by sample_count
+                if math.isinf(upper_bound):
+                    continue
+                histogram += _bytes_field(
+                    3,
+                    _varint_field(1, cumulative)
+                    + _double_field(2, upper_bound)
+                    + _exemplar(3, exemplar),
+                )
+            if native is not None:
+                histogram += _native_histogram_fields(native)
+            if self.created is not None:
+                histogram += _bytes_field(15, _timestamp_message(self.created))
+            body += _bytes_field(7, histogram)
+        else:
+            body += _bytes_field(5, _double_field(1, self.value or 0.0))
+
+        if self.timestamp is not None:
+            body += _varint_field(6, int(_seconds(self.timestamp) * 1000))
+        return body
+
+
+def _family_type(metric):
+    return {
+        "counter": _COUNTER,
+        "gauge": _GAUGE,
+        "summary": _SUMMARY,
+        "histogram": _HISTOGRAM,
+        "gaugehistogram": _GAUGE_HISTOGRAM,
+        "info": _GAUGE,
+        "stateset": _GAUGE,
+    }.get(metric.type, _UNTYPED)
+
+
+def _family_name(metric):
+    # The text formats append the suffix per sample; protobuf carries it in the family name
+    if metric.type == "counter":
+        return metric.name + "_total"
+    if metric.type == "info":
+        return metric.name + "_info"
+    return metric.name
+
+
+def _encode_family(metric):
+    metric_type = _family_type(metric)
+    name = metric.name
+    builders = {}
+
+    for sample in metric.samples:
+        labels = dict(sample.labels)
+        suffix = sample.name[len(name) :] if sample.name.startswith(name) else sample.name
+        quantile = bucket = None
+        if metric_type == _SUMMARY and "quantile" in labels:
+            quantile = float(labels.pop("quantile"))
+        elif metric_type in (_HISTOGRAM, _GAUGE_HISTOGRAM) and "le" in labels:
+            bucket = float(labels.pop("le"))
+
+        key = tuple(sorted(labels.items()))
+        builder = builders.get(key)
+        if builder is None:
+            builder = builders[key] = _MetricBuilder(labels)
+
+        if suffix == "_created":
+            builder.created = sample.value
+            continue
+        if sample.timestamp is not None:
+            builder.timestamp = sample.timestamp
+
+        if quantile is not None:
+            builder.quantiles.append((quantile, sample.value))
+        elif bucket is not None:
+            builder.buckets.append((bucket, sample.value, sample.exemplar))
+        elif suffix in ("_count", "_gcount"):
+            builder.count = sample.value
+        elif suffix in ("_sum", "_gsum"):
+            builder.sum = sample.value
+        elif getattr(sample, "native_histogram", None) is not None:
+            builder.native = sample.native_histogram
+        else:
+            builder.value = sample.value
+            builder.exemplar = sample.exemplar
+
+    if not builders:
+        return b""
+
+    body = _string_field(1, _family_name(metric))
+    if metric.documentation:
+        body += _string_field(2, metric.documentation)
+    body += _varint_field(3, metric_type)
+    for builder in builders.values():
+        body += _bytes_field(4, builder.encode(metric_type))
+    return _varint(len(body)) + body
+
+
+def generate_latest(registry):
+    """Returns the registry's metrics in the length-delimited protobuf format."""
+    output = []
+    for metric in registry.collect():
+        output.append(_encode_family(metric))
+    return b"".join(output)
@@ -0,0 +1,66 @@
+import logging
+
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+logger = logging.getLogger("frappe_exporter.queue_collector")
+
+
+def _queue_names():
+    from frappe.utils.background_jobs import get_queue_list
+
+    try:
+        from frappe.utils.background_jobs import generate_qname
+    except ImportError:
+        # Older Frappe versions use the plain queue name in Redis
+        def generate_qname(qtype):
+            return qtype
+
+    return [(queue, generate_qname(queue)) for queue in get_queue_list()]
+
+
+class QueueCollector:
+    """
+    Reports RQ queue lengths, failed job counts and worker counts at scrape
+    time. All values are read with a single pipelined Redis round trip.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        try:
+            from frappe.utils.background_jobs import get_redis_conn
+
+            queues = _queue_names()
+            conn = get_redis_conn()
+            pipe = conn.pipeline(transaction=False)
+            for _queue, qname in queues:
+                pipe.llen(f"rq:queue:{qname}")
+                pipe.zcard(f"rq:failed:{qname}")
+                pipe.scard(f"rq:workers:{qname}")
+            pipe.scard("rq:workers")
+            results = pipe.execute()
+        except Exception as e:
+            logger.debug(f"Could not read RQ queue state: {e}")
+            return
+
+        length = GaugeMetricFamily(
+            "frappe_rq_queue_length", "Number of jobs waiting in each RQ queue", labels=["queue"]
+        )
+        failed = GaugeMetricFamily(
+            "frappe_rq_failed_jobs", "Number of jobs in each RQ queue's failed registry", labels=["queue"]
+        )
+        workers = GaugeMetricFamily(
+            "frappe_rq_queue_workers", "Number of RQ workers listening on each queue", labels=["queue"]
+        )
+        for i, (queue, _qname) in enumerate(queues):
+            length.add_metric([queue], results[3 * i])
+            failed.add_metric([queue], results[3 * i + 1])
+            workers.add_metric([queue], results[3 * i + 2])
+
+        yield length
+        yield failed
+        yield workers
+        yield GaugeMetricFamily(
+            "frappe_rq_workers", "Total number of registered RQ workers", value=results[-1]
+        )
@@ -0,0 +1,310 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+import frappe
+
+logger = logging.getLogger("frappe_exporter.recorder")
+
+DEFAULT_FLUSH_INTERVAL_MS = 1000
+
+# Buffered action carrying a (value, weight) pair, see record_weighted
+WEIGHTED_OBSERVE = "observe_weighted"
+# Buffered action carrying a request's merged histogram observations, see RequestAccumulator
+ACCUMULATED_OBSERVE = "observe_accumulated"
+
+# frappe.local attribute holding the RequestAccumulator of the current request or job
+ACCUMULATOR_ATTR = "frappe_exporter_accumulator"
+
+# One deque per thread. Appending and popping from opposite ends of a deque is
+# thread-safe without a lock, so request threads never wait on the flusher.
+_buffers = []
+_buffers_lock = threading.Lock()
+_local = threading.local()
+
+_flusher = None
+_flusher_lock = threading.Lock()
+_flush_interval = DEFAULT_FLUSH_INTERVAL_MS / 1000.0
+
+
+def record_direct(child, action, value):
+    getattr(child, action)(value)
+
+
+def _check_increment(child, value):
+    # Increments are summed before they are applied, so a negative Counter
+    # increment has to fail here, as in Counter.inc, or it would net against
+    # the positive ones
+    if value < 0 and getattr(child, "_type", None) == "counter":
+        raise ValueError("Counters can only be incremented by non-negative amounts.")
+
+
+def record_buffered(child, action, value):
+    if action == "inc":
+        _check_increment(child, value)
+    elif action == "dec":
+        _check_increment(child, -value)
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _register_thread_buffer()
+    buffer.append((child, action, value))
+    if _flusher is None:
+        _start_flusher()
+
+
+def observe_weighted(child, value, weight):
+    """
+    Records `value` on a Histogram or Summary child as if it had been observed
+    `weight` times, so a sample of 1 in N calls keeps count, sum and bucket
+    distribution unbiased.
+    """
+    native_observe = getattr(child, "observe_weighted", None)
+    if native_observe is not None:
+        native_observe(value, weight)
+        return
+    child._sum.inc(value * weight)
+    upper_bounds = getattr(child, "_upper_bounds", None)
+    if upper_bounds is None:
+        child._count.inc(weight)
+        return
+    for i, bound in enumerate(upper_bounds):
+        if value <= bound:
+            child._buckets[i].inc(weight)
+            break
+
+
+def observe_accumulated(child, total, counts):
+    # Applies a sum and {bucket index (-1 for summaries): count} merged by a RequestAccumulator
+    child._sum.inc(total)
+    for index, count in counts.items():
+        if index < 0:
+            child._count.inc(count)
+        else:
+            child._buckets[index].inc(count)
+
+
+def record_weighted(record, child, value, weight):
+    # Weighted counterpart of record(child, "observe", value)
+    if weight == 1:
+        record(child, "observe", value)
+    elif record is record_direct:
+        observe_weighted(child, value, weight)
+    else:
+        record(child, WEIGHTED_OBSERVE, (value, weight))
+
+
+class RequestAccumulator:
+    """
+    Collects the observations of one request or background job, merged per
+    metric child: increments are summed and histogram observations are
+    reduced to per-bucket counts and a sum. `apply` writes them once at the
+    end, so a label set updated N times during the request takes its locks
+    once instead of N times. With buffered recording they are queued for the
+    background flusher instead.
+    """
+
+    __slots__ = ("get_doc_calls", "increments", "native_observations", "observations")
+
+    def __init__(self):
+        self.increments = {}
+        # child -> [sum, {bucket index (-1 for summaries): count}]
+        self.observations = {}
+        # Native histogram or sketch child -> [(value, weight)], as only the child knows its buckets
+        self.native_observations = {}
+        self.get_doc_calls = 0
+
+    def record(self, child, action, value):
+        if action == "inc":
+            _check_increment(child, value)
+            self.increments[child] = self.increments.get(child, 0.0) + value
+        elif action == "dec":
+            _check_increment(child, -value)
+            self.increments[child] = self.increments.get(child, 0.0) - value
+        elif action == "observe":
+            self._observe(child, value, 1)
+        elif action == WEIGHTED_OBSERVE:
+            self._observe(child, *value)
+        else:
+            if action == "set" and child in self.increments:
+                # Keep ordering for gauges that are both incremented and set
+                child.inc(self.increments.pop(child))
+            getattr(child, action)(value)
+
+    def _observe(self, child, value, weight):
+        if hasattr(child, "observe_many"):
+            self.native_observations.setdefault(child, []).append((value, weight))
+            return
+        entry = self.observations.get(child)
+        if entry is None:
+            entry = self.observations[child] = [0.0, {}]
+        entry[0] += value * weight
+        upper_bounds = getattr(child, "_upper_bounds", None)
+        # First bucket whose upper bound is >= value, as in Histogram.observe
+        index = bisect_left(upper_bounds, value) if upper_bounds is not None else -1
+        entry[1][index] = entry[1].get(index, 0) + weight
+
+    def apply(self, record=record_direct):
+        for child, value in self.increments.items():
+            try:
+                record(child, "inc", value)
+            except Exception as e:
+                logger.error(f"Failed to apply accumulated increment: {e}")
+
+        for child, (total, counts) in self.observations.items():
+            try:
+                if record is record_direct:
+                    observe_accumulated(child, total, counts)
+                else:
+                    record(child, ACCUMULATED_OBSERVE, (total, counts))
+            except Exception as e:
+                logger.error(f"Failed to apply accumulated observations: {e}")
+
+        for child, observations in self.native_observations.items():
+            try:
+                record(child, "observe_many", observations)
+            except Exception as e:
+                logger.error(f"Failed to apply accumulated observations: {e}")
+
+        self.increments = {}
+        self.observations = {}
+        self.native_observations = {}
+
+
+def get_request_accumulator():
+    return getattr(frappe.local, ACCUMULATOR_ATTR, None)
+
+
+def start_request_accumulator():
+    accumulator = RequestAccumulator()
+    setattr(frappe.local, ACCUMULATOR_ATTR, accumulator)
+    return accumulator
+
+
+def finish_request_accumulator(settings=None):
+    """
+    Detaches the current accumulator and applies it, through the background
+    flusher if `settings` enable buffered recording; returns it, or None if
+    there was none.
+    """
+    accumulator = getattr(frappe.local, ACCUMULATOR_ATTR, None)
+    if accumulator is None:
+        return None
+    setattr(frappe.local, ACCUMULATOR_ATTR, None)
+    accumulator.apply(get_recorder(settings) if settings is not None else record_direct)
+    return accumulator
+
+
+def get_recorder(settings):
+    """
+    Returns the function used to apply an observation to a resolved metric
+    child: `record(child, action, value)`. Inside a request or job the
+    observation goes to its RequestAccumulator; otherwise, with buffered
+    recording enabled, it is queued and applied by the background flusher.
+    """
+    accumulator = getattr(frappe.local, ACCUMULATOR_ATTR, None)
+    if accumulator is not None:
+        return accumulator.record
+
+    if not settings.values.get("buffered_recording"):
+        return record_direct
+
+    global _flush_interval
+    _flush_interval = (settings.values.get("flush_interval_ms") or DEFAULT_FLUSH_INTERVAL_MS) / 1000.0
+    return record_buffered
+
+
+def _register_thread_buffer():
+    buffer = deque()
+    _local.buffer = buffer
+    with _buffers_lock:
+        _buffers.append((threading.current_thread(), buffer))
+    return buffer
+
+
+def flush_buffers():
+    """
+    Applies every queued observation to its metric. Increments of the same
+    child are summed so each child is locked once per flush.
+    """
+    increments = {}
+    applied = 0
+
+    with _buffers_lock:
+        buffers = list(_buffers)
+
+    for _thread, buffer in buffers:
+        while True:
+            try:
+                child, action, value = buffer.popleft()
+            except IndexError:
+                break
+            applied += 1
+            if action == "inc":
+                increments[child] = increments.get(child, 0.0) + value
+                continue
+            if action == "dec":
+                increments[child] = increments.get(child, 0.0) - value
+                continue
+            try:
+                if action == WEIGHTED_OBSERVE:
+                    observe_weighted(child, *value)
+                    continue
+                if action == ACCUMULATED_OBSERVE:
+                    observe_accumulated(child, *value)
+                    continue
+                if action == "set" and child in increments:
+                    # Keep ordering for gauges that are both incremented and set
+                    child.inc(increments.pop(child))
+                getattr(child, action)(value)
+            except Exception as e:
+                logger.error(f"Failed to apply buffered '{action}': {e}")
+
+    for child, value in increments.items():
+        try:
+            child.inc(value)
+        except Exception as e:
+            logger.error(f"Failed to apply buffered increment: {e}")
+
+    _prune_dead_buffers()
+    return applied
+
+
+def _prune_dead_buffers():
+    with _buffers_lock:
+        _buffers[:] = [
+            (thread, buffer) for thread, buffer in _buffers if thread.is_alive() or buffer
+        ]
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_flush_interval)
+        try:
+            flush_buffers()
+        except Exception as e:
+            logger.error(f"Metric flusher failed: {e}", exc_info=True)
+
+
+def _start_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_loop, name="frappe-exporter-flusher", daemon=True
+            )
+            _flusher.start()
+
+
+def _reset_after_fork():
+    # Threads do not survive fork. Observations queued in the parent belong to
+    # the parent; replaying them in the child would count them twice.
+    global _flusher
+    _flusher = None
+    for _thread, buffer in _buffers:
+        buffer.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
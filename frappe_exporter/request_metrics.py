@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import frappe
+
+from .instrumentation import sync_instrumentation
+from .label_cache import label_cache_for
+from .metrics_handler import (
+    GET_DOC_CALLS_PER_REQUEST,
+    HTTP_REQUEST_DURATION_SECONDS,
+    HTTP_REQUESTS_IN_FLIGHT,
+    HTTP_RESPONSE_SIZE_BYTES,
+    run_housekeeping,
+)
+from .profiler import get_profiler, tag_current_thread, untag_current_thread
+from .recorder import finish_request_accumulator, get_recorder, start_request_accumulator
+from .settings import get_site_settings
+
+logger = logging.getLogger("frappe_exporter.request_metrics")
+
+_request_duration = label_cache_for(HTTP_REQUEST_DURATION_SECONDS)
+_response_size = label_cache_for(HTTP_RESPONSE_SIZE_BYTES)
+_in_flight = label_cache_for(HTTP_REQUESTS_IN_FLIGHT)
+_get_doc_calls = label_cache_for(GET_DOC_CALLS_PER_REQUEST)
+
+# Path -> route template, so each distinct path is normalized once
+ROUTE_CACHE_SIZE = 2048
+_route_cache = OrderedDict()
+_route_cache_lock = threading.Lock()
+
+# Top-level path segments kept as their own route; anything beyond this
+# becomes "other" so scanners probing random URLs cannot add series.
+MAX_ROUTE_ROOTS = 100
+OTHER_ROUTE = "other"
+_route_roots = set()
+
+# Prefix -> number of dynamic segments after it, most specific first
+_API_TEMPLATES = (
+    ("/api/method/", ("<method>",)),
+    ("/api/v1/method/", ("<method>",)),
+    ("/api/v2/method/", ("<method>",)),
+    ("/api/resource/", ("<doctype>", "<name>")),
+    ("/api/v1/resource/", ("<doctype>", "<name>")),
+    ("/api/v2/document/", ("<doctype>", "<name>", "<method>")),
+    ("/api/v2/doctype/", ("<doctype>", "<method>")),
+)
+
+# Prefixes whose remaining path is collapsed into a single placeholder
+_PATH_PREFIXES = ("/app", "/assets", "/files", "/private/files", "/socket.io", "/desk")
+
+_START_ATTR = "frappe_exporter_request_start"
+
+
+def normalize_route(path):
+    """Maps a request path to a bounded route template, e.g. /api/resource/<doctype>/<name>."""
+    template = _route_cache.get(path)
+    if template is not None:
+        return template
+
+    template = _build_route_template(path)
+    with _route_cache_lock:
+        _route_cache[path] = template
+        while len(_route_cache) > ROUTE_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+    return template
+
+
+def _build_route_template(path):
+    path = "/" + path.strip("/") if path else "/"
+
+    for prefix, placeholders in _API_TEMPLATES:
+        if path.startswith(prefix):
+            segments = [s for s in path[len(prefix) :].split("/") if s]
+            return prefix + "/".join(placeholders[: max(1, min(len(segments), len(placeholders)))])
+
+    for prefix in _PATH_PREFIXES:
+        if path == prefix:
+            return prefix
+        if path.startswith(prefix + "/"):
+            return prefix + "/<path>"
+
+    if path == "/":
+        return "/"
+
+    root, _, rest = path[1:].partition("/")
+    if root not in _route_roots:
+        if len(_route_roots) >= MAX_ROUTE_ROOTS:
+            return OTHER_ROUTE
+        _route_roots.add(root)
+    return f"/{root}/<path>" if rest else f"/{root}"
+
+
+def before_request():
+    site = getattr(frappe.local, "site", None) or "unknown_site"
+    setattr(frappe.local, _START_ATTR, (time.monotonic(), site))
+    _in_flight.get(site).inc()
+    # Wraps or unwraps the functions listed in the settings once they change
+    sync_instrumentation(get_site_settings())
+    # Metric updates made while handling the request are merged and applied in after_request
+    start_request_accumulator()
+
+    if get_profiler() is not None:
+        request = frappe.request
+        tag_current_thread(site, normalize_route(request.path if request is not None else ""))
+
+
+def _response_size_bytes(response):
+    if response is None or getattr(response, "is_streamed", False):
+        return None
+    size = response.content_length
+    if size is None:
+        size = response.calculate_content_length()
+    return size
+
+
+def after_request(response=None, request=None):
+    started = getattr(frappe.local, _START_ATTR, None)
+    if not started:
+        return
+    setattr(frappe.local, _START_ATTR, None)
+
+    start_time, site = started
+    duration_seconds = time.monotonic() - start_time
+    _in_flight.get(site).dec()
+    accumulator = finish_request_accumulator(get_site_settings())
+    untag_current_thread()
+
+    try:
+        request = request or frappe.request
+        route = normalize_route(request.path if request is not None else "")
+        method = request.method if request is not None else "UNKNOWN"
+        status_code = getattr(response, "status_code", None) or 500
+        status_class = f"{status_code // 100}xx"
+
+        record = get_recorder(get_site_settings())
+        record(_request_duration.get(site, route, method, status_class), "observe", duration_seconds)
+
+        size = _response_size_bytes(response)
+        if size is not None:
+            record(_response_size.get(site, route, method), "observe", size)
+
+        if accumulator is not None:
+            record(_get_doc_calls.get(site, route), "observe", accumulator.get_doc_calls)
+    except Exception as e:
+        logger.debug(f"Failed to record request metrics: {e}")
+
+    # Rate limited; drops idle sites and series that have not been used for a while
+    run_housekeeping()
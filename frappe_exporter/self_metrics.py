@@ -0,0 +1,181 @@
+"""
+Metrics about the exporter itself: time spent in its own bookkeeping, how
+often the settings snapshot is served from memory, and the cost of scrapes.
+
+Hot path counters live in a per-thread ThreadStats that only its own thread
+writes, so recording them takes no lock. They are summed at scrape time;
+stats of finished threads are folded into a retired total.
+"""
+
+import os
+import threading
+
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily, SummaryMetricFamily
+
+
+class ThreadStats:
+    __slots__ = (
+        "get_doc_calls",
+        "get_doc_seconds",
+        "get_list_calls",
+        "get_list_seconds",
+        "settings_hits",
+        "settings_loads",
+        "settings_misses",
+        "update_metric_calls",
+        "update_metric_seconds",
+    )
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, 0)
+
+    def add(self, other):
+        for field in self.__slots__:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+
+_local = threading.local()
+_threads = []
+_threads_lock = threading.Lock()
+_retired = ThreadStats()
+
+# format -> [serializations, total seconds, last payload bytes, last sample count]
+_scrapes = {}
+_scrapes_lock = threading.Lock()
+
+
+def thread_stats():
+    """Returns the calling thread's ThreadStats; only that thread may modify it."""
+    stats = getattr(_local, "stats", None)
+    if stats is None:
+        stats = _local.stats = ThreadStats()
+        with _threads_lock:
+            _threads.append((threading.current_thread(), stats))
+    return stats
+
+
+def totals():
+    """Sums the stats of every thread, folding finished threads into the retired total."""
+    total = ThreadStats()
+    with _threads_lock:
+        alive = []
+        for thread, stats in _threads:
+            if thread.is_alive():
+                alive.append((thread, stats))
+            else:
+                _retired.add(stats)
+        _threads[:] = alive
+        total.add(_retired)
+        for _thread, stats in alive:
+            total.add(stats)
+    return total
+
+
+def record_scrape(fmt, seconds, payload_bytes, samples):
+    with _scrapes_lock:
+        entry = _scrapes.get(fmt)
+        if entry is None:
+            entry = _scrapes[fmt] = [0, 0.0, 0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = payload_bytes
+        entry[3] = samples
+
+
+class SelfMetricsCollector:
+    """
+    Exposes the exporter's own overhead, as measured by the process serving
+    the scrape. Every series carries that process's pid, so values of
+    different workers are never mistaken for one counter going back and forth.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        total = totals()
+        pid = str(os.getpid())
+
+        wrapper_seconds = CounterMetricFamily(
+            "frappe_exporter_wrapper_overhead_seconds",
+            "Time the get_doc/get_list wrappers spend recording metrics after the wrapped call, "
+            "estimated from the sampled calls",
+            labels=["method", "pid"],
+        )
+        wrapper_calls = CounterMetricFamily(
+            "frappe_exporter_wrapper_calls",
+            "Calls that went through the get_doc/get_list wrappers",
+            labels=["method", "pid"],
+        )
+        for method in ("get_doc", "get_list"):
+            wrapper_seconds.add_metric([method, pid], getattr(total, f"{method}_seconds"))
+            wrapper_calls.add_metric([method, pid], getattr(total, f"{method}_calls"))
+        yield wrapper_seconds
+        yield wrapper_calls
+
+        update_seconds = CounterMetricFamily(
+            "frappe_exporter_update_metric_seconds", "Time spent in update_metric", labels=["pid"]
+        )
+        update_seconds.add_metric([pid], total.update_metric_seconds)
+        yield update_seconds
+        update_calls = CounterMetricFamily(
+            "frappe_exporter_update_metric_calls", "Calls to update_metric", labels=["pid"]
+        )
+        update_calls.add_metric([pid], total.update_metric_calls)
+        yield update_calls
+
+        lookups = CounterMetricFamily(
+            "frappe_exporter_whitelist_cache_lookups",
+            "Lookups of the cached settings snapshot (DocType whitelist, sampling, custom metrics): "
+            "served from memory (hit) or after checking the settings version in Redis (miss)",
+            labels=["result", "pid"],
+        )
+        lookups.add_metric(["hit", pid], total.settings_hits)
+        lookups.add_metric(["miss", pid], total.settings_misses)
+        yield lookups
+        loads = CounterMetricFamily(
+            "frappe_exporter_settings_loads", "Settings snapshots loaded from the database", labels=["pid"]
+        )
+        loads.add_metric([pid], total.settings_loads)
+        yield loads
+
+        with _scrapes_lock:
+            scrapes = {fmt: list(entry) for fmt, entry in _scrapes.items()}
+        duration = SummaryMetricFamily(
+            "frappe_exporter_scrape_duration_seconds",
+            "Time spent serializing scrapes, by exposition format",
+            labels=["format", "pid"],
+        )
+        payload = GaugeMetricFamily(
+            "frappe_exporter_scrape_payload_bytes",
+            "Uncompressed size of the last serialized scrape, by exposition format",
+            labels=["format", "pid"],
+        )
+        samples = GaugeMetricFamily(
+            "frappe_exporter_scrape_samples",
+            "Samples in the last serialized scrape, by exposition format",
+            labels=["format", "pid"],
+        )
+        for fmt, (count, seconds, payload_bytes, sample_count) in scrapes.items():
+            duration.add_metric([fmt, pid], count, seconds)
+            payload.add_metric([fmt, pid], payload_bytes)
+            samples.add_metric([fmt, pid], sample_count)
+        yield duration
+        yield payload
+        yield samples
+
+
+def _reset_after_fork():
+    # Work done by the parent is reported by the parent. Locks are replaced in
+    # case another thread of the parent held them while forking.
+    global _retired, _threads_lock, _scrapes_lock
+    _threads_lock = threading.Lock()
+    _scrapes_lock = threading.Lock()
+    _threads[:] = []
+    _retired = ThreadStats()
+    _local.stats = None
+    _scrapes.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
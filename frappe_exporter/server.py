@@ -0,0 +1,96 @@
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .exposition import SiteView, get_scrape_payload
+from .multiprocess import (
+    compact_dead_process_files,
+    get_aggregated_registry,
+    is_multiprocess_enabled,
+)
+
+logger = logging.getLogger("frappe_exporter.server")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9877
+METRICS_PATH = "/metrics"
+# /metrics/<site> serves the series of a single site
+SITE_METRICS_PREFIX = METRICS_PATH + "/"
+
+
+def _prepare_registry():
+    registry = get_aggregated_registry()
+    compact_dead_process_files()
+    return registry
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # Set by serve(); seconds to reuse a serialized payload
+    cache_ttl = 0.0
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/healthz":
+            self._send(200, b"OK\n", "text/plain; charset=utf-8")
+            return
+        site = None
+        if path.startswith(SITE_METRICS_PREFIX):
+            site = path[len(SITE_METRICS_PREFIX) :]
+            path = METRICS_PATH if site and "/" not in site else None
+        if path != METRICS_PATH:
+            self._send(404, b"Not Found\n", "text/plain; charset=utf-8")
+            return
+
+        get_registry = _prepare_registry
+        if site is not None:
+            get_registry = lambda: SiteView(_prepare_registry(), site)  # noqa: E731
+
+        try:
+            payload = get_scrape_payload(
+                get_registry,
+                accept=self.headers.get("Accept"),
+                accept_encoding=self.headers.get("Accept-Encoding"),
+                ttl=self.cache_ttl,
+                scope=("server", site),
+            )
+        except Exception as e:
+            logger.error(f"Failed to collect metrics: {e}", exc_info=True)
+            self._send(500, b"Failed to collect metrics\n", "text/plain; charset=utf-8")
+            return
+
+        self._send(200, payload.body, payload.content_type, payload.headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, cache_ttl=0.0):
+    """
+    Serves the bench-wide metrics of all sites on http://host:port/metrics, and
+    those of a single site on /metrics/<site>, straight from the multiprocess
+    metric files, without a site, database connection or gunicorn worker.
+    Blocks until interrupted.
+    """
+    if not is_multiprocess_enabled():
+        raise RuntimeError(
+            "The standalone metrics server needs multiprocess mode. Set "
+            "'frappe_exporter_multiprocess_dir' in common_site_config.json or the "
+            "PROMETHEUS_MULTIPROC_DIR environment variable."
+        )
+
+    handler = type("MetricsRequestHandler", (MetricsRequestHandler,), {"cache_ttl": float(cache_ttl)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(f"Serving metrics on http://{host}:{port}{METRICS_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+
+import frappe
+
+from .self_metrics import thread_stats
+
+logger = logging.getLogger("frappe_exporter.settings")
+
+SETTINGS_DOCTYPE = "Frappe Exporter Settings"
+
+# Bumped by FrappeExporterSettings.on_update. Every process compares it with
+# the version its snapshot was built from and reloads when they differ.
+SETTINGS_VERSION_KEY = "frappe_exporter_settings_version"
+
+# How long a process trusts its snapshot before re-reading the version key.
+# Keeps the hot path free of Redis calls; changes propagate within this window.
+VERSION_CHECK_INTERVAL_SECONDS = 2.0
+
+# Series a site may create per metric when no limit is configured for it; 0 is unlimited
+DEFAULT_SERIES_LIMIT = 0
+
+# get_doc/get_list durations are recorded for 1 in N calls; N while
+# frappe.flags.in_import is set, unless configured
+DEFAULT_BATCH_SAMPLE_EVERY = 100
+
+
+class SiteSettings:
+    """
+    Snapshot of a site's Frappe Exporter Settings, shared by every thread of
+    the process until the settings version changes.
+    """
+
+    __slots__ = (
+        "batch_sample_every",
+        "checked_at",
+        "custom_metrics",
+        "default_series_limit",
+        "doctype_sample_every",
+        "enabled",
+        "instrumented_functions",
+        "loaded",
+        "sample_every",
+        "series_limits",
+        "values",
+        "version",
+        "whitelist",
+        "whitelisting_enabled",
+    )
+
+    def __init__(
+        self,
+        version=None,
+        values=None,
+        whitelist=(),
+        custom_metrics=None,
+        series_limits=None,
+        doctype_sample_every=None,
+        instrumented_functions=None,
+    ):
+        self.version = version
+        # False for placeholder snapshots used when settings could not be read
+        self.loaded = values is not None
+        self.values = frappe._dict(values or {})
+        self.enabled = bool(self.values.get("enabled"))
+        self.whitelisting_enabled = self.enabled and bool(self.values.get("whitelisting_enabled"))
+        self.whitelist = frozenset(whitelist)
+        self.custom_metrics = tuple(custom_metrics or ())
+        self.series_limits = dict(series_limits or {})
+        default_series_limit = self.values.get("default_series_limit")
+        if default_series_limit is None:
+            default_series_limit = DEFAULT_SERIES_LIMIT
+        self.default_series_limit = int(default_series_limit)
+        self.sample_every = max(1, int(self.values.get("sample_every") or 1))
+        batch_sample_every = self.values.get("batch_sample_every")
+        if batch_sample_every is None:
+            batch_sample_every = DEFAULT_BATCH_SAMPLE_EVERY
+        self.batch_sample_every = max(1, int(batch_sample_every or 1))
+        self.doctype_sample_every = dict(doctype_sample_every or {})
+        # dotted path -> (label extractor, label argument, buckets), see instrumentation.py
+        self.instrumented_functions = dict(instrumented_functions or {})
+        self.checked_at = time.monotonic()
+
+    def is_doctype_whitelisted(self, doctype):
+        if not self.whitelisting_enabled:
+            return True
+        return doctype in self.whitelist
+
+    def get_sample_every(self, doctype=None, batch=False):
+        # N in "record durations for 1 in N calls" for a doctype
+        sample_every = self.doctype_sample_every.get(doctype, self.sample_every)
+        if batch and self.batch_sample_every > sample_every:
+            return self.batch_sample_every
+        return sample_every
+
+    def series_limit(self, *metric_names):
+        # Maximum series per metric for this site; 0 means unlimited
+        for metric_name in metric_names:
+            limit = self.series_limits.get(metric_name)
+            if limit is not None:
+                return limit
+        return self.default_series_limit
+
+
+# Returned while a snapshot is being loaded (database calls made by the loader
+# may be instrumented themselves) and when no site is active.
+DEFAULT_SETTINGS = SiteSettings()
+
+_site_settings = {}
+_load_guard = threading.local()
+
+
+def get_settings_version():
+    return frappe.cache().get_value(SETTINGS_VERSION_KEY)
+
+
+def _load_site_settings(version):
+    values = frappe.db.get_singles_dict(SETTINGS_DOCTYPE)
+    whitelist = ()
+    if values.get("enabled") and values.get("whitelisting_enabled"):
+        rows = frappe.db.get_values(
+            "Whitelisted Doctype",
+            {"parent": SETTINGS_DOCTYPE, "parenttype": SETTINGS_DOCTYPE},
+            "doctype_name",
+        )
+        whitelist = [row[0] for row in rows if row[0]]
+    custom_metrics = ()
+    if values.get("enabled"):
+        custom_metrics = frappe.db.get_values(
+            "Prometheus Custom Metric",
+            {"parent": SETTINGS_DOCTYPE, "parenttype": SETTINGS_DOCTYPE},
+            ["metric_name", "metric_type", "help_text", "label_names", "quantiles"],
+            as_dict=True,
+            order_by="idx",
+        )
+    series_limits = {}
+    if values.get("enabled"):
+        rows = frappe.db.get_values(
+            "Metric Series Limit",
+            {"parent": SETTINGS_DOCTYPE, "parenttype": SETTINGS_DOCTYPE},
+            ["metric_name", "max_series"],
+        )
+        series_limits = {name: int(limit or 0) for name, limit in rows if name}
+    doctype_sample_every = {}
+    if values.get("enabled"):
+        rows = frappe.db.get_values(
+            "Doctype Sampling Rate",
+            {"parent": SETTINGS_DOCTYPE, "parenttype": SETTINGS_DOCTYPE},
+            ["doctype_name", "sample_every"],
+        )
+        doctype_sample_every = {name: max(1, int(n or 1)) for name, n in rows if name}
+    instrumented_functions = {}
+    if values.get("enabled"):
+        rows = frappe.db.get_values(
+            "Instrumented Function",
+            {"parent": SETTINGS_DOCTYPE, "parenttype": SETTINGS_DOCTYPE},
+            ["function_path", "label_extractor", "label_argument", "buckets"],
+            order_by="idx",
+        )
+        instrumented_functions = {
+            path.strip(): (extractor or "None", (argument or "").strip(), buckets or "")
+            for path, extractor, argument, buckets in rows
+            if path and path.strip()
+        }
+    return SiteSettings(
+        version,
+        values,
+        whitelist,
+        custom_metrics,
+        series_limits,
+        doctype_sample_every,
+        instrumented_functions,
+    )
+
+
+def get_site_settings():
+    """
+    Returns the settings snapshot for the current site. Costs a dict lookup,
+    a clock read and a per-thread counter increment on the hot path; Redis is consulted at most once per
+    VERSION_CHECK_INTERVAL_SECONDS per site and process.
+    """
+    site = getattr(frappe.local, "site", None)
+    if not site or getattr(_load_guard, "active", False):
+        return DEFAULT_SETTINGS
+
+    settings = _site_settings.get(site)
+    now = time.monotonic()
+    stats = thread_stats()
+    if settings is not None and now - settings.checked_at < VERSION_CHECK_INTERVAL_SECONDS:
+        stats.settings_hits += 1
+        return settings
+
+    stats.settings_misses += 1
+
+    _load_guard.active = True
+    try:
+        try:
+            version = get_settings_version()
+        except Exception as e:
+            logger.debug(f"Could not read settings version for site '{site}': {e}")
+            version = settings.version if settings is not None else None
+
+        if settings is not None and settings.version == version:
+            settings.checked_at = now
+            return settings
+
+        stats.settings_loads += 1
+        try:
+            settings = _load_site_settings(version)
+        except Exception as e:
+            # Settings missing (e.g. app not migrated yet): behave as if disabled and
+            # retry after the check interval instead of on every call.
+            logger.debug(f"Could not load Frappe Exporter Settings for site '{site}': {e}")
+            settings = SiteSettings(version)
+
+        _site_settings[site] = settings
+        return settings
+    finally:
+        _load_guard.active = False
+
+
+def get_loaded_site_settings():
+    # (site, snapshot) pairs of the sites this process has served. A snapshot's
+    # checked_at doubles as the time the site was last active, to within
+    # VERSION_CHECK_INTERVAL_SECONDS.
+    return list(_site_settings.items())
+
+
+def drop_site_settings(site):
+    _site_settings.pop(site, None)
+
+
+def invalidate_site_settings():
+    """Signals every process on the bench to reload the current site's settings."""
+    frappe.cache().set_value(SETTINGS_VERSION_KEY, frappe.generate_hash(length=12))
+    _site_settings.pop(getattr(frappe.local, "site", None), None)
@@ -0,0 +1,476 @@
+"""
+Quantile summaries backed by DDSketch, a mergeable sketch with a relative
+error guarantee: every reported quantile is within `relative_accuracy` of the
+true value, and sketches from different processes merge exactly.
+
+In multiprocess mode each process periodically writes its sketches to
+`sketch_<pid>.json` in the shared directory, and the scrape merges them
+with the live sketches of the process serving it.
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+from prometheus_client.metrics import MetricWrapperBase
+from prometheus_client.metrics_core import Metric
+from prometheus_client.samples import Sample
+
+from .multiprocess import _directory_lock, _is_pid_alive, get_multiprocess_dir, is_multiprocess_enabled
+
+logger = logging.getLogger("frappe_exporter.sketch")
+
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# At 1% accuracy, 1024 bins span about nine orders of magnitude (e.g. 1µs to
+# 15 minutes) before the smallest values are folded together.
+DEFAULT_MAX_BINS = 1024
+
+# Values closer to zero than this are counted as zero
+MIN_INDEXABLE_VALUE = 1e-9
+
+PERSIST_INTERVAL_SECONDS = 5.0
+_FILE_PREFIX = "sketch_"
+_ARCHIVE_PID = "archive"
+
+
+class DDSketch:
+    __slots__ = (
+        "_gamma",
+        "_log_gamma",
+        "count",
+        "max",
+        "max_bins",
+        "min",
+        "negative",
+        "positive",
+        "relative_accuracy",
+        "sum",
+        "zero_count",
+    )
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero_count = 0
+        # bin index -> count; bin i holds magnitudes in (gamma^(i-1), gamma^i]
+        self.positive = {}
+        self.negative = {}
+
+    def add(self, value, weight=1):
+        if math.isnan(value):
+            return
+        self.count += weight
+        self.sum += value * weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        magnitude = abs(value)
+        if magnitude < MIN_INDEXABLE_VALUE:
+            self.zero_count += weight
+            return
+        bins = self.positive if value > 0 else self.negative
+        index = math.ceil(math.log(min(magnitude, 1.7976931348623157e308)) / self._log_gamma)
+        bins[index] = bins.get(index, 0) + weight
+        if len(self.positive) + len(self.negative) > self.max_bins:
+            self._collapse()
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zero_count += other.zero_count
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in theirs.items():
+                mine[index] = mine.get(index, 0) + count
+        if len(self.positive) + len(self.negative) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # Folds the bins of the smallest magnitudes into one, so the accuracy
+        # guarantee is only lost for the lowest quantiles.
+        while len(self.positive) + len(self.negative) > self.max_bins:
+            bins = self.positive if len(self.positive) >= len(self.negative) else self.negative
+            excess = len(self.positive) + len(self.negative) - self.max_bins
+            lowest = sorted(bins)[: min(excess, len(bins) - 1) + 1]
+            folded = sum(bins.pop(index) for index in lowest)
+            bins[lowest[-1]] = folded
+
+    def _value(self, index):
+        # Midpoint of the bin in the sense of the relative error
+        return 2 * self._gamma**index / (self._gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self._value(index), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "accuracy": self.relative_accuracy,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "zero": self.zero_count,
+            "positive": list(self.positive.items()),
+            "negative": list(self.negative.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data, max_bins=DEFAULT_MAX_BINS):
+        sketch = cls(data["accuracy"], max_bins)
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if data["min"] is not None:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        sketch.zero_count = data["zero"]
+        sketch.positive = dict(data["positive"])
+        sketch.negative = dict(data["negative"])
+        return sketch
+
+    def __sizeof__(self):
+        # Two dict entries (an int key and a count) per bin
+        bins = len(self.positive) + len(self.negative)
+        return object.__sizeof__(self) + 2 * 64 + bins * 3 * 28
+
+
+# Parents (and label-less metrics) of every SketchSummary in this process
+_sketch_metrics = weakref.WeakSet()
+
+_dirty = False
+_persister = None
+_persister_lock = threading.Lock()
+
+
+def _quantile_label(q):
+    return repr(float(q))
+
+
+class SketchSummary(MetricWrapperBase):
+    """
+    Summary metric exporting `quantiles` (e.g. p50, p95, p99) estimated from a
+    DDSketch per series, alongside `_count` and `_sum`. Memory per series is
+    bounded by `max_bins`.
+    """
+
+    _type = "summary"
+    _reserved_labelnames = ("quantile",)
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        namespace="",
+        subsystem="",
+        unit="",
+        registry=None,
+        _labelvalues=None,
+        quantiles=DEFAULT_QUANTILES,
+        relative_accuracy=DEFAULT_RELATIVE_ACCURACY,
+        max_bins=DEFAULT_MAX_BINS,
+    ):
+        for q in quantiles:
+            if not 0 <= q <= 1:
+                raise ValueError(f"Quantile {q} must be between 0 and 1")
+        self._quantiles = tuple(sorted(quantiles))
+        self._relative_accuracy = relative_accuracy
+        self._max_bins = max_bins
+        super().__init__(
+            name=name,
+            documentation=documentation,
+            labelnames=labelnames,
+            namespace=namespace,
+            subsystem=subsystem,
+            unit=unit,
+            registry=registry,
+            _labelvalues=_labelvalues,
+        )
+        self._kwargs["quantiles"] = self._quantiles
+        self._kwargs["relative_accuracy"] = relative_accuracy
+        self._kwargs["max_bins"] = max_bins
+        if _labelvalues is None:
+            _sketch_metrics.add(self)
+
+    def _metric_init(self):
+        self._value_lock = threading.Lock()
+        self._sketch = DDSketch(self._relative_accuracy, self._max_bins)
+
+    def observe(self, amount, weight=1):
+        self._raise_if_not_observable()
+        with self._value_lock:
+            self._sketch.add(amount, weight)
+        _mark_dirty()
+
+    def observe_weighted(self, amount, weight):
+        self.observe(amount, weight)
+
+    def observe_many(self, observations):
+        # (amount, weight) pairs, applied under a single lock acquisition
+        self._raise_if_not_observable()
+        with self._value_lock:
+            for amount, weight in observations:
+                self._sketch.add(amount, weight)
+        _mark_dirty()
+
+    def snapshot(self):
+        with self._value_lock:
+            return DDSketch.from_dict(self._sketch.to_dict(), self._max_bins)
+
+    def _child_samples(self):
+        sketch = self.snapshot()
+        samples = [
+            Sample("", {"quantile": _quantile_label(q)}, sketch.quantile(q), None, None)
+            for q in self._quantiles
+        ]
+        samples.append(Sample("_count", {}, sketch.count, None, None))
+        samples.append(Sample("_sum", {}, sketch.sum, None, None))
+        return tuple(samples)
+
+
+def _series_of(metric):
+    # (label values, child) pairs of a parent, or the metric itself without labels
+    if metric._is_parent():
+        with metric._lock:
+            return list(metric._metrics.items())
+    return [((), metric)]
+
+
+def _dump_live_metrics():
+    dumped = []
+    for metric in list(_sketch_metrics):
+        series = [
+            {
+                "labels": dict(zip(metric._labelnames, labelvalues, strict=True)),
+                "sketch": child.snapshot().to_dict(),
+            }
+            for labelvalues, child in _series_of(metric)
+        ]
+        if series:
+            dumped.append(
+                {
+                    "name": metric._name,
+                    "documentation": metric._documentation,
+                    "quantiles": list(metric._quantiles),
+                    "series": series,
+                }
+            )
+    return dumped
+
+
+def _sketch_path(directory, pid):
+    return os.path.join(directory, f"{_FILE_PREFIX}{pid}.json")
+
+
+def _write_file(path, metrics):
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"metrics": metrics}, f)
+    os.replace(tmp_path, path)
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get("metrics", [])
+    except (OSError, ValueError) as e:
+        logger.debug(f"Skipping unreadable sketch file '{path}': {e}")
+        return []
+
+
+def persist_sketches():
+    """Writes this process's sketches to its file in the multiprocess directory."""
+    global _dirty
+
+    directory = get_multiprocess_dir()
+    if not directory:
+        return
+    _dirty = False
+    try:
+        _write_file(_sketch_path(directory, os.getpid()), _dump_live_metrics())
+    except Exception as e:
+        _dirty = True
+        logger.error(f"Failed to persist quantile sketches: {e}")
+
+
+def persist_dirty_sketches():
+    """Persists the sketches if anything was observed since they were last written."""
+    if _dirty:
+        persist_sketches()
+
+
+def _mark_dirty():
+    global _dirty
+    _dirty = True
+    if _persister is None and is_multiprocess_enabled():
+        _start_persister()
+
+
+def _persist_loop():
+    while True:
+        time.sleep(PERSIST_INTERVAL_SECONDS)
+        persist_dirty_sketches()
+
+
+def _start_persister():
+    global _persister
+    with _persister_lock:
+        if _persister is None:
+            _persister = threading.Thread(
+                target=_persist_loop, name="frappe-exporter-sketches", daemon=True
+            )
+            _persister.start()
+            atexit.register(persist_sketches)
+
+
+def _reset_after_fork():
+    # The parent's observations are its own to persist. The child empties the
+    # sketches it inherited, in place since label caches hold the children,
+    # so its file and live values only carry what it observes itself.
+    global _persister, _dirty
+    _persister = None
+    _dirty = False
+    for metric in list(_sketch_metrics):
+        children = list(metric._metrics.values()) if metric._is_parent() else [metric]
+        for child in children:
+            child._metric_init()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _MergedFamily:
+    __slots__ = ("documentation", "quantiles", "series")
+
+    def __init__(self, documentation, quantiles):
+        self.documentation = documentation
+        self.quantiles = quantiles
+        # sorted label items -> DDSketch
+        self.series = {}
+
+    def add(self, labels, sketch):
+        key = tuple(sorted(labels.items()))
+        merged = self.series.get(key)
+        if merged is None:
+            self.series[key] = sketch
+            return
+        try:
+            merged.merge(sketch)
+        except ValueError as e:
+            logger.warning(f"Skipping sketch series {dict(key)}: {e}")
+
+
+def _merge_into(families, dumped):
+    for entry in dumped:
+        family = families.get(entry["name"])
+        if family is None:
+            family = families[entry["name"]] = _MergedFamily(entry["documentation"], entry["quantiles"])
+        for series in entry["series"]:
+            family.add(series["labels"], DDSketch.from_dict(series["sketch"]))
+
+
+class SketchFileCollector:
+    """
+    Exposes sketch summaries merged across every process of the bench: the
+    live sketches of this process plus the files written by the others.
+    Registered on the aggregated registry in multiprocess mode.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        families = {}
+        # Live values first, so the current definition decides the quantiles
+        _merge_into(families, _dump_live_metrics())
+        own_file = _sketch_path(self._path, os.getpid())
+        with _directory_lock(self._path, fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(self._path, f"{_FILE_PREFIX}*.json")):
+                if path != own_file:
+                    _merge_into(families, _read_file(path))
+
+        for name, family in families.items():
+            metric = Metric(name, family.documentation, "summary")
+            for key, sketch in family.series.items():
+                labels = dict(key)
+                for q in family.quantiles:
+                    metric.add_sample(name, {**labels, "quantile": _quantile_label(q)}, sketch.quantile(q))
+                metric.add_sample(name + "_count", labels, sketch.count)
+                metric.add_sample(name + "_sum", labels, sketch.sum)
+            yield metric
+
+
+def compact_dead_sketch_files(directory):
+    """
+    Merges the sketch files of processes that no longer exist into
+    `sketch_archive.json`. Called by compact_dead_process_files, which holds
+    the directory lock.
+    """
+    dead_files = []
+    for path in glob.glob(os.path.join(directory, f"{_FILE_PREFIX}*.json")):
+        pid = os.path.basename(path)[len(_FILE_PREFIX) : -5]
+        if pid.isdigit() and int(pid) != os.getpid() and not _is_pid_alive(int(pid)):
+            dead_files.append(path)
+    if not dead_files:
+        return 0
+
+    archive_path = _sketch_path(directory, _ARCHIVE_PID)
+    families = {}
+    for path in [archive_path, *dead_files]:
+        if os.path.exists(path):
+            _merge_into(families, _read_file(path))
+
+    _write_file(
+        archive_path,
+        [
+            {
+                "name": name,
+                "documentation": family.documentation,
+                "quantiles": family.quantiles,
+                "series": [
+                    {"labels": dict(key), "sketch": sketch.to_dict()}
+                    for key, sketch in family.series.items()
+                ],
+            }
+            for name, family in families.items()
+        ],
+    )
+    for path in dead_files:
+        os.remove(path)
+    return len(dead_files)
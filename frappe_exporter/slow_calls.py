@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+import time
+
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
+
+# Number of call signatures kept. Memory stays fixed regardless of traffic.
+DEFAULT_CAPACITY = 50
+
+# Calls faster than this are never considered, so fast calls only pay a float compare
+MIN_TRACKED_DURATION_SECONDS = 0.005
+
+# Signatures end up in label values; keep them readable and bounded
+MAX_SIGNATURE_LENGTH = 200
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Quoted identifiers (kept), string literals and numbers in SQL text. Double
+# quotes are identifiers on Postgres; Frappe quotes values with single quotes.
+_SQL_TOKENS = re.compile(
+    r"(`[^`]*`|\"[^\"]*\")|'(?:[^'\\]|\\.|'')*'|\b0x[0-9a-f]+\b|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b",
+    re.I,
+)
+# IN lists of any length
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)")
+
+
+class _SlowCall:
+    __slots__ = (
+        "count",
+        "kind",
+        "last_duration",
+        "last_seen",
+        "max_duration",
+        "signature",
+        "site",
+        "target",
+        "total_duration",
+    )
+
+    def __init__(self, site, kind, target, signature):
+        self.site = site
+        self.kind = kind
+        self.target = target
+        self.signature = signature
+        self.count = 0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_duration = 0.0
+        self.last_seen = 0.0
+
+    def as_dict(self):
+        return {
+            "site": self.site,
+            "kind": self.kind,
+            "target": self.target,
+            "signature": self.signature,
+            "count": self.count,
+            "max_duration": self.max_duration,
+            "avg_duration": self.total_duration / self.count if self.count else 0.0,
+            "last_duration": self.last_duration,
+            "last_seen": self.last_seen,
+        }
+
+
+class SlowCallTracker:
+    """
+    Keeps the `capacity` slowest call signatures seen by this process, across
+    all sites; every entry records the site it was seen on.
+
+    Once full, a new signature only enters by evicting the entry with the
+    smallest max duration, and only if it is slower. `threshold` is that
+    smallest max duration, so callers can skip building a signature for any
+    call that cannot make it into the table.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, min_duration=MIN_TRACKED_DURATION_SECONDS):
+        self.capacity = capacity
+        self.min_duration = min_duration
+        self.threshold = min_duration
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, site, kind, target, signature, duration):
+        key = (site, kind, target, signature)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.capacity:
+                    fastest_key = min(self._entries, key=lambda k: self._entries[k].max_duration)
+                    if self._entries[fastest_key].max_duration >= duration:
+                        return
+                    del self._entries[fastest_key]
+                entry = self._entries[key] = _SlowCall(site, kind, target, signature)
+
+            entry.count += 1
+            entry.total_duration += duration
+            entry.last_duration = duration
+            entry.last_seen = time.time()
+            if duration > entry.max_duration:
+                entry.max_duration = duration
+
+            if len(self._entries) >= self.capacity:
+                self.threshold = max(
+                    self.min_duration, min(e.max_duration for e in self._entries.values())
+                )
+
+    def top(self, limit=None, site=None):
+        """Entries slowest first; only those of `site` if given."""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e.max_duration, reverse=True)
+        if site is not None:
+            entries = [entry for entry in entries if entry.site == site]
+        return [entry.as_dict() for entry in entries[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.threshold = self.min_duration
+
+
+SLOW_CALLS = SlowCallTracker()
+
+
+def _truncate(text):
+    text = _WHITESPACE.sub(" ", text).strip()
+    if len(text) > MAX_SIGNATURE_LENGTH:
+        return text[: MAX_SIGNATURE_LENGTH - 3] + "..."
+    return text
+
+
+def _filters_shape(filters):
+    # Field names and operators only; values would make every call unique
+    if not filters:
+        return ""
+    if isinstance(filters, str):
+        return "<raw>"
+    if isinstance(filters, dict):
+        items = []
+        for field, value in filters.items():
+            operator = value[0] if isinstance(value, list | tuple) and value else "="
+            items.append(f"{field} {operator}")
+        return ", ".join(sorted(items))
+    items = []
+    for f in filters:
+        if isinstance(f, list | tuple):
+            if len(f) >= 4:
+                items.append(f"{f[1]} {f[2]}")
+            elif len(f) == 3:
+                items.append(f"{f[0]} {f[1]}")
+            else:
+                items.append(str(f[0]) if f else "")
+        elif isinstance(f, dict):
+            items.append(_filters_shape(f))
+        else:
+            items.append("<raw>")
+    return ", ".join(sorted(items))
+
+
+def _fields_shape(fields):
+    if not fields:
+        return "*"
+    if isinstance(fields, str):
+        return fields
+    return ", ".join(str(f) for f in fields)
+
+
+def get_list_signature(args, kwargs):
+    # frappe.get_list(doctype, fields=None, filters=None, ...)
+    fields = kwargs.get("fields", args[1] if len(args) > 1 else None)
+    filters = kwargs.get("filters", args[2] if len(args) > 2 else None)
+    return _truncate(f"fields: {_fields_shape(fields)} | filters: {_filters_shape(filters)}")
+
+
+def get_doc_signature(args, kwargs):
+    # frappe.get_doc(doctype, name) / get_doc(dict) / get_doc(doctype, filters_dict)
+    if args and isinstance(args[0], dict):
+        return "new from dict"
+    name = args[1] if len(args) > 1 else kwargs.get("name")
+    if isinstance(name, dict):
+        return _truncate(f"filters: {_filters_shape(name)}")
+    if name is None:
+        return "single or new"
+    return "by name"
+
+
+def normalize_query(query):
+    """Replaces the literals in a SQL string with ?, e.g. `name in ('a', 'b')` -> `name in (?)`."""
+    query = _SQL_TOKENS.sub(lambda match: match.group(1) or "?", query)
+    return _PLACEHOLDER_LIST.sub("(?)", query)
+
+
+def query_signature(query):
+    # Queries with inline values would leak them into labels and make every call unique
+    return _truncate(normalize_query(query if isinstance(query, str) else str(query)))
+
+
+class SlowCallCollector:
+    """
+    Exposes the slow call table of the process serving the scrape, labelled
+    with the site of each call and the pid; label cardinality is bounded by
+    the table's capacity.
+    """
+
+    def __init__(self, tracker):
+        self._tracker = tracker
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        max_duration = GaugeMetricFamily(
+            "frappe_slow_call_max_duration_seconds",
+            "Slowest observed duration per tracked call signature in this process",
+            labels=["site", "kind", "target", "signature", "pid"],
+        )
+        count = CounterMetricFamily(
+            "frappe_slow_call",
+            "Number of slow calls recorded per tracked call signature in this process",
+            labels=["site", "kind", "target", "signature", "pid"],
+        )
+        pid = str(os.getpid())
+        for entry in self._tracker.top():
+            labels = [entry["site"], entry["kind"], entry["target"], entry["signature"], pid]
+            max_duration.add_metric(labels, entry["max_duration"])
+            count.add_metric(labels, entry["count"])
+        yield max_duration
+        yield count
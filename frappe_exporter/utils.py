@@ -1,9 +1,74 @@
 import frappe
+from . import metrics_handler
+from .label_cache import label_cache_for
 from .metrics_handler import get_custom_metric
+from .recorder import get_recorder
+from .self_metrics import thread_stats
+from .settings import get_site_settings
 import logging
+import time
 
 logger = logging.getLogger("frappe_exporter.utils")
 
+# Action used when the caller does not specify one, by metric type
+DEFAULT_ACTIONS = {
+    "Counter": "inc",
+    "Gauge": "set",
+    "Histogram": "observe",
+    "Summary": "observe",
+    "NativeHistogram": "observe",
+    "SketchSummary": "observe",
+}
+
+
+def _resolve_metric_target(metric_name, labels=None, action=None, site=None):
+    # Shared validation for update_metric, bind_metric and update_metrics_bulk.
+    # Returns (label cache, label values, action), or None after logging why
+    # the update is skipped. `site` defaults to the current site; outside a
+    # site there are no custom metrics, which is logged as not found.
+    site = site or getattr(frappe.local, "site", None)
+    metric = get_custom_metric(metric_name, site)
+    if not metric:
+        # Fail silently in logs to avoid crashing critical business logic
+        logger.debug(f"Custom metric '{metric_name}' not found. Cannot update.")
+        return None
+
+    metric_type = type(metric).__name__
+
+    # Infer the default action based on metric type if not provided
+    if not action:
+        action = DEFAULT_ACTIONS.get(metric_type)
+        if not action:
+            logger.warning(
+                f"No default action for metric type '{metric_type}' on metric '{metric_name}'. Please specify an action."
+            )
+            return None
+
+    # The leading site label is filled in here; callers only pass the labels they defined
+    label_names = metric._labelnames[1:]
+    if set(label_names) != set(labels.keys() if labels else ()):
+        logger.error(
+            f"Mismatched labels for metric '{metric_name}'. Required: {label_names}, Provided: {list(labels.keys() if labels else [])}"
+        )
+        return None
+    labelvalues = (site, *(str(labels[name]) for name in label_names))
+
+    # Check the method for the specified action (e.g., .inc, .set); children share the metric's class
+    if not callable(getattr(metric, action, None)):
+        logger.error(f"Action '{action}' is not valid for metric type '{metric_type}'.")
+        return None
+
+    return label_cache_for(metric), labelvalues, action
+
+
+def _resolve_metric_child(metric_name, labels=None, action=None):
+    # Returns (child, action), or None if the update is skipped
+    target = _resolve_metric_target(metric_name, labels, action)
+    if not target:
+        return None
+    cache, labelvalues, action = target
+    return cache.get(*labelvalues), action
+
 
 def update_metric(metric_name, value=1.0, labels=None, action=None):
     """
@@ -22,51 +87,170 @@ def update_metric(metric_name, value=1.0, labels=None, action=None):
                    - Gauge: 'set'
                    - Histogram/Summary: 'observe'
     """
-    metric = get_custom_metric(metric_name)
-    if not metric:
-        # Fail silently in logs to avoid crashing critical business logic
-        logger.debug(f"Custom metric '{metric_name}' not found. Cannot update.")
-        return
-
-    metric_type = type(metric).__name__
-
-    # Infer the default action based on metric type if not provided
-    if not action:
-        if metric_type == "Counter":
-            action = "inc"
-        elif metric_type == "Gauge":
-            action = "set"
-        elif metric_type in ["Histogram", "Summary"]:
-            action = "observe"
-        else:
-            logger.warning(
-                f"No default action for metric type '{metric_type}' on metric '{metric_name}'. Please specify an action."
-            )
-            return
-
+    start_time = time.perf_counter()
     try:
-        # Prepare the metric instance (with or without labels)
-        target_metric = metric
-        if metric._labelnames:
-            if not labels or sorted(metric._labelnames) != sorted(labels.keys()):
-                logger.error(
-                    f"Mismatched labels for metric '{metric_name}'. Required: {metric._labelnames}, Provided: {list(labels.keys() if labels else [])}"
-                )
-                return
-            target_metric = metric.labels(**labels)
-
-        # Get the method for the specified action (e.g., .inc, .set)
-        action_func = getattr(target_metric, action, None)
-        if not callable(action_func):
-            logger.error(
-                f"Action '{action}' is not valid for metric type '{metric_type}'."
-            )
+        resolved = _resolve_metric_child(metric_name, labels, action)
+        if not resolved:
             return
 
-        action_func(float(value))
+        target_metric, action = resolved
+        get_recorder(get_site_settings())(target_metric, action, float(value))
 
     except Exception as e:
         logger.error(
             f"Failed to update metric '{metric_name}' with action '{action}': {e}",
             exc_info=True,
         )
+    finally:
+        stats = thread_stats()
+        stats.update_metric_calls += 1
+        stats.update_metric_seconds += time.perf_counter() - start_time
+
+
+class BoundMetric:
+    """
+    Handle to one label child of a custom metric, returned by `bind_metric`.
+    Metric lookup and label validation happen once at bind time, so each call
+    is a label cache hit and a method dispatch. Going through the cache keeps
+    the series from expiring while the handle is in use. Each update goes
+    through the recorder in effect when it is made, so a handle bound inside
+    a request keeps working after the request has ended.
+
+    If the custom metric definitions are reloaded, the handle re-resolves its
+    child against the site it was bound on at the next call; updates are
+    dropped if the metric was removed. Errors are logged, never raised.
+    """
+
+    __slots__ = ("_cache", "_generation", "_labels", "_labelvalues", "metric_name", "site")
+
+    def __init__(self, metric_name, cache, labelvalues, labels=None):
+        self.metric_name = metric_name
+        self.site = labelvalues[0]
+        self._cache = cache
+        self._labelvalues = labelvalues
+        self._labels = labels
+        self._generation = metrics_handler.custom_metrics_generation
+
+    def _apply(self, action, value):
+        try:
+            if self._generation != metrics_handler.custom_metrics_generation:
+                self._generation = metrics_handler.custom_metrics_generation
+                target = _resolve_metric_target(self.metric_name, self._labels, site=self.site)
+                self._cache, self._labelvalues = target[:2] if target else (None, None)
+            if self._cache is not None:
+                get_recorder(get_site_settings())(self._cache.get(*self._labelvalues), action, float(value))
+        except Exception as e:
+            logger.error(
+                f"Failed to update bound metric '{self.metric_name}' with action '{action}': {e}",
+                exc_info=True,
+            )
+
+    def inc(self, amount=1.0):
+        self._apply("inc", amount)
+
+    def dec(self, amount=1.0):
+        self._apply("dec", amount)
+
+    def set(self, value):
+        self._apply("set", value)
+
+    def observe(self, value):
+        self._apply("observe", value)
+
+
+class NullBoundMetric:
+    """Returned by `bind_metric` when the metric cannot be bound; every call is a no-op."""
+
+    __slots__ = ("metric_name",)
+
+    def __init__(self, metric_name):
+        self.metric_name = metric_name
+
+    def inc(self, amount=1.0):
+        pass
+
+    def dec(self, amount=1.0):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def __bool__(self):
+        return False
+
+
+def bind_metric(metric_name, **labels):
+    """
+    Returns a handle to a custom metric with its labels already resolved,
+    for code that updates the same series many times.
+
+    Example:
+        invoices_total = bind_metric("sales_invoice_total", customer=self.customer)
+        invoices_total.inc()
+
+    If the metric does not exist or the labels do not match, a falsy handle
+    whose methods do nothing is returned, mirroring `update_metric`.
+    """
+    try:
+        target = _resolve_metric_target(metric_name, labels)
+    except Exception as e:
+        logger.error(f"Failed to bind metric '{metric_name}': {e}", exc_info=True)
+        target = None
+
+    if not target:
+        return NullBoundMetric(metric_name)
+
+    cache, labelvalues, _action = target
+    return BoundMetric(metric_name, cache, labelvalues, labels)
+
+
+def update_metrics_bulk(updates):
+    """
+    Applies many custom metric updates in one call, e.g. from an import loop.
+
+    :param updates: An iterable of dicts with the keys accepted by `update_metric`
+                    ('metric_name', 'value', 'labels', 'action'), or tuples in the
+                    same order: (metric_name, value[, labels[, action]]).
+    :return: The number of updates applied.
+
+    Metric lookup and label validation are done once per distinct
+    (metric_name, labels, action) combination in the batch.
+    """
+    record = get_recorder(get_site_settings())
+    resolved_cache = {}
+    applied = 0
+
+    for update in updates:
+        if isinstance(update, dict):
+            metric_name = update.get("metric_name")
+            value = update.get("value", 1.0)
+            labels = update.get("labels")
+            action = update.get("action")
+        else:
+            update = tuple(update)
+            metric_name = update[0]
+            value = update[1] if len(update) > 1 else 1.0
+            labels = update[2] if len(update) > 2 else None
+            action = update[3] if len(update) > 3 else None
+
+        key = (metric_name, tuple(sorted(labels.items())) if labels else (), action)
+        try:
+            resolved = resolved_cache.get(key)
+            if resolved is None:
+                resolved = resolved_cache[key] = _resolve_metric_child(metric_name, labels, action) or False
+            if not resolved:
+                continue
+
+            child, child_action = resolved
+            record(child, child_action, float(value))
+            applied += 1
+        except Exception as e:
+            logger.error(
+                f"Failed to update metric '{metric_name}' with action '{action}': {e}",
+                exc_info=True,
+            )
+
+    return applied
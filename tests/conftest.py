@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import frappe_stub
+
+# frappe_exporter imports frappe at module level, so the stub goes in first
+frappe = frappe_stub.install()
+
+
+@pytest.fixture
+def configure():
+    """Replaces the exporter settings for one test, restoring the defaults afterwards."""
+    yield frappe_stub.configure
+    frappe_stub.configure(tables={})
+
+
+@pytest.fixture
+def multiprocess_dir(tmp_path, monkeypatch):
+    """Points the exporter's multiprocess helpers at an empty directory."""
+    from frappe_exporter import multiprocess
+
+    monkeypatch.setattr(multiprocess, "_multiprocess_dir", str(tmp_path))
+    monkeypatch.setattr(multiprocess, "_last_compaction", 0.0)
+    return str(tmp_path)
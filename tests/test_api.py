@@ -0,0 +1,45 @@
+import frappe
+import pytest
+from prometheus_client import CollectorRegistry, Counter
+
+from frappe_exporter import api
+
+
+class _NotPermitted(Exception):
+    pass
+
+
+@pytest.fixture
+def bench(monkeypatch):
+    registry = CollectorRegistry()
+    requests = Counter("requests", "Requests", ["site"], registry=registry)
+    requests.labels("a.localhost").inc()
+    requests.labels("b.localhost").inc()
+    monkeypatch.setattr(api, "_prepare_exposition_registry", lambda: registry)
+    monkeypatch.setattr(frappe.local, "site", "a.localhost", raising=False)
+    roles = []
+
+    def only_for(role):
+        if role not in roles:
+            raise _NotPermitted(role)
+
+    monkeypatch.setattr(frappe, "only_for", only_for, raising=False)
+    return roles
+
+
+def test_metrics_only_exposes_the_calling_site(bench):
+    body = api.metrics().get_data(as_text=True)
+
+    assert 'site="a.localhost"' in body
+    assert 'site="b.localhost"' not in body
+
+
+def test_all_sites_requires_system_manager(bench):
+    with pytest.raises(_NotPermitted):
+        api.metrics(all_sites="1")
+
+    bench.append("System Manager")
+    body = api.metrics(all_sites="1").get_data(as_text=True)
+
+    assert 'site="a.localhost"' in body
+    assert 'site="b.localhost"' in body
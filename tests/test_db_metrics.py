@@ -0,0 +1,39 @@
+import pytest
+
+from frappe_exporter import db_metrics
+from frappe_exporter.db_metrics import get_query_shape, parse_query_shape
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("select name from `tabSales Invoice` where docstatus = 1", ("select", "tabSales Invoice")),
+        ("/* comment */ SELECT * FROM tabItem", ("select", "tabItem")),
+        ("with recent as (select 1) select * from tabToDo", ("select", "tabToDo")),
+        ("insert into `tabVersion` (name) values (%s)", ("insert", "tabVersion")),
+        ("update low_priority `tabItem` set x = 1", ("update", "tabItem")),
+        ("delete from db.tabNote where name = %s", ("delete", "tabNote")),
+        ('select * from "tabUser"', ("select", "tabUser")),
+        ("set autocommit = 1", ("other", "unknown")),
+    ],
+)
+def test_parse_query_shape(query, expected):
+    assert parse_query_shape(query) == expected
+
+
+def test_queries_with_inline_values_share_a_cache_entry(monkeypatch):
+    monkeypatch.setattr(db_metrics, "_query_shapes", type(db_metrics._query_shapes)())
+    for n in range(100):
+        assert get_query_shape(f"select * from tabToDo where name = 'TODO-{n}'") == ("select", "tabToDo")
+    assert len(db_metrics._query_shapes) == 1
+
+
+def test_parameterized_queries_are_found_without_normalizing(monkeypatch):
+    monkeypatch.setattr(db_metrics, "_query_shapes", type(db_metrics._query_shapes)())
+    calls = []
+    normalize_query = db_metrics.normalize_query
+    monkeypatch.setattr(db_metrics, "normalize_query", lambda query: calls.append(query) or normalize_query(query))
+
+    for _ in range(3):
+        assert get_query_shape("select name from tabNote where owner = %s") == ("select", "tabNote")
+    assert len(calls) == 1
@@ -0,0 +1,27 @@
+import frappe
+
+from frappe_exporter.doc_metrics import mark_doc_event
+from frappe_exporter.metrics_handler import DOC_EVENT_DURATION_SECONDS
+
+
+class _Doc:
+    doctype = "ToDo"
+
+
+def _events():
+    return {
+        sample.labels["event"]
+        for family in DOC_EVENT_DURATION_SECONDS.collect()
+        for sample in family.samples
+        if sample.name.endswith("_count") and sample.labels["doctype"] == "ToDo"
+    }
+
+
+def test_delete_is_timed_as_after_delete(monkeypatch):
+    monkeypatch.setattr(frappe.local, "site", "bench.localhost", raising=False)
+    doc = _Doc()
+
+    mark_doc_event(doc, "on_trash")
+    mark_doc_event(doc, "after_delete")
+
+    assert _events() == {"after_delete"}
@@ -0,0 +1,196 @@
+import gzip
+import struct
+
+import pytest
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+from frappe_exporter.exposition import (
+    CONTENT_TYPE_TEXT,
+    accepts_gzip,
+    get_scrape_payload,
+    negotiate_format,
+)
+from frappe_exporter.native_histogram import NativeHistogram
+from frappe_exporter.protobuf import CONTENT_TYPE_PROTOBUF, generate_latest
+
+PROTOBUF_ACCEPT = (
+    "application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=delimited"
+)
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _fields(data):
+    # field number -> list of raw values (ints, floats or bytes)
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 1:
+            value = struct.unpack("<d", data[pos : pos + 8])[0]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos : pos + length]
+            pos += length
+        else:
+            raise AssertionError(f"Unexpected wire type {wire_type}")
+        fields.setdefault(field, []).append(value)
+    return fields
+
+
+def _families(data):
+    families = {}
+    pos = 0
+    while pos < len(data):
+        length, pos = _varint(data, pos)
+        family = _fields(data[pos : pos + length])
+        pos += length
+        families[family[1][0].decode()] = family
+    return families
+
+
+def _labels(metric):
+    return {
+        pair[1][0].decode(): pair[2][0].decode() for pair in (_fields(raw) for raw in metric.get(1, []))
+    }
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, "text"),
+        ("", "text"),
+        ("text/plain;version=0.0.4", "text"),
+        ("application/openmetrics-text;version=1.0.0", "openmetrics"),
+        (PROTOBUF_ACCEPT, "protobuf"),
+        # Prometheus' default scrape_protocols
+        (
+            PROTOBUF_ACCEPT + ";q=0.6,application/openmetrics-text;version=1.0.0;q=0.5,"
+            "text/plain;version=0.0.4;q=0.4,*/*;q=0.1",
+            "protobuf",
+        ),
+        ("application/openmetrics-text;q=0.5,text/plain;q=0.9", "text"),
+        # Text protobuf and unknown proto messages are not supported
+        ("application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=text", "text"),
+        ("application/json", "text"),
+        ("text/plain;q=0,application/openmetrics-text;q=0.1", "openmetrics"),
+    ],
+)
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(accept) == expected
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [(None, False), ("gzip", True), ("deflate, gzip;q=0.5", True), ("gzip;q=0", False), ("*", True)],
+)
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) is expected
+
+
+def test_protobuf_counter_and_gauge():
+    registry = CollectorRegistry()
+    Counter("test_requests", "Requests", ["site"], registry=registry).labels("a").inc(3)
+    Gauge("test_in_flight", "In flight", registry=registry).set(2.5)
+
+    families = _families(generate_latest(registry))
+
+    counter = families["test_requests_total"]
+    assert counter[2] == [b"Requests"]
+    assert counter[3] == [0]
+    metric = _fields(counter[4][0])
+    assert _labels(metric) == {"site": "a"}
+    assert _fields(metric[3][0])[1] == [3.0]
+
+    gauge = families["test_in_flight"]
+    assert gauge[3] == [1]
+    assert _fields(_fields(gauge[4][0])[2][0])[1] == [2.5]
+
+
+def test_protobuf_classic_histogram():
+    registry = CollectorRegistry()
+    histogram = Histogram("test_latency", "Latency", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    family = _families(generate_latest(registry))["test_latency"]
+    assert family[3] == [4]
+    encoded = _fields(_fields(family[4][0])[7][0])
+    assert encoded[1] == [3]
+    assert encoded[2] == [5.55]
+    # Cumulative counts of the finite buckets; +Inf is implied by the count
+    buckets = [(_fields(raw)[2][0], _fields(raw)[1][0]) for raw in encoded[3]]
+    assert buckets == [(0.1, 1), (1.0, 2)]
+
+
+def test_protobuf_native_histogram():
+    registry = CollectorRegistry()
+    histogram = NativeHistogram("test_native_pb", "Native", schema=0, registry=registry)
+    for value in (1.0, 3.0, 3.5, 0.0):
+        histogram.observe(value)
+
+    family = _families(generate_latest(registry))["test_native_pb"]
+    encoded = _fields(_fields(family[4][0])[7][0])
+    assert encoded[1] == [4]
+    assert _unzigzag(encoded[5][0]) == 0
+    assert encoded[7] == [1]
+    spans = [_fields(raw) for raw in encoded[12]]
+    assert [(_unzigzag(s[1][0]), s[2][0]) for s in spans] == [(0, 1), (1, 1)]
+    deltas_data = encoded[13][0]
+    deltas = []
+    pos = 0
+    while pos < len(deltas_data):
+        value, pos = _varint(deltas_data, pos)
+        deltas.append(_unzigzag(value))
+    assert deltas == [1, 1]
+
+
+def test_protobuf_empty_native_histogram_is_marked_native():
+    registry = CollectorRegistry()
+    NativeHistogram("test_native_empty", "Native", registry=registry)
+
+    family = _families(generate_latest(registry))["test_native_empty"]
+    encoded = _fields(_fields(family[4][0])[7][0])
+    assert [_fields(raw) for raw in encoded[12]] == [{1: [0], 2: [0]}]
+
+
+def test_text_scrape_hides_native_samples():
+    registry = CollectorRegistry()
+    NativeHistogram("test_native_text", "Native", registry=registry).observe(1.0)
+
+    payload = get_scrape_payload(lambda: registry, accept="text/plain")
+    assert payload.content_type == CONTENT_TYPE_TEXT
+    assert b'test_native_text_bucket{le="+Inf"} 1.0' in payload.body
+    assert b"test_native_text 0.0" not in payload.body
+
+    payload = get_scrape_payload(lambda: registry, accept=PROTOBUF_ACCEPT)
+    assert payload.content_type == CONTENT_TYPE_PROTOBUF
+
+
+def test_large_payloads_are_gzipped():
+    registry = CollectorRegistry()
+    counter = Counter("test_many", "Many", ["n"], registry=registry)
+    for n in range(100):
+        counter.labels(str(n)).inc()
+
+    payload = get_scrape_payload(lambda: registry, accept_encoding="gzip")
+    assert payload.content_encoding == "gzip"
+    assert payload.headers["Content-Encoding"] == "gzip"
+    assert b"test_many_total" in gzip.decompress(payload.body)
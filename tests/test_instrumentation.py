@@ -0,0 +1,31 @@
+from frappe_exporter import instrumentation
+from frappe_exporter.instrumentation import (
+    DEFAULT_BUCKETS,
+    FUNCTION_DURATION_NAME,
+    FunctionDurationCollector,
+    duration_metric_name,
+    parse_buckets,
+)
+
+
+def test_each_bucket_layout_gets_a_metric_name_of_its_own():
+    custom = parse_buckets("0.01, 0.1, 1")
+
+    assert duration_metric_name(DEFAULT_BUCKETS) == FUNCTION_DURATION_NAME
+    assert duration_metric_name(custom) == duration_metric_name(parse_buckets("1, 0.1, 0.01"))
+    assert duration_metric_name(custom) != duration_metric_name(parse_buckets("0.01, 0.1, 10"))
+    assert duration_metric_name(custom).endswith("_seconds")
+
+
+def test_collector_exports_one_family_per_layout(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_histograms", {})
+    custom = parse_buckets("0.01, 0.1, 1")
+    instrumentation._duration_histogram(DEFAULT_BUCKETS).labels("a.localhost", "f", "").observe(0.2)
+    instrumentation._duration_histogram(custom).labels("a.localhost", "g", "").observe(0.2)
+
+    families = {family.name: family for family in FunctionDurationCollector().collect()}
+
+    assert set(families) == {FUNCTION_DURATION_NAME, duration_metric_name(custom)}
+    for buckets in (DEFAULT_BUCKETS, custom):
+        le = {s.labels["le"] for s in families[duration_metric_name(buckets)].samples if "le" in s.labels}
+        assert len(le) == len(buckets) + 1
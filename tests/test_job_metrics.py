@@ -0,0 +1,46 @@
+import frappe
+import pytest
+
+from frappe_exporter.job_metrics import after_job, before_job
+from frappe_exporter.metrics_handler import JOBS_TOTAL
+
+METHOD = "frappe_exporter.tests.job"
+
+
+def _statuses():
+    return {
+        sample.labels["status"]: sample.value
+        for family in JOBS_TOTAL.collect()
+        for sample in family.samples
+        if sample.name.endswith("_total") and sample.labels["method"] == METHOD
+    }
+
+
+def _execute_job(job):
+    # Mirrors frappe.utils.background_jobs.execute_job
+    before_job(method=METHOD)
+    try:
+        job()
+    finally:
+        after_job(method=METHOD)
+
+
+def _fail():
+    raise ValueError("deadlock")
+
+
+def test_job_retried_from_an_except_block_is_counted_by_its_own_outcome(monkeypatch):
+    monkeypatch.setattr(frappe.local, "site", "bench.localhost", raising=False)
+    before = _statuses()
+
+    with pytest.raises(ValueError):
+        _execute_job(_fail)
+    try:
+        _fail()
+    except ValueError:
+        # The retry succeeds while the first attempt's exception is being handled
+        _execute_job(lambda: None)
+
+    after = _statuses()
+    assert after["error"] - before.get("error", 0) == 1
+    assert after["success"] - before.get("success", 0) == 1
@@ -0,0 +1,178 @@
+import os
+import time
+
+from prometheus_client import Counter, Gauge
+
+from frappe_exporter.cardinality import SeriesCollector
+from frappe_exporter.label_cache import (
+    OVERFLOW_CACHE_SIZE,
+    OVERFLOW_LABEL_VALUE,
+    LabelCache,
+    expire_stale_series,
+    label_cache_for,
+)
+
+SITE = "bench.localhost"
+
+
+def _counter(name="test_label_cache"):
+    return Counter(name, "Test counter", ["site", "doctype"], registry=None)
+
+
+def test_hit_returns_cached_child():
+    metric = _counter()
+    cache = LabelCache(metric)
+    assert cache.get(SITE, "ToDo") is cache.get(SITE, "ToDo")
+    assert cache.get(SITE, "ToDo") is metric.labels(SITE, "ToDo")
+
+
+def test_label_sets_past_the_limit_share_the_overflow_series(configure):
+    configure({"enabled": 1, "default_series_limit": 2})
+    metric = _counter()
+    cache = LabelCache(metric)
+
+    for doctype in ("ToDo", "Note", "User", "Role"):
+        cache.get(SITE, doctype).inc()
+
+    assert set(metric._metrics) == {
+        (SITE, "ToDo"),
+        (SITE, "Note"),
+        (SITE, OVERFLOW_LABEL_VALUE),
+    }
+    assert metric.labels(SITE, OVERFLOW_LABEL_VALUE)._value.get() == 2
+    assert cache.series_counts[SITE] == 2
+    assert cache.overflowed[SITE] == 2
+
+
+def test_limit_is_per_site(configure):
+    configure({"enabled": 1, "default_series_limit": 1})
+    metric = _counter()
+    cache = LabelCache(metric)
+
+    cache.get("a.localhost", "ToDo")
+    cache.get("b.localhost", "ToDo")
+
+    assert set(metric._metrics) == {("a.localhost", "ToDo"), ("b.localhost", "ToDo")}
+
+
+def test_remove_releases_the_series_slot(configure):
+    configure({"enabled": 1, "default_series_limit": 1})
+    metric = _counter()
+    cache = LabelCache(metric)
+
+    cache.get(SITE, "ToDo")
+    cache.remove(SITE, "ToDo")
+    cache.get(SITE, "Note")
+
+    assert set(metric._metrics) == {(SITE, "Note")}
+
+
+def test_expire_removes_idle_children_only():
+    metric = _counter()
+    cache = LabelCache(metric)
+    cache.get(SITE, "ToDo")
+    cutoff = time.monotonic()
+    cache.get(SITE, "Note")
+
+    assert cache.expire(cutoff) == 1
+    assert set(metric._metrics) == {(SITE, "Note")}
+    assert len(cache) == 1
+
+
+def test_expire_stale_series_uses_the_gauge_ttl_for_gauges():
+    counter = _counter("test_expire_counter")
+    gauge = Gauge("test_expire_gauge", "Test gauge", ["site", "doctype"], registry=None)
+    label_cache_for(counter).get(SITE, "ToDo")
+    label_cache_for(gauge).get(SITE, "ToDo")
+    # Every child is idle for longer than a TTL in the past
+    for cache in (label_cache_for(counter), label_cache_for(gauge)):
+        cache._last_used[(SITE, "ToDo")] -= 10
+
+    expire_stale_series(ttl=5, gauge_ttl=0)
+
+    assert not counter._metrics
+    assert set(gauge._metrics) == {(SITE, "ToDo")}
+
+
+def test_overflowed_label_sets_do_not_grow_the_cache(configure):
+    configure({"enabled": 1, "default_series_limit": 5})
+    metric = _counter()
+    cache = LabelCache(metric)
+
+    for n in range(20000):
+        cache.get(SITE, str(n)).inc()
+
+    assert len(metric._metrics) == 6
+    assert len(cache) == 6
+    assert len(cache._overflows) <= OVERFLOW_CACHE_SIZE
+    assert metric.labels(SITE, OVERFLOW_LABEL_VALUE)._value.get() == 20000 - 5
+
+
+def test_overflowed_label_set_gets_a_series_once_a_slot_is_free(configure):
+    configure({"enabled": 1, "default_series_limit": 1})
+    metric = _counter()
+    cache = LabelCache(metric)
+
+    cache.get(SITE, "ToDo")
+    assert cache.get(SITE, "Note") is metric.labels(SITE, OVERFLOW_LABEL_VALUE)
+    cache.remove(SITE, "ToDo")
+
+    assert cache.get(SITE, "Note") is metric.labels(SITE, "Note")
+
+
+def test_expiry_drops_the_idle_overflow_series(configure):
+    configure({"enabled": 1, "default_series_limit": 1})
+    metric = _counter()
+    cache = LabelCache(metric)
+    cache.get(SITE, "ToDo")
+    cache.get(SITE, "Note")
+    cache.get(SITE, "User")
+
+    assert cache.expire(time.monotonic()) == 2
+    assert not metric._metrics
+    assert not cache._overflows
+
+
+def test_no_expiry_in_multiprocess_mode(multiprocess_dir):
+    metric = _counter("test_expire_multiprocess")
+    label_cache_for(metric).get(SITE, "ToDo")
+    label_cache_for(metric)._last_used[(SITE, "ToDo")] -= 10
+
+    assert expire_stale_series(ttl=5) == 0
+    assert set(metric._metrics) == {(SITE, "ToDo")}
+
+
+def test_series_collector_reports_overflow_per_process(configure):
+    configure({"enabled": 1, "default_series_limit": 1})
+    metric = _counter("test_series_collector")
+    cache = label_cache_for(metric)
+    cache.get(SITE, "ToDo")
+    cache.get(SITE, "Note")
+
+    samples = {
+        (sample.name, sample.labels.get("metric"), sample.labels.get("site")): sample
+        for family in SeriesCollector().collect()
+        for sample in family.samples
+    }
+
+    series = samples[("frappe_exporter_series", "test_series_collector_total", SITE)]
+    assert series.value == 2
+    assert series.labels["pid"] == str(os.getpid())
+    overflow = samples[("frappe_exporter_series_overflow_total", "test_series_collector_total", SITE)]
+    assert overflow.value == 1
+
+
+def test_series_are_unlimited_by_default_but_the_cache_is_bounded(configure):
+    configure({"enabled": 1})
+    metric = _counter("test_label_cache_unlimited")
+    cache = LabelCache(metric, maxsize=100)
+
+    for n in range(1000):
+        cache.get(SITE, f"DocType {n}").inc()
+
+    assert len(cache) == 100
+    assert len(metric._metrics) == 1000
+    assert cache.series_counts[SITE] == 1000
+    # An evicted child is resolved to the series it already has
+    assert cache.get(SITE, "DocType 0")._value.get() == 1.0
+    assert cache.series_counts[SITE] == 1000
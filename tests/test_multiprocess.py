@@ -0,0 +1,102 @@
+import os
+import subprocess
+
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from frappe_exporter.multiprocess import compact_dead_process_files
+
+
+def _dead_pid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+def _write(directory, typ, pid, metric_name, value, labels=None, timestamp=0.0):
+    labels = labels or {"site": "bench.localhost"}
+    sample_name = metric_name if typ.startswith("gauge") else metric_name + "_total"
+    values = MmapedDict(os.path.join(directory, f"{typ}_{pid}.db"))
+    try:
+        key = mmap_key(metric_name, sample_name, list(labels), list(labels.values()), "Test")
+        values.write_value(key, value, timestamp)
+    finally:
+        values.close()
+
+
+def _totals(directory):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for metric in MultiProcessCollector(None, path=directory).collect()
+        for sample in metric.samples
+    }
+
+
+def test_dead_process_counters_are_folded_into_the_archive(multiprocess_dir):
+    for value in (1.0, 2.0):
+        _write(multiprocess_dir, "counter", _dead_pid(), "jobs", value)
+    _write(multiprocess_dir, "counter", os.getpid(), "jobs", 4.0)
+    before = _totals(multiprocess_dir)
+
+    assert compact_dead_process_files(force=True) == 2
+
+    assert set(os.listdir(multiprocess_dir)) == {
+        ".frappe_exporter.lock",
+        "counter_archive.db",
+        f"counter_{os.getpid()}.db",
+    }
+    assert _totals(multiprocess_dir) == before
+
+
+def test_compaction_merges_into_an_existing_archive(multiprocess_dir):
+    _write(multiprocess_dir, "counter", _dead_pid(), "jobs", 1.0)
+    compact_dead_process_files(force=True)
+    _write(multiprocess_dir, "counter", _dead_pid(), "jobs", 2.0)
+    compact_dead_process_files(force=True)
+
+    assert _totals(multiprocess_dir) == {("jobs_total", (("site", "bench.localhost"),)): 3.0}
+
+
+def test_compaction_is_rate_limited(multiprocess_dir):
+    _write(multiprocess_dir, "counter", _dead_pid(), "jobs", 1.0)
+    compact_dead_process_files()
+    _write(multiprocess_dir, "counter", _dead_pid(), "jobs", 1.0)
+
+    assert compact_dead_process_files() == 0
+
+
+def test_dead_process_gauges_are_folded_by_mode(multiprocess_dir):
+    _write(multiprocess_dir, "gauge_mostrecent", _dead_pid(), "queue", 5.0, timestamp=200.0)
+    _write(multiprocess_dir, "gauge_mostrecent", _dead_pid(), "queue", 7.0, timestamp=100.0)
+    _write(multiprocess_dir, "gauge_max", _dead_pid(), "peak", 3.0)
+    _write(multiprocess_dir, "gauge_max", _dead_pid(), "peak", 9.0)
+    before = _totals(multiprocess_dir)
+
+    assert compact_dead_process_files(force=True) == 4
+
+    assert set(os.listdir(multiprocess_dir)) == {
+        ".frappe_exporter.lock",
+        "gauge_max_archive.db",
+        "gauge_mostrecent_archive.db",
+    }
+    assert _totals(multiprocess_dir) == before == {
+        ("queue", (("site", "bench.localhost"),)): 5.0,
+        ("peak", (("site", "bench.localhost"),)): 9.0,
+    }
+
+    # A later dead process still only wins with a newer value
+    _write(multiprocess_dir, "gauge_mostrecent", _dead_pid(), "queue", 1.0, timestamp=150.0)
+    compact_dead_process_files(force=True)
+    assert _totals(multiprocess_dir)[("queue", (("site", "bench.localhost"),))] == 5.0
+
+
+def test_dead_process_live_gauges_are_removed(multiprocess_dir):
+    _write(multiprocess_dir, "gauge_livesum", _dead_pid(), "in_flight", 2.0)
+    _write(multiprocess_dir, "gauge_livesum", os.getpid(), "in_flight", 1.0)
+    _write(multiprocess_dir, "gauge_all", _dead_pid(), "workers", 1.0)
+
+    assert compact_dead_process_files(force=True) == 1
+
+    assert not any(name.startswith("gauge_livesum_archive") for name in os.listdir(multiprocess_dir))
+    assert f"gauge_livesum_{os.getpid()}.db" in os.listdir(multiprocess_dir)
+    assert sum(name.startswith("gauge_all_") for name in os.listdir(multiprocess_dir)) == 1
@@ -0,0 +1,68 @@
+import math
+
+import pytest
+
+from frappe_exporter.native_histogram import MIN_SCHEMA, NativeHistogram, bucket_index
+
+
+def _native(histogram):
+    return next(s for f in histogram.collect() for s in f.samples if s.native_histogram).native_histogram
+
+
+def _bucket_bounds(index, schema):
+    base = 2.0 ** (2.0**-schema)
+    return base ** (index - 1), base**index
+
+
+@pytest.mark.parametrize("schema", [-4, -1, 0, 1, 3, 8])
+def test_bucket_index_matches_the_schema_definition(schema):
+    for value in (1e-9, 0.001, 0.3, 0.5, 1.0, 1.5, 2.0, 3.0, 1024.0, 12345.678, 1e12):
+        lower, upper = _bucket_bounds(bucket_index(value, schema), schema)
+        # Bucket i covers (base^(i-1), base^i]
+        assert lower < value or math.isclose(lower, value, rel_tol=1e-12)
+        assert value <= upper or math.isclose(upper, value, rel_tol=1e-12)
+
+
+def test_powers_of_two_are_upper_bounds():
+    # Prometheus puts exact powers of the base in the bucket they close
+    assert bucket_index(1.0, 0) == 0
+    assert bucket_index(2.0, 0) == 1
+    assert bucket_index(4.0, 1) == 4
+
+
+def test_observations_populate_sparse_buckets():
+    histogram = NativeHistogram("test_native", "Test", schema=0, registry=None)
+    for value in (0.0, 1.0, 3.0, 3.5, -2.0):
+        histogram.observe(value)
+
+    native = _native(histogram)
+    assert native.schema == 0
+    assert native.count_value == 5
+    assert native.zero_count == 1
+    # 1 -> bucket 0, 3 and 3.5 -> bucket 2: spans (0, 1) and (1, 1), deltas 1, +1
+    assert [(s.offset, s.length) for s in native.pos_spans] == [(0, 1), (1, 1)]
+    assert native.pos_deltas == [1, 1]
+    assert [(s.offset, s.length) for s in native.neg_spans] == [(1, 1)]
+
+
+def test_schema_is_lowered_past_max_buckets():
+    histogram = NativeHistogram("test_native_reduce", "Test", schema=3, max_buckets=10, registry=None)
+    values = [1.1**i for i in range(100)]
+    for value in values:
+        histogram.observe(value)
+
+    native = _native(histogram)
+    assert MIN_SCHEMA <= native.schema < 3
+    assert sum(s.length for s in native.pos_spans) <= 10
+    assert native.count_value == len(values)
+    # Every observation is still in the bucket covering it at the final schema
+    expected = {}
+    for value in values:
+        index = bucket_index(value, native.schema)
+        expected[index] = expected.get(index, 0) + 1
+    assert histogram._positive == expected
+
+
+def test_invalid_schema_is_rejected():
+    with pytest.raises(ValueError):
+        NativeHistogram("test_native_invalid", "Test", schema=9, registry=None)
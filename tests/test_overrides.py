@@ -0,0 +1,50 @@
+import time
+import types
+
+import frappe
+
+from frappe_exporter import overrides
+from frappe_exporter.metrics_handler import GET_DOC_TOTAL
+from frappe_exporter.self_metrics import thread_stats
+
+
+def _wrap(monkeypatch, sampled):
+    monkeypatch.setattr(overrides, "_original_get_doc", lambda *args, **kwargs: frappe._dict(doctype=args[0]))
+    monkeypatch.setattr(overrides, "is_sampled", lambda sample_every: sampled)
+    reads = []
+
+    def perf_counter():
+        reads.append(None)
+        return time.perf_counter()
+
+    monkeypatch.setattr(overrides, "time", types.SimpleNamespace(perf_counter=perf_counter))
+    return reads
+
+
+def _count(doctype):
+    return GET_DOC_TOTAL.labels(frappe.local.site, doctype, "success")._value.get()
+
+
+def test_unsampled_calls_read_no_clock(monkeypatch):
+    reads = _wrap(monkeypatch, sampled=False)
+    stats = thread_stats()
+    calls, seconds = stats.get_doc_calls, stats.get_doc_seconds
+    before = _count("ToDo")
+
+    overrides.get_doc_wrapper("ToDo", "TODO-1")
+
+    assert not reads
+    assert _count("ToDo") == before + 1
+    assert stats.get_doc_calls == calls + 1
+    assert stats.get_doc_seconds == seconds
+
+
+def test_sampled_calls_measure_the_overhead(monkeypatch):
+    reads = _wrap(monkeypatch, sampled=True)
+    stats = thread_stats()
+    seconds = stats.get_doc_seconds
+
+    overrides.get_doc_wrapper("Note", "NOTE-1")
+
+    assert len(reads) == 3
+    assert stats.get_doc_seconds > seconds
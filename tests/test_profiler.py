@@ -0,0 +1,54 @@
+import os
+
+from frappe_exporter import profiler
+from frappe_exporter.profiler import OTHER_FRAME, ProfilerCollector, SamplingProfiler, render_collapsed
+
+SITE = "bench.localhost"
+
+
+def _sampled(monkeypatch, **kwargs):
+    # A profiler that is sampled by hand instead of by its thread
+    sampling = SamplingProfiler(10, **kwargs)
+    monkeypatch.setattr(profiler, "_profiler", sampling)
+    monkeypatch.setattr(profiler, "_thread_tags", {})
+    profiler.tag_current_thread(SITE, "/api/method/ping")
+    return sampling
+
+
+def test_samples_tagged_threads(monkeypatch):
+    sampling = _sampled(monkeypatch)
+    sampling.sample()
+    sampling.sample()
+
+    stacks, functions = sampling.snapshot(SITE)
+    ((site, route, stack), count), = stacks.items()
+    assert (site, route, count) == (SITE, "/api/method/ping", 2)
+    assert stack[-1].endswith(":SamplingProfiler.sample")
+    assert functions[(SITE, stack[-1])] == [2, 2]
+    assert render_collapsed(stacks).endswith(" 2\n")
+
+
+def test_stack_table_is_bounded(monkeypatch):
+    sampling = _sampled(monkeypatch, max_stacks=1)
+    sampling.sample()
+
+    def other_stack():
+        sampling.sample()
+
+    other_stack()
+
+    stacks, _functions = sampling.snapshot()
+    assert len(stacks) == 2
+    assert (SITE, "/api/method/ping", (OTHER_FRAME,)) in stacks
+
+
+def test_collector_labels_series_with_the_pid(monkeypatch):
+    _sampled(monkeypatch).sample()
+
+    samples = [sample for family in ProfilerCollector().collect() for sample in family.samples]
+
+    assert {sample.name for sample in samples} >= {
+        "frappe_profiler_samples_total",
+        "frappe_profiler_function_self_samples_total",
+    }
+    assert {sample.labels["pid"] for sample in samples} == {str(os.getpid())}
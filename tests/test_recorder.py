@@ -0,0 +1,122 @@
+import pytest
+from prometheus_client import Counter, Gauge, Histogram, Summary
+
+from frappe_exporter import recorder
+from frappe_exporter.native_histogram import NativeHistogram
+from frappe_exporter.recorder import (
+    RequestAccumulator,
+    finish_request_accumulator,
+    flush_buffers,
+    get_recorder,
+    record_buffered,
+    record_direct,
+    start_request_accumulator,
+)
+from frappe_exporter.settings import SiteSettings
+
+
+def _sample(metric, name, **labels):
+    for family in metric.collect():
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value
+    return None
+
+
+def test_accumulator_matches_direct_recording():
+    direct = Histogram("test_direct", "Test", buckets=(0.1, 1.0), registry=None)
+    accumulated = Histogram("test_accumulated", "Test", buckets=(0.1, 1.0), registry=None)
+    values = (0.05, 0.1, 0.5, 2.0, 0.5)
+
+    accumulator = RequestAccumulator()
+    for value in values:
+        direct.observe(value)
+        accumulator.record(accumulated, "observe", value)
+    assert _sample(accumulated, "test_accumulated_count") == 0
+    accumulator.apply()
+
+    for le in ("0.1", "1.0", "+Inf"):
+        assert _sample(accumulated, "test_accumulated_bucket", le=le) == _sample(
+            direct, "test_direct_bucket", le=le
+        )
+    assert _sample(accumulated, "test_accumulated_sum") == _sample(direct, "test_direct_sum")
+
+
+def test_accumulator_sums_increments_and_keeps_set_ordering():
+    counter = Counter("test_acc_counter", "Test", registry=None)
+    gauge = Gauge("test_acc_gauge", "Test", registry=None)
+    accumulator = RequestAccumulator()
+
+    accumulator.record(counter, "inc", 1.0)
+    accumulator.record(counter, "inc", 2.0)
+    accumulator.record(gauge, "inc", 5.0)
+    accumulator.record(gauge, "set", 1.0)
+    accumulator.record(gauge, "inc", 2.0)
+    accumulator.apply()
+
+    assert counter._value.get() == 3.0
+    assert gauge._value.get() == 3.0
+
+
+def test_accumulator_applies_weighted_and_native_observations():
+    summary = Summary("test_acc_summary", "Test", registry=None)
+    native = NativeHistogram("test_acc_native", "Test", registry=None)
+    accumulator = RequestAccumulator()
+
+    accumulator.record(summary, "observe_weighted", (2.0, 10))
+    accumulator.record(native, "observe", 1.0)
+    accumulator.record(native, "observe_weighted", (1.0, 3))
+    accumulator.apply()
+
+    assert summary._count.get() == 10
+    assert summary._sum.get() == 20.0
+    assert native._count == 4
+
+
+def test_recorder_is_the_accumulator_inside_a_request():
+    settings = SiteSettings(values={"enabled": 1})
+    accumulator = start_request_accumulator()
+    try:
+        assert get_recorder(settings) == accumulator.record
+    finally:
+        assert finish_request_accumulator() is accumulator
+    assert get_recorder(settings) is record_direct
+    assert finish_request_accumulator() is None
+
+
+def test_negative_counter_increments_are_rejected_when_recorded():
+    counter = Counter("test_acc_negative", "Test", registry=None)
+    gauge = Gauge("test_acc_negative_gauge", "Test", registry=None)
+    accumulator = RequestAccumulator()
+
+    accumulator.record(counter, "inc", 10.0)
+    with pytest.raises(ValueError):
+        accumulator.record(counter, "inc", -5.0)
+    with pytest.raises(ValueError):
+        record_buffered(counter, "inc", -5.0)
+    accumulator.record(gauge, "inc", -5.0)
+    accumulator.apply()
+
+    assert counter._value.get() == 10.0
+    assert gauge._value.get() == -5.0
+
+
+def test_buffered_recording_applies_the_accumulator_through_the_flusher(monkeypatch):
+    monkeypatch.setattr(recorder, "_start_flusher", lambda: None)
+    counter = Counter("test_acc_buffered", "Test", registry=None)
+    histogram = Histogram("test_acc_buffered_seconds", "Test", buckets=(0.1, 1.0), registry=None)
+    native = NativeHistogram("test_acc_buffered_native", "Test", registry=None)
+
+    start_request_accumulator()
+    record = get_recorder(SiteSettings(values={"enabled": 1}))
+    record(counter, "inc", 2.0)
+    record(histogram, "observe", 0.5)
+    record(native, "observe", 0.5)
+    finish_request_accumulator(SiteSettings(values={"enabled": 1, "buffered_recording": 1}))
+
+    assert counter._value.get() == 0.0
+    assert _sample(histogram, "test_acc_buffered_seconds_count") == 0
+    assert flush_buffers() == 3
+    assert counter._value.get() == 2.0
+    assert _sample(histogram, "test_acc_buffered_seconds_bucket", le="1.0") == 1
+    assert native._count == 1
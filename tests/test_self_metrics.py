@@ -0,0 +1,15 @@
+import os
+
+from frappe_exporter.self_metrics import SelfMetricsCollector, record_scrape, thread_stats
+
+
+def test_every_series_names_the_process():
+    thread_stats().update_metric_calls += 1
+    record_scrape("text", 0.01, 100, 10)
+
+    families = list(SelfMetricsCollector().collect())
+
+    assert families
+    for family in families:
+        for sample in family.samples:
+            assert sample.labels["pid"] == str(os.getpid())
@@ -0,0 +1,114 @@
+import math
+import os
+import random
+
+import pytest
+
+from frappe_exporter.job_metrics import after_job, before_job
+from frappe_exporter.sketch import DDSketch, SketchSummary, _read_file, _sketch_path
+
+
+def _true_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(0, 2) for _ in range(20000)]
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.99):
+        expected = _true_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+
+
+def test_merge_equals_a_single_sketch():
+    rng = random.Random(3)
+    values = [rng.uniform(-5, 100) for _ in range(5000)] + [0.0] * 10
+    whole = DDSketch()
+    parts = [DDSketch() for _ in range(3)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 3].add(value)
+
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    assert merged.count == whole.count
+    assert merged.zero_count == whole.zero_count
+    assert merged.positive == whole.positive
+    assert merged.negative == whole.negative
+    assert math.isclose(merged.sum, whole.sum)
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    for q in (0.01, 0.5, 0.99):
+        assert merged.quantile(q) == whole.quantile(q)
+
+
+def test_merge_rejects_a_different_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.02))
+
+
+def test_bins_are_bounded():
+    sketch = DDSketch(max_bins=50)
+    for exponent in range(-200, 200):
+        sketch.add(10.0 ** (exponent / 10))
+    assert len(sketch.positive) <= 50
+    assert sketch.count == 400
+    # The highest quantiles keep their accuracy
+    assert math.isclose(sketch.quantile(1.0), 10.0**19.9, rel_tol=0.01)
+
+
+def test_dict_round_trip():
+    sketch = DDSketch()
+    for value in (-1.0, 0.0, 0.5, 3.0):
+        sketch.add(value, 2)
+    restored = DDSketch.from_dict(sketch.to_dict())
+    assert restored.to_dict() == sketch.to_dict()
+
+
+def test_summary_exports_quantiles_count_and_sum():
+    summary = SketchSummary("test_sketch_summary", "Test", ["site"], quantiles=(0.5,), registry=None)
+    child = summary.labels("bench.localhost")
+    child.observe_many([(1.0, 1), (2.0, 1), (3.0, 1)])
+
+    samples = {
+        (sample.name, sample.labels.get("quantile")): sample.value
+        for family in summary.collect()
+        for sample in family.samples
+    }
+    assert math.isclose(samples[("test_sketch_summary", "0.5")], 2.0, rel_tol=0.01)
+    assert samples[("test_sketch_summary_count", None)] == 3
+    assert samples[("test_sketch_summary_sum", None)] == 6.0
+
+
+def test_forked_job_persists_only_its_own_observations(multiprocess_dir):
+    summary = SketchSummary("test_sketch_fork", "Test", ["site"], registry=None)
+    child = summary.labels("bench.localhost")
+    for value in range(5):
+        child.observe(value)
+
+    pid = os.fork()
+    if pid == 0:
+        # Stands in for an RQ work horse, which leaves with os._exit
+        code = 1
+        try:
+            before_job(method="test.job")
+            child.observe(10.0)
+            after_job(method="test.job")
+            code = 0
+        finally:
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    dumped = {entry["name"]: entry for entry in _read_file(_sketch_path(multiprocess_dir, pid))}
+    (series,) = dumped["test_sketch_fork"]["series"]
+    assert series["sketch"]["count"] == 1
+    assert series["sketch"]["sum"] == 10.0
+    # The parent's own sketch is untouched
+    assert child.snapshot().count == 5
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from frappe_exporter.exposition import SiteView
+from frappe_exporter.slow_calls import (
+    SlowCallCollector,
+    SlowCallTracker,
+    get_list_signature,
+    query_signature,
+)
+
+
+class _Registry:
+    def __init__(self, collector):
+        self.collect = collector.collect
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        (
+            "select name from `tabSales Invoice` where customer = 'ACME' and grand_total > 100.5",
+            "select name from `tabSales Invoice` where customer = ? and grand_total > ?",
+        ),
+        ("select * from tabItem where name in ('a', 'b', 'c')", "select * from tabItem where name in (?)"),
+        ("select * from tabUser where name in (%s, %s)", "select * from tabUser where name in (?)"),
+        ("update tabNote set title='it''s' where idx=3", "update tabNote set title=? where idx=?"),
+        (r"select 'a\'b', 0x1f, 2e5 from t2fa", "select ?, ?, ? from t2fa"),
+        ('select "tabUser"."name" from "tabUser 2"', 'select "tabUser"."name" from "tabUser 2"'),
+        ("select\n  name\nfrom tabToDo  limit 20", "select name from tabToDo limit ?"),
+    ],
+)
+def test_query_signature_drops_literals(query, expected):
+    assert query_signature(query) == expected
+
+
+def test_queries_differing_in_values_share_a_signature():
+    signatures = {query_signature(f"select * from tabToDo where name = 'TODO-{n}'") for n in range(100)}
+    assert len(signatures) == 1
+
+
+def test_get_list_signature_keeps_fields_and_operators_only():
+    signature = get_list_signature(("ToDo",), {"fields": ["name"], "filters": {"status": ["=", "Open"]}})
+    assert signature == "fields: name | filters: status ="
+
+
+def test_tracker_keeps_the_slowest_signatures():
+    tracker = SlowCallTracker(capacity=2, min_duration=0.0)
+    tracker.observe("a.localhost", "sql", "tabToDo", "a", 0.1)
+    tracker.observe("a.localhost", "sql", "tabToDo", "b", 0.3)
+    tracker.observe("a.localhost", "sql", "tabToDo", "c", 0.05)
+    tracker.observe("a.localhost", "sql", "tabToDo", "d", 0.2)
+
+    assert [entry["signature"] for entry in tracker.top()] == ["b", "d"]
+    assert tracker.threshold == 0.2
+
+
+def test_collector_labels_series_with_the_pid():
+    tracker = SlowCallTracker(min_duration=0.0)
+    tracker.observe("a.localhost", "get_doc", "ToDo", "by name", 0.1)
+
+    samples = [sample for family in SlowCallCollector(tracker).collect() for sample in family.samples]
+
+    assert samples
+    assert {sample.labels["pid"] for sample in samples} == {str(os.getpid())}
+
+
+def test_entries_are_kept_and_exposed_per_site():
+    tracker = SlowCallTracker(min_duration=0.0)
+    tracker.observe("a.localhost", "db_select", "tabNote", "select ?", 0.1)
+    tracker.observe("b.localhost", "db_select", "tabNote", "select ?", 0.2)
+
+    assert [entry["max_duration"] for entry in tracker.top(site="a.localhost")] == [0.1]
+    assert len(tracker.top()) == 2
+
+    view = SiteView(_Registry(SlowCallCollector(tracker)), "a.localhost")
+    samples = [sample for family in view.collect() for sample in family.samples]
+    assert samples
+    assert {sample.labels["site"] for sample in samples} == {"a.localhost"}
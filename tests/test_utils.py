@@ -0,0 +1,70 @@
+import frappe
+import pytest
+
+from frappe_exporter import bind_metric, metrics_handler, update_metric
+from frappe_exporter.metrics_handler import get_custom_metric
+from frappe_exporter.recorder import finish_request_accumulator, start_request_accumulator
+
+SITE = frappe.local.site
+
+
+@pytest.fixture
+def invoices(configure):
+    row = {
+        "idx": 0,
+        "metric_name": "test_invoices",
+        "metric_type": "Counter",
+        "help_text": "Invoices",
+        "label_names": "customer",
+        "quantiles": "",
+    }
+    configure({"enabled": 1}, {"Prometheus Custom Metric": [row]})
+    return lambda customer: get_custom_metric("test_invoices").labels(SITE, customer)._value.get()
+
+
+def test_update_metric(invoices):
+    update_metric("test_invoices", 2, labels={"customer": "ACME"})
+    assert invoices("ACME") == 2
+
+
+def test_bound_metric_outlives_the_request_it_was_bound_in(invoices):
+    start_request_accumulator()
+    handle = bind_metric("test_invoices", customer="Globex")
+    handle.inc()
+    finish_request_accumulator()
+
+    handle.inc(2)
+
+    assert invoices("Globex") == 3
+
+
+def test_bound_metric_logs_errors_instead_of_raising(invoices):
+    handle = bind_metric("test_invoices", customer="Initech")
+    # Counters reject negative increments
+    handle.inc(-1)
+    handle.inc()
+
+    assert invoices("Initech") == 1
+
+
+def test_bound_metric_re_resolves_against_its_own_site(invoices, monkeypatch):
+    handle = bind_metric("test_invoices", customer="Umbrella")
+    # As if another site had reloaded its custom metrics
+    generation = metrics_handler.custom_metrics_generation + 1
+    monkeypatch.setattr(metrics_handler, "custom_metrics_generation", generation)
+    monkeypatch.setattr(frappe.local, "site", "other.localhost")
+
+    handle.inc()
+
+    monkeypatch.setattr(frappe.local, "site", SITE)
+    assert invoices("Umbrella") == 1
+
+
+def test_update_outside_a_site_is_skipped_quietly(invoices, monkeypatch, caplog):
+    monkeypatch.delattr(frappe.local, "site", raising=False)
+    monkeypatch.delattr(type(frappe.local), "site")
+
+    with caplog.at_level("DEBUG", logger="frappe_exporter.utils"):
+        update_metric("test_invoices", 1, labels={"customer": "Hooli"})
+
+    assert [record.levelname for record in caplog.records] == ["DEBUG"]